@@ -1,62 +1,76 @@
 import pandas as pd
 import numpy as np
-import scipy.stats as stats
-import seaborn as sns
-import matplotlib.pyplot as plt
 import os
-from dotenv import load_dotenv
 import logging
+from combined_storage import read_combined
+from data_quality import session_starts_ns
+from metrics_engine import daily_metrics_frame
+from ohlc_cube import RESOLUTIONS, cube_metrics_frame, read_cube
+from phase_tagging import NS_PER_MINUTE
+from plot_rendering import grouped_box_statistics, render_figures
+from profiling import profiler
+from resampling import resampling_tests
+from settings import settings
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logging.info("Iniciando análisis estadístico de fases lunares...")
-
-# Cargar variables de entorno
-load_dotenv()
-PRE_PANDEMIC_END = os.getenv('PRE_PANDEMIC_END', '2020-03-01')
-PANDEMIC_END = os.getenv('PANDEMIC_END', '2021-12-31')
-
-# Convertir fechas a datetime
-try:
-    pre_pandemic_end = pd.to_datetime(PRE_PANDEMIC_END).tz_localize('UTC')
-    pandemic_end = pd.to_datetime(PANDEMIC_END).tz_localize('UTC')
-except ValueError as e:
-    logging.error(f"Error en el formato de fechas en .env: {e}")
-    raise
-
-def load_data():
-    """Carga los datos combinados."""
-    input_path = 'data/processed/combined_data.csv'
-    if not os.path.exists(input_path):
-        logging.error(f"Archivo no encontrado: {input_path}")
-        raise FileNotFoundError(f"Archivo no encontrado: {input_path}")
-    df = pd.read_csv(input_path, parse_dates=['timestamp'])
-    logging.info(f"Datos cargados desde {input_path}")
+
+# Columnas del dataset combinado que usa el análisis
+ANALYSIS_COLUMNS = ['timestamp', 'high', 'low', 'close', 'lunar_phase', 'period']
+
+@profiler.profile('load_data', rows=len, memory=True)
+def load_data(columns=ANALYSIS_COLUMNS, periods=None, years=None, input_dir='data/processed', resolution=None):
+    """Carga los datos combinados (sólo las columnas, períodos y años pedidos).
+
+    Los datos M1 se mantienen en el esquema compacto (precios int32
+    escalados). Con resolution (M5, M15, H1, H4 o D1) carga las barras
+    precalculadas del cubo OHLC en lugar de los datos M1. df.attrs['source_dir']
+    indica dónde buscar el índice de sesiones.
+    """
+    if resolution is not None:
+        return read_cube(input_dir, resolution, periods=periods, years=years)
+    df = read_combined(input_dir, columns=columns, periods=periods, years=years, compact=True)
+    df.attrs['source_dir'] = input_dir
     return df
 
-def calculate_metrics(df):
-    """Calcula retornos, volatilidad y rango diario."""
-    # Calcular retornos logarítmicos
-    df['return'] = np.log(df['close'] / df['close'].shift(1))
-    
-    # Agrupar por día, fase lunar y período
-    df['date'] = df['timestamp'].dt.date
-    daily_metrics = df.groupby(['date', 'lunar_phase', 'period']).agg({
-        'return': ['mean', 'std'],
-        'high': 'max',
-        'low': 'min',
-        'timestamp': 'count'
-    }).reset_index()
-    
-    # Renombrar columnas
-    daily_metrics.columns = ['date', 'lunar_phase', 'period', 'mean_return', 'volatility', 'high', 'low', 'count']
-    daily_metrics['range'] = daily_metrics['high'] - daily_metrics['low']
-    
-    return daily_metrics
+def calculate_metrics(df, gap_minutes=None, resolution=None):
+    """Calcula retornos, volatilidad, rango, retorno absoluto medio y varianza realizada diarios.
+
+    Agrupa por día, fase lunar y período con reducciones sobre arrays ordenados;
+    con gap_minutes > 0 los retornos que cruzan un hueco mayor (fines de semana,
+    datos faltantes) se descartan. Por defecto usa RETURN_GAP_MINUTES. Con
+    RESET_RETURNS_AT_SESSIONS también se descarta el primer retorno de cada
+    sesión del índice que guarda la combinación.
 
-def descriptive_statistics(daily_metrics):
+    resolution (M5, M15, H1, H4, D1) sustituye el día por ese intervalo. df
+    puede ser M1 o barras del cubo (load_data con resolution); en ese caso las
+    métricas se agregan desde las barras sin volver a M1 y, por defecto, se
+    usa la resolución de las barras. Sus retornos son los del cubo, que
+    read_cube reconstruye si cambian RETURN_GAP_MINUTES o
+    RESET_RETURNS_AT_SESSIONS; gap_minutes no se aplica.
+    """
+    gap_minutes = settings.RETURN_GAP_MINUTES if gap_minutes is None else gap_minutes
+    gap_ns = int(gap_minutes * NS_PER_MINUTE) if gap_minutes > 0 else None
+    from_cube = 'return_count' in df.columns
+    resolution = resolution or (df.attrs.get('resolution', 'D1') if from_cube else 'D1')
+    if resolution not in RESOLUTIONS:
+        logging.error(f"Resolución desconocida: {resolution}. Disponibles: {', '.join(RESOLUTIONS)}")
+        raise ValueError(f"Resolución desconocida: {resolution}")
+    with profiler.stage('daily_metrics') as step:
+        step.rows = len(df)
+        if not from_cube:
+            starts = session_starts_ns(df.attrs.get('source_dir', 'data/processed')) if settings.RESET_RETURNS_AT_SESSIONS else None
+            return daily_metrics_frame(df, bucket_ns=RESOLUTIONS[resolution], gap_ns=gap_ns, session_starts_ns=starts)
+        bar_resolution = df.attrs.get('resolution')
+        if bar_resolution is not None and RESOLUTIONS[resolution] % RESOLUTIONS[bar_resolution] != 0:
+            logging.error(f"No se pueden calcular métricas {resolution} desde barras {bar_resolution}")
+            raise ValueError(f"Resolución {resolution} incompatible con barras {bar_resolution}")
+        return cube_metrics_frame(df, RESOLUTIONS[resolution])
+
+@profiler.profile('descriptive_statistics')
+def descriptive_statistics(daily_metrics, output_dir='data/processed'):
     """Calcula estadísticas descriptivas por fase lunar y período."""
-    stats_df = daily_metrics.groupby(['lunar_phase', 'period']).agg({
+    stats_df = daily_metrics.groupby(['lunar_phase', 'period'], observed=True).agg({
         'mean_return': ['mean', 'median', 'std', lambda x: np.percentile(x.dropna(), 25), lambda x: np.percentile(x.dropna(), 75)],
         'volatility': ['mean'],
         'count': 'sum'
@@ -64,113 +78,158 @@ def descriptive_statistics(daily_metrics):
     
     stats_df.columns = ['lunar_phase', 'period', 'mean_return', 'median_return', 'std_return', 'return_p25', 'return_p75', 'mean_volatility', 'count_days']
     
-    output_dir = 'data/processed'
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, 'statistics_by_phase_period.csv')
     stats_df.to_csv(output_path, index=False)
     logging.info(f"Estadísticas descriptivas guardadas en {output_path}")
     return stats_df
 
-def statistical_tests(daily_metrics):
-    """Realiza pruebas ANOVA de Welch y Kruskal-Wallis."""
-    test_results = []
+def split_groups(values, codes):
+    """Agrupa values por código con una sola ordenación (en lugar de un filtro booleano por fase)."""
+    order = np.argsort(codes, kind='stable')
+    return np.split(values[order], np.flatnonzero(np.diff(codes[order])) + 1)
+
+@profiler.profile('statistical_tests')
+def statistical_tests(daily_metrics, output_dir='data/processed', n_permutations=None, n_bootstrap=None, workers=None):
+    """Realiza pruebas ANOVA de Welch, Kruskal-Wallis y de permutación.
+
+    La prueba de permutación compara la suma de cuadrados entre fases con la de
+    N_PERMUTATIONS reordenaciones de las etiquetas; ci_low/ci_high son el
+    intervalo bootstrap por bloques de días de eta² (effect_size), repartidos
+    entre `workers` procesos (RESAMPLING_WORKERS por defecto).
+    """
+    import scipy.stats as stats
+
+    n_permutations = settings.N_PERMUTATIONS if n_permutations is None else n_permutations
+    n_bootstrap = settings.N_BOOTSTRAP if n_bootstrap is None else n_bootstrap
     metrics = ['mean_return', 'volatility']
-    
+    phase_codes = pd.Categorical(daily_metrics['lunar_phase']).codes
+    periods = daily_metrics['period'].to_numpy()
+    dates = daily_metrics['date'].to_numpy()
+
+    # Índices de grupo por (período, métrica), calculados una vez para todas las pruebas
+    samples = {}
     for period in daily_metrics['period'].unique():
-        period_data = daily_metrics[daily_metrics['period'] == period]
+        rows = np.flatnonzero(periods == period)
         for metric in metrics:
-            # Agrupar datos por fase lunar
-            groups = [period_data[period_data['lunar_phase'] == phase][metric].dropna() 
-                      for phase in period_data['lunar_phase'].unique()]
-            
-            # ANOVA de Welch
-            try:
-                f_stat, p_value = stats.f_oneway(*groups)
-                test_results.append({
-                    'metric': metric,
-                    'period': period,
-                    'test': 'ANOVA_Welch',
-                    'p_value': p_value,
-                    'significant': p_value < 0.05
-                })
-            except Exception as e:
-                logging.warning(f"Error en ANOVA para {metric} en {period}: {e}")
-            
-            # Kruskal-Wallis
-            try:
-                stat, p_value = stats.kruskal(*groups)
-                test_results.append({
-                    'metric': metric,
-                    'period': period,
-                    'test': 'Kruskal-Wallis',
-                    'p_value': p_value,
-                    'significant': p_value < 0.05
-                })
-            except Exception as e:
-                logging.warning(f"Error en Kruskal-Wallis para {metric} en {period}: {e}")
-    
+            values = daily_metrics[metric].to_numpy()[rows]
+            valid = ~np.isnan(values)
+            day_index = np.unique(dates[rows][valid], return_inverse=True)[1]
+            samples[(period, metric)] = (values[valid], phase_codes[rows][valid], day_index)
+    with profiler.stage('resampling'):
+        resampled = resampling_tests(samples, n_permutations, n_bootstrap, workers=workers) if n_permutations > 0 or n_bootstrap > 0 else {}
+
+    test_results = []
+    for (period, metric), (values, codes, _) in samples.items():
+        groups = split_groups(values, codes)
+
+        # ANOVA de Welch
+        try:
+            f_stat, p_value = stats.f_oneway(*groups)
+            test_results.append({
+                'metric': metric,
+                'period': period,
+                'test': 'ANOVA_Welch',
+                'p_value': p_value,
+                'significant': p_value < 0.05
+            })
+        except Exception as e:
+            logging.warning(f"Error en ANOVA para {metric} en {period}: {e}")
+
+        # Kruskal-Wallis
+        try:
+            stat, p_value = stats.kruskal(*groups)
+            test_results.append({
+                'metric': metric,
+                'period': period,
+                'test': 'Kruskal-Wallis',
+                'p_value': p_value,
+                'significant': p_value < 0.05
+            })
+        except Exception as e:
+            logging.warning(f"Error en Kruskal-Wallis para {metric} en {period}: {e}")
+
+        # Permutación de etiquetas de fase con IC bootstrap de eta²
+        result = resampled.get((period, metric))
+        if result is not None and not np.isnan(result['effect_size']):
+            test_results.append({
+                'metric': metric,
+                'period': period,
+                'test': 'Permutation',
+                'p_value': result['p_value'],
+                'significant': result['p_value'] < 0.05,
+                'effect_size': result['effect_size'],
+                'ci_low': result['ci_low'],
+                'ci_high': result['ci_high']
+            })
+
     test_df = pd.DataFrame(test_results)
-    output_path = 'data/processed/statistical_tests.csv'
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, 'statistical_tests.csv')
     test_df.to_csv(output_path, index=False)
     logging.info(f"Resultados de pruebas estadísticas guardados en {output_path}")
     return test_df
 
-def generate_boxplots(daily_metrics):
-    """Genera boxplots para retornos y volatilidad."""
-    output_dir = 'data/processed/plots'
-    os.makedirs(output_dir, exist_ok=True)
-    
-    sns.set_style("whitegrid")
-    palette = sns.color_palette("deep", 8)
-    
+@profiler.profile('boxplots')
+def generate_boxplots(daily_metrics, output_dir='data/processed/plots', workers=None):
+    """Genera boxplots para retornos y volatilidad.
+
+    Las cajas se construyen a partir de cuartiles precalculados y las figuras se
+    dibujan en paralelo; sólo se regeneran las que cambiaron desde la última
+    ejecución (ver plot_rendering).
+    """
+    specs = []
+    with profiler.stage('box_statistics') as step:
+        box_stats = {metric: grouped_box_statistics(daily_metrics, metric) for metric in ['mean_return', 'volatility']}
+        step.rows = len(daily_metrics)
     for period in daily_metrics['period'].unique():
-        period_data = daily_metrics[daily_metrics['period'] == period]
-        
         # Boxplot para retornos
-        plt.figure(figsize=(12, 6))
-        sns.boxplot(x='lunar_phase', y='mean_return', data=period_data, palette=palette)
-        plt.title(f'Retornos por Fase Lunar - {period.capitalize()}')
-        plt.xlabel('Fase Lunar')
-        plt.ylabel('Retorno Logarítmico Medio Diario')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'returns_boxplot_{period}.png'))
-        plt.close()
-        
+        specs.append({
+            'kind': 'box',
+            'filename': f'returns_boxplot_{period}.png',
+            'boxes': box_stats['mean_return'].get(period, []),
+            'title': f'Retornos por Fase Lunar - {period.capitalize()}',
+            'xlabel': 'Fase Lunar',
+            'ylabel': 'Retorno Logarítmico Medio Diario'
+        })
+
         # Boxplot para volatilidad
-        plt.figure(figsize=(12, 6))
-        sns.boxplot(x='lunar_phase', y='volatility', data=period_data, palette=palette)
-        plt.title(f'Volatilidad por Fase Lunar - {period.capitalize()}')
-        plt.xlabel('Fase Lunar')
-        plt.ylabel('Volatilidad (Desviación Estándar Diaria)')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'volatility_boxplot_{period}.png'))
-        plt.close()
-    
+        specs.append({
+            'kind': 'box',
+            'filename': f'volatility_boxplot_{period}.png',
+            'boxes': box_stats['volatility'].get(period, []),
+            'title': f'Volatilidad por Fase Lunar - {period.capitalize()}',
+            'xlabel': 'Fase Lunar',
+            'ylabel': 'Volatilidad (Desviación Estándar Diaria)'
+        })
+
     # Gráfico de líneas para tendencia de retornos
-    trend_data = daily_metrics.groupby(['lunar_phase', 'period'])['mean_return'].mean().unstack()
-    plt.figure(figsize=(12, 6))
-    for period in trend_data.columns:
-        plt.plot(trend_data.index, trend_data[period], marker='o', label=period.capitalize())
-    plt.title('Tendencia de Retornos Medios por Fase Lunar')
-    plt.xlabel('Fase Lunar')
-    plt.ylabel('Retorno Logarítmico Medio')
-    plt.legend()
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, 'mean_returns_trend.png'))
-    plt.close()
-    
+    trend_data = daily_metrics.groupby(['lunar_phase', 'period'], observed=True)['mean_return'].mean().unstack()
+    specs.append({
+        'kind': 'line',
+        'filename': 'mean_returns_trend.png',
+        'x': [str(phase) for phase in trend_data.index],
+        'series': {str(period).capitalize(): trend_data[period].tolist() for period in trend_data.columns},
+        'title': 'Tendencia de Retornos Medios por Fase Lunar',
+        'xlabel': 'Fase Lunar',
+        'ylabel': 'Retorno Logarítmico Medio'
+    })
+
+    with profiler.stage('render'):
+        render_figures(specs, output_dir, workers)
     logging.info(f"Gráficos guardados en {output_dir}")
 
 def main():
     """Función principal."""
-    df = load_data()
+    logging.info("Iniciando análisis estadístico de fases lunares...")
+    # Con ANALYSIS_RESOLUTION el análisis usa barras del cubo; salvo D1, los resultados van a data/processed/<resolución>/
+    resolution = settings.ANALYSIS_RESOLUTION or None
+    output_dir = 'data/processed' if resolution in (None, 'D1') else os.path.join('data/processed', resolution)
+    df = load_data(resolution=resolution)
     daily_metrics = calculate_metrics(df)
-    stats_df = descriptive_statistics(daily_metrics)
-    test_df = statistical_tests(daily_metrics)
-    generate_boxplots(daily_metrics)
+    stats_df = descriptive_statistics(daily_metrics, output_dir)
+    test_df = statistical_tests(daily_metrics, output_dir)
+    generate_boxplots(daily_metrics, os.path.join(output_dir, 'plots'))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
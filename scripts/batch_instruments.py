@@ -0,0 +1,94 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import calculate_lunar_phases as phases
+import analyze_lunar_phases as analysis
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def instrument_symbol(financial_path):
+    """Obtiene el símbolo del instrumento a partir del nombre del archivo (eur_usd_m1.csv -> eur_usd_m1)."""
+    return os.path.splitext(os.path.basename(financial_path))[0]
+
+def find_instruments(paths):
+    """Devuelve la lista de CSVs a procesar: los indicados, BATCH_INSTRUMENTS o todos los de FINANCIAL_DATA_PATH."""
+    if not paths and settings.BATCH_INSTRUMENTS:
+        paths = [path.strip() for path in settings.BATCH_INSTRUMENTS.split(',')]
+    if not paths:
+        paths = [os.path.join(settings.FINANCIAL_DATA_PATH, '*.csv')]
+    files = sorted({file for path in paths for file in glob.glob(path)})
+    if not files:
+        logging.error(f"No se encontraron archivos de instrumentos en {paths}")
+        raise FileNotFoundError(f"No se encontraron archivos de instrumentos en {paths}")
+    return files
+
+def process_instrument(financial_path, df_phases, output_root, nested_workers=1):
+    """Combina, analiza y grafica un instrumento en su propio directorio de salida.
+
+    El remuestreo y los gráficos usan nested_workers procesos en lugar de
+    RESAMPLING_WORKERS y PLOT_WORKERS, que ya cuentan las CPUs de la máquina.
+    """
+    symbol = instrument_symbol(financial_path)
+    output_dir = os.path.join(output_root, symbol)
+    logging.info(f"[{symbol}] Procesando {financial_path}")
+    phases.combine_financial_data(financial_path, output_dir, df_phases)
+    df = analysis.load_data(input_dir=output_dir)
+    daily_metrics = analysis.calculate_metrics(df)
+    stats_df = analysis.descriptive_statistics(daily_metrics, output_dir)
+    analysis.statistical_tests(daily_metrics, output_dir, workers=nested_workers)
+    analysis.generate_boxplots(daily_metrics, os.path.join(output_dir, 'plots'), nested_workers)
+    logging.info(f"[{symbol}] Resultados guardados en {output_dir}")
+    return stats_df.assign(symbol=symbol)
+
+def run_batch(financial_paths, workers=None, output_root=None):
+    """Procesa varios instrumentos en paralelo con una única tabla de fases (BATCH_WORKERS procesos y BATCH_OUTPUT_DIR por defecto).
+
+    Las CPUs se reparten entre los instrumentos en curso: cada uno remuestrea
+    y dibuja con cpu_count // procesos, al menos uno (no cpu_count² procesos).
+    """
+    workers = settings.BATCH_WORKERS if workers is None else workers
+    output_root = settings.BATCH_OUTPUT_DIR if output_root is None else output_root
+    workers = max(1, min(workers, len(financial_paths)))
+    nested_workers = max(1, (os.cpu_count() or 1) // workers)
+    df_phases = phases.generate_lunar_phase_changes()
+    results = {}
+    failed = []
+    logging.info(f"Procesando {len(financial_paths)} instrumentos con {workers} procesos ({nested_workers} por instrumento para remuestreo y gráficos)")
+    # spawn: los procesos no heredan los archivos de efemérides abiertos al calcular la tabla de fases
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(process_instrument, path, df_phases, output_root, nested_workers): path for path in financial_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                logging.error(f"Error procesando {path}: {e}")
+                failed.append(path)
+
+    if results:
+        # Tabla conjunta en el orden de entrada, con el símbolo como primera columna
+        combined = pd.concat([results[path] for path in financial_paths if path in results], ignore_index=True)
+        combined = combined[['symbol'] + [col for col in combined.columns if col != 'symbol']]
+        output_path = os.path.join(output_root, 'statistics_by_instrument.csv')
+        combined.to_csv(output_path, index=False)
+        logging.info(f"Estadísticas de todos los instrumentos guardadas en {output_path}")
+    if failed:
+        raise RuntimeError(f"Fallaron {len(failed)} instrumentos: {', '.join(failed)}")
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Procesa varios instrumentos en paralelo con una tabla de fases compartida.")
+    parser.add_argument('instruments', nargs='*', help="CSVs o patrones glob de instrumentos (por defecto BATCH_INSTRUMENTS o FINANCIAL_DATA_PATH/*.csv)")
+    parser.add_argument('--workers', type=int, help="Número de procesos (BATCH_WORKERS)")
+    parser.add_argument('--output-dir', help="Directorio raíz de salida (BATCH_OUTPUT_DIR)")
+    args = parser.parse_args()
+    run_batch(find_instruments(args.instruments), args.workers, args.output_dir)
+
+if __name__ == "__main__":
+    main()
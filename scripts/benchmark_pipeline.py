@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASELINE_PATH = 'benchmarks/pipeline_baseline.json'
+BENCHMARK_DATA_DIR = 'data/benchmark'
+DEFAULT_SIZES = ['1m', '1y', '5y']
+# Los datos terminan siempre en la misma fecha: los tamaños grandes cubren los tres períodos
+BENCHMARK_END = '2024-01-01'
+BENCHMARK_TIMEZONE = 'Europe/Berlin'
+# Configuración fija para que los resultados sólo dependan del código (tiene prioridad sobre .env)
+BENCHMARK_ENV = {
+    'FINANCIAL_DATA_TIMEZONE': BENCHMARK_TIMEZONE,
+    'PERIOD_CUTS': '2020-03-01,2022-01-01',
+    'PERIOD_LABELS': 'pre-pandemia,pandemia,pos-pandemia',
+    'PHASE_TOLERANCE_SECONDS': '60',
+    'RETURN_GAP_MINUTES': '0'
+}
+# Tolerancia relativa al comparar resultados numéricos con la línea base
+RESULT_RTOL = 1e-9
+# Etapas más rápidas que esto en la línea base no se comparan en tiempo (dominadas por el ruido)
+MIN_COMPARED_SECONDS = 0.05
+
+def configure_environment(sizes, end=BENCHMARK_END):
+    """Fija el rango de fechas y la configuración del benchmark antes de que settings lea .env."""
+    from generate_synthetic_data import parse_span
+    end = pd.Timestamp(end)
+    first = min(end - parse_span(size) for size in sizes)
+    os.environ.update(BENCHMARK_ENV)
+    os.environ['START_DATE'] = (first - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    os.environ['END_DATE'] = end.strftime('%Y-%m-%d')
+
+def best_time(func, repeat, setup=None):
+    """Mejor tiempo de repeat ejecuciones de func(setup()) y el último resultado."""
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        result = func(argument) if setup else func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def benchmark_size(size, data_dir, work_dir, repeat, n_permutations, n_bootstrap, seed=0):
+    """Mide cada etapa con los datos sintéticos de un tamaño; devuelve tiempos y resumen de resultados."""
+    import analyze_lunar_phases as analysis
+    import calculate_lunar_phases as phases
+    from generate_synthetic_data import generate_m1, parse_span
+    from phase_tagging import phase_boundaries
+
+    end = pd.Timestamp(BENCHMARK_END, tz='UTC')
+    start = end - parse_span(size)
+    csv_path = os.path.join(data_dir, f'm1_{size}_seed{seed}.csv')
+    if not os.path.exists(csv_path):
+        generate_m1(csv_path, start.tz_localize(None), end.tz_localize(None), BENCHMARK_TIMEZONE, seed)
+
+    timings = {}
+    timings['phases'], df_phases = best_time(lambda: phases.compute_phase_changes(start.to_pydatetime(), end.to_pydatetime()), repeat)
+    boundaries_ns, boundary_codes = phase_boundaries(df_phases, phases.PHASE_NAMES_ES)
+    timings['ingest'], raw = best_time(lambda: pd.read_csv(csv_path, **phases.financial_csv_options(csv_path)), repeat)
+
+    def cold_interpolator():
+        # Cada repetición parte sin coeficientes de elongación en caché
+        phases._lunar_elongation = None
+    timings['tag'], combined = best_time(lambda _: phases.prepare_financial_data(raw, boundaries_ns, boundary_codes),
+                                         repeat, setup=cold_interpolator)
+    timings['metrics'], daily = best_time(lambda: analysis.calculate_metrics(combined), repeat)
+    timings['tests'], tests = best_time(lambda: analysis.statistical_tests(daily, work_dir, n_permutations, n_bootstrap), repeat)
+
+    def fresh_plot_dir():
+        # Sin huellas previas: todas las figuras se dibujan
+        plot_dir = os.path.join(work_dir, 'plots')
+        shutil.rmtree(plot_dir, ignore_errors=True)
+        return plot_dir
+    timings['plots'], _ = best_time(lambda plot_dir: analysis.generate_boxplots(daily, plot_dir), repeat, setup=fresh_plot_dir)
+
+    results = {
+        'phase_changes': len(df_phases),
+        'bars': len(raw),
+        'tagged_bars': int(combined['lunar_phase'].notna().sum()),
+        'lunar_angle_mean': float(combined['lunar_angle'].mean()),
+        'daily_rows': len(daily),
+        'mean_return_sum': float(daily['mean_return'].sum()),
+        'volatility_sum': float(daily['volatility'].sum()),
+        'p_values': [float(p) for p in tests['p_value']],
+        'plots': len([name for name in os.listdir(os.path.join(work_dir, 'plots')) if name.endswith('.png')])
+    }
+    rows_per_stage = {'ingest': len(raw), 'tag': len(raw), 'metrics': len(combined)}
+    stages = {stage: {'seconds': round(seconds, 4),
+                      'rows_per_s': round(rows_per_stage[stage] / seconds) if stage in rows_per_stage and seconds > 0 else None}
+              for stage, seconds in timings.items()}
+    return {'bars': len(raw), 'stages': stages, 'results': results}
+
+def compare_results(expected, actual):
+    """Lista de diferencias entre dos resúmenes de resultados."""
+    differences = []
+    for key, value in expected.items():
+        current = actual.get(key)
+        if isinstance(value, float) or (isinstance(value, list) and value and isinstance(value[0], float)):
+            same = current is not None and np.shape(value) == np.shape(current) and np.allclose(value, current, rtol=RESULT_RTOL, atol=0, equal_nan=True)
+        else:
+            same = value == current
+        if not same:
+            differences.append(f"{key}: línea base {value}, actual {current}")
+    return differences
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Compara resultados (deben coincidir) y tiempos (no más de tolerance veces la línea base); devuelve los problemas."""
+    problems = []
+    if baseline['config'] != report['config']:
+        logging.warning(f"La configuración difiere de la línea base ({baseline['config']}); sólo se comparan los tamaños comunes")
+    for size, current in report['sizes'].items():
+        reference = baseline['sizes'].get(size)
+        if reference is None:
+            logging.info(f"{size}: sin línea base")
+            continue
+        for difference in compare_results(reference['results'], current['results']):
+            problems.append(f"{size}: resultado distinto en {difference}")
+        for stage, info in current['stages'].items():
+            base_seconds = reference['stages'].get(stage, {}).get('seconds')
+            if not base_seconds or base_seconds < MIN_COMPARED_SECONDS:
+                continue
+            ratio = info['seconds'] / base_seconds
+            message = f"{size}/{stage}: {info['seconds']:.3f} s frente a {base_seconds:.3f} s (x{ratio:.2f})"
+            if ratio > tolerance:
+                problems.append(f"regresión en {message}")
+            else:
+                logging.info(message)
+    return problems
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, n_permutations=None, n_bootstrap=None, data_dir=BENCHMARK_DATA_DIR, seed=0):
+    """Ejecuta el benchmark para cada tamaño y devuelve el informe (configuración, entorno y resultados)."""
+    configure_environment(sizes)
+    from settings import settings
+    n_permutations = settings.N_PERMUTATIONS if n_permutations is None else n_permutations
+    n_bootstrap = settings.N_BOOTSTRAP if n_bootstrap is None else n_bootstrap
+    os.makedirs(data_dir, exist_ok=True)
+
+    report = {
+        'config': {'seed': seed, 'end': BENCHMARK_END, 'timezone': BENCHMARK_TIMEZONE,
+                   'n_permutations': n_permutations, 'n_bootstrap': n_bootstrap},
+        'repeat': repeat,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                        'numpy': np.__version__, 'pandas': pd.__version__},
+        'sizes': {}
+    }
+    root_logger = logging.getLogger()
+    for size in sizes:
+        work_dir = tempfile.mkdtemp(prefix=f'benchmark_{size}_')
+        level = root_logger.level
+        # Los mensajes por cambio de fase y por archivo ocultarían el resumen
+        root_logger.setLevel(logging.WARNING)
+        try:
+            report['sizes'][size] = benchmark_size(size, data_dir, work_dir, repeat, n_permutations, n_bootstrap, seed)
+        finally:
+            root_logger.setLevel(level)
+            shutil.rmtree(work_dir, ignore_errors=True)
+        stages = report['sizes'][size]['stages']
+        logging.info(f"{size}: {report['sizes'][size]['bars']} barras | " + ' | '.join(f"{stage} {info['seconds']:.3f} s" for stage, info in stages.items()))
+    return report
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Benchmark de las etapas del pipeline con datos M1 sintéticos frente a una línea base.")
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help=f"Duraciones de los datos (por defecto {' '.join(DEFAULT_SIZES)}; p. ej. 20y)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--permutations', type=int, default=None, help="Permutaciones de statistical_tests (por defecto N_PERMUTATIONS)")
+    parser.add_argument('--bootstrap', type=int, default=None, help="Réplicas bootstrap (por defecto N_BOOTSTRAP)")
+    parser.add_argument('--data-dir', default=BENCHMARK_DATA_DIR, help="Directorio de los CSV sintéticos (se reutilizan entre ejecuciones)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=1.5, help="Cociente máximo de tiempo frente a la línea base")
+    parser.add_argument('--save-baseline', action='store_true', help="Guarda los resultados como nueva línea base")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.repeat, args.permutations, args.bootstrap, args.data_dir)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        logging.info(f"Línea base guardada en {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        logging.warning(f"No hay línea base en {args.baseline}; use --save-baseline para crearla")
+        return
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    problems = compare_with_baseline(report, baseline, args.tolerance)
+    for problem in problems:
+        logging.error(problem)
+    if problems:
+        sys.exit(1)
+    logging.info("Resultados idénticos a la línea base y tiempos dentro de la tolerancia")
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,24 @@
 import swisseph as swe
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta, timezone
+import hashlib
+import itertools
+import glob
+import json
 import logging
+import math
 import os
-from dotenv import load_dotenv
+from combined_storage import CombinedWriter
+from data_quality import QualityScan, save_quality
+from lunar_ephemeris import LunarElongation
+from phase_tagging import codes_to_labels, phase_boundaries, tag_intervals, tag_periods, to_epoch_ns
+from profiling import profiler
+from settings import settings
 import pytz
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logging.info("Iniciando script de cálculo de fases lunares...")
-
-# Cargar variables de entorno desde .env
-load_dotenv()
-EPHE_PATH = os.getenv('EPHE_PATH', 'data/lunar_data/swisseph_dll')
-DLL_PATH = os.path.abspath(os.getenv('DLL_PATH', 'data/lunar_data/swisseph_dll')) # Modificado por Cline
-START_DATE = os.getenv('START_DATE', '2018-01-01')
-END_DATE = os.getenv('END_DATE', '2024-12-31')
-FINANCIAL_DATA_TIMEZONE = os.getenv('FINANCIAL_DATA_TIMEZONE', 'UTC')
-PRE_PANDEMIC_END = os.getenv('PRE_PANDEMIC_END', '2020-03-01')
-PANDEMIC_END = os.getenv('PANDEMIC_END', '2021-12-31')
-FINANCIAL_CSV = os.getenv('FINANCIAL_CSV', 'eur_usd_m1.csv')
-FINANCIAL_DATA_PATH = os.getenv('FINANCIAL_DATA_PATH', 'data/financial_data')
-
-# Convertir fechas a objetos datetime en UTC
-try:
-    start_date = datetime.strptime(START_DATE, '%Y-%m-%d').replace(tzinfo=timezone.utc, hour=0, minute=0, second=0, microsecond=0)
-    end_date = datetime.strptime(END_DATE, '%Y-%m-%d').replace(tzinfo=timezone.utc, hour=0, minute=0, second=0, microsecond=0)
-    pre_pandemic_end = datetime.strptime(PRE_PANDEMIC_END, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-    pandemic_end = datetime.strptime(PANDEMIC_END, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-except ValueError as e:
-    logging.error(f"Error en el formato de las fechas en .env: {e}")
-    raise
-
-# Verificar y configurar rutas de Swiss Ephemeris
-if not os.path.exists(EPHE_PATH):
-    logging.error(f"Directorio de efemérides no encontrado: {EPHE_PATH}")
-    raise FileNotFoundError(f"Directorio de efemérides no encontrado: {EPHE_PATH}")
-if not os.path.exists(DLL_PATH):
-    logging.error(f"Directorio de DLL no encontrado: {DLL_PATH}")
-    raise FileNotFoundError(f"Directorio de DLL no encontrado: {DLL_PATH}")
-swe.set_ephe_path(EPHE_PATH)
-if os.name == 'nt':  # Windows
-    os.add_dll_directory(DLL_PATH)
-logging.info(f"Rutas de Swiss Ephemeris configuradas: {EPHE_PATH}, {DLL_PATH}")
 
 # Definir las 8 fases lunares
 NUM_PHASES = 8
@@ -58,74 +34,227 @@ PHASE_NAMES_ES = [
     "Menguante Cóncava"
 ]
 
+# Velocidad de la elongación Luna-Sol (°/día). La media es 360° por mes sinódico
+# (~12.19 °/día) y la real oscila aproximadamente entre 10.7 y 14.5 °/día, así
+# que estas cotas garantizan que el intervalo de búsqueda contiene el cruce.
+MIN_ELONGATION_RATE = 10.0
+MAX_ELONGATION_RATE = 16.0
+
+# Referencias para convertir entre día juliano (UT) y datetime UTC
+J2000_JD = 2451545.0
+J2000_UTC = datetime(2000, 1, 1, 12, tzinfo=timezone.utc)
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Número de llamadas a swe.calc_ut realizadas por el proceso
+calc_ut_calls = 0
+
+# Elongación continua interpolada para cada barra (columna lunar_angle); se crea al primer uso
+_lunar_elongation = None
+
+def elongation_interpolator():
+    """Interpolador de elongación compartido por el proceso."""
+    global _lunar_elongation
+    if _lunar_elongation is None:
+        settings.configure_ephemeris()
+        _lunar_elongation = LunarElongation(ephe_path=settings.EPHE_PATH)
+    return _lunar_elongation
+
+def datetime_to_jd(dt_utc):
+    """Convierte un datetime UTC a día juliano (UT)."""
+    return swe.julday(dt_utc.year, dt_utc.month, dt_utc.day, dt_utc.hour + dt_utc.minute/60.0 + dt_utc.second/3600.0)
+
+def jd_to_datetime(jd_ut):
+    """Convierte un día juliano (UT) a datetime UTC."""
+    return J2000_UTC + timedelta(days=jd_ut - J2000_JD)
+
+def get_elongation(jd_ut):
+    """Calcula la elongación Luna-Sol (0-360°) para un día juliano UT."""
+    global calc_ut_calls
+    sun_pos = swe.calc_ut(jd_ut, swe.SUN)[0][0]
+    moon_pos = swe.calc_ut(jd_ut, swe.MOON)[0][0]
+    calc_ut_calls += 2
+    return (moon_pos - sun_pos) % 360
+
 def get_phase_data(dt_utc):
     """Calcula el ángulo de fase para un datetime UTC."""
     try:
-        jd_ut = swe.julday(dt_utc.year, dt_utc.month, dt_utc.day, dt_utc.hour + dt_utc.minute/60.0 + dt_utc.second/3600.0)
-        sun_pos = swe.calc_ut(jd_ut, swe.SUN)[0][0]
-        moon_pos = swe.calc_ut(jd_ut, swe.MOON)[0][0]
-        angle = (moon_pos - sun_pos) % 360
-        return angle
+        return get_elongation(datetime_to_jd(dt_utc))
     except Exception as e:
         logging.error(f"Error al calcular el ángulo de fase para {dt_utc}: {e}")
         raise
 
-def find_next_phase_change(start_dt_utc, current_phase_num):
-    """Encuentra el momento exacto del próximo cambio de fase."""
+def get_phase_num(angle):
+    """Devuelve el índice de fase (0..NUM_PHASES-1) correspondiente a un ángulo."""
+    return int((angle % 360) / ANGLE_PER_PHASE) % NUM_PHASES
+
+def ceil_to_tolerance(dt_utc, tolerance_seconds=None):
+    """Redondea hacia arriba un datetime UTC a la rejilla de la tolerancia (alineada con la época Unix)."""
+    tolerance_seconds = tolerance_seconds or settings.PHASE_TOLERANCE_SECONDS
+    seconds = (dt_utc - UNIX_EPOCH).total_seconds()
+    return UNIX_EPOCH + timedelta(seconds=math.ceil(seconds / tolerance_seconds) * tolerance_seconds)
+
+def find_next_phase_change(start_dt_utc, current_phase_num, limit_dt=None):
+    """Encuentra el momento exacto del próximo cambio de fase.
+
+    Acota el cruce de la elongación objetivo con las velocidades mínima y máxima
+    de la Luna y lo refina con el método de Brent. El resultado es el primer
+    instante de la rejilla de PHASE_TOLERANCE_SECONDS que ya pertenece a la
+    nueva fase (verificado contra el punto anterior de la rejilla); si el cruce cae en o después de limit_dt se devuelve limit_dt.
+    """
+    from scipy.optimize import brentq
+
+    limit_dt = limit_dt or settings.end_date
     target_phase_num = (current_phase_num + 1) % NUM_PHASES
     target_angle = target_phase_num * ANGLE_PER_PHASE
-    current_dt = start_dt_utc
-    step = timedelta(hours=6)
-    max_steps = 5000
-    step_count = 0
-
-    while current_dt < end_date and step_count < max_steps:
-        current_angle = get_phase_data(current_dt)
-        current_phase_num_check = int((current_angle % 360) / ANGLE_PER_PHASE) % NUM_PHASES
-        if current_phase_num_check == target_phase_num:
-            fine_dt = current_dt
-            fine_step = timedelta(minutes=1)
-            while True:
-                fine_dt -= fine_step
-                prev_angle = get_phase_data(fine_dt)
-                prev_phase_num = int((prev_angle % 360) / ANGLE_PER_PHASE) % NUM_PHASES
-                if prev_phase_num != target_phase_num:
-                    return fine_dt + fine_step
-                if fine_dt < start_date:
-                    logging.warning(f"No se encontró cambio de fase para {target_phase_num} desde {start_dt_utc}")
-                    return current_dt
-            break
-        current_dt += step
-        step_count += 1
-
-    if step_count >= max_steps:
-        logging.error(f"Bucle infinito detectado buscando la fase {target_phase_num} desde {start_dt_utc}")
-        raise RuntimeError(f"No se pudo encontrar la fase {target_phase_num}")
-    if current_dt >= end_date:
-        logging.warning(f"Fecha límite alcanzada: {current_dt}")
-        return end_date
-    return current_dt
+    jd_start = datetime_to_jd(start_dt_utc)
 
-def generate_lunar_phase_changes():
-    """Genera un DataFrame con los momentos exactos de cambio de fase."""
-    logging.info(f"Calculando cambios de fase desde {START_DATE} hasta {END_DATE}")
+    def angle_offset(days):
+        # Diferencia con signo respecto al ángulo objetivo, continua alrededor del cruce
+        return (get_elongation(jd_start + days) - target_angle + 180.0) % 360.0 - 180.0
+
+    try:
+        remaining = -angle_offset(0.0) % 360.0
+        lower_days = remaining / MAX_ELONGATION_RATE
+        upper_days = remaining / MIN_ELONGATION_RATE
+        if start_dt_utc + timedelta(days=lower_days) >= limit_dt:
+            return limit_dt
+        xtol = settings.PHASE_TOLERANCE_SECONDS / 86400.0 / 10.0
+        root_days = brentq(angle_offset, lower_days, upper_days, xtol=xtol)
+    except (ValueError, RuntimeError) as e:
+        logging.error(f"No se pudo acotar la fase {target_phase_num} desde {start_dt_utc}: {e}")
+        raise RuntimeError(f"No se pudo encontrar la fase {target_phase_num}") from e
+
+    # Ajustar al primer punto de la rejilla en la nueva fase (el error de Brent es menor que un paso)
+    step = timedelta(seconds=settings.PHASE_TOLERANCE_SECONDS)
+    change_dt = ceil_to_tolerance(jd_to_datetime(jd_start + root_days))
+    if get_phase_num(get_phase_data(change_dt - step)) == target_phase_num:
+        change_dt -= step
+    elif get_phase_num(get_phase_data(change_dt)) != target_phase_num:
+        change_dt += step
+    if change_dt >= limit_dt:
+        logging.warning(f"Fecha límite alcanzada: {change_dt}")
+        return limit_dt
+    return change_dt
+
+@profiler.profile('phase_solver', rows=len)
+def compute_phase_changes(range_start, range_end):
+    """Calcula la tabla de cambios de fase en [range_start, range_end).
+
+    La primera fila es la fase vigente en range_start; las siguientes son los
+    cambios de fase reales dentro del rango.
+    """
+    settings.configure_ephemeris()
     phase_changes = []
-    current_dt = start_date
+    current_dt = range_start
     last_phase_num = None
+    calls_start = calls_before = calc_ut_calls
 
-    while current_dt < end_date:
+    while current_dt < range_end:
         angle = get_phase_data(current_dt)
-        phase_num = int((angle % 360) / ANGLE_PER_PHASE) % NUM_PHASES
+        phase_num = get_phase_num(angle)
         if last_phase_num is None or phase_num != last_phase_num:
             phase_changes.append({
                 'TimestampUTC': current_dt,
                 'PhaseName': PHASE_NAMES_ES[phase_num]
             })
-            logging.info(f"Inicio de {PHASE_NAMES_ES[phase_num]} a las {current_dt}")
+            logging.info(f"Inicio de {PHASE_NAMES_ES[phase_num]} a las {current_dt} ({calc_ut_calls - calls_before} llamadas a swe.calc_ut)")
             last_phase_num = phase_num
-        current_dt = find_next_phase_change(current_dt, phase_num)
+            calls_before = calc_ut_calls
+        current_dt = find_next_phase_change(current_dt, phase_num, range_end)
+
+    total_calls = calc_ut_calls - calls_start
+    logging.info(f"Cambios de fase calculados: {len(phase_changes)} con {total_calls} llamadas a swe.calc_ut "
+                 f"({total_calls / max(len(phase_changes), 1):.1f} por cambio)")
+    return pd.DataFrame(phase_changes, columns=['TimestampUTC', 'PhaseName'])
+
+def phase_cache_key():
+    """Identifica la caché por archivos de efemérides, número de fases y tolerancia."""
+    digest = hashlib.sha256()
+    ephemeris_files = sorted(glob.glob(os.path.join(settings.EPHE_PATH, '*.se1')))
+    for path in ephemeris_files:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    if not ephemeris_files:
+        digest.update(b'moshier')
+    digest.update(f"{NUM_PHASES}|{settings.PHASE_TOLERANCE_SECONDS}".encode())
+    return digest.hexdigest()[:16]
+
+def merge_phase_changes(*tables):
+    """Une tablas de cambios de fase y elimina las filas que no cambian de fase."""
+    df = pd.concat(tables, ignore_index=True).sort_values('TimestampUTC', kind='stable')
+    df = df.drop_duplicates('TimestampUTC', keep='last')
+    return df[df['PhaseName'] != df['PhaseName'].shift(1)].reset_index(drop=True)
+
+def load_phase_changes(range_start, range_end):
+    """Devuelve los cambios de fase que cubren [range_start, range_end) usando la caché en disco.
+
+    Sólo se calculan los tramos que faltan antes o después del rango ya cubierto.
+    """
+    if not settings.PHASE_CACHE_DIR:
+        return compute_phase_changes(range_start, range_end)
+
+    key = phase_cache_key()
+    table_path = os.path.join(settings.PHASE_CACHE_DIR, f'phase_changes_{key}.csv')
+    meta_path = os.path.join(settings.PHASE_CACHE_DIR, f'phase_changes_{key}.json')
+    if os.path.exists(table_path) and os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        cached = pd.read_csv(table_path)
+        cached['TimestampUTC'] = pd.to_datetime(cached['TimestampUTC'], utc=True)
+        coverage_start = datetime.fromisoformat(meta['coverage_start'])
+        coverage_end = datetime.fromisoformat(meta['coverage_end'])
+    else:
+        cached = None
+        coverage_start = coverage_end = None
+
+    if cached is not None and coverage_start <= range_start and range_end <= coverage_end:
+        logging.info(f"Cambios de fase cargados desde la caché {table_path}")
+        return cached
+
+    if cached is None:
+        logging.info(f"Caché de fases vacía para la clave {key}")
+        merged = compute_phase_changes(range_start, range_end)
+        coverage_start, coverage_end = range_start, range_end
+    else:
+        tables = [cached]
+        if range_start < coverage_start:
+            logging.info(f"Extendiendo la caché de fases hacia atrás: {range_start} - {coverage_start}")
+            tables.append(compute_phase_changes(range_start, coverage_start))
+            coverage_start = range_start
+        if range_end > coverage_end:
+            logging.info(f"Extendiendo la caché de fases hacia adelante: {coverage_end} - {range_end}")
+            tables.append(compute_phase_changes(coverage_end, range_end))
+            coverage_end = range_end
+        merged = merge_phase_changes(*tables)
+
+    os.makedirs(settings.PHASE_CACHE_DIR, exist_ok=True)
+    merged.to_csv(table_path + '.tmp', index=False)
+    os.replace(table_path + '.tmp', table_path)
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({
+            'coverage_start': coverage_start.isoformat(),
+            'coverage_end': coverage_end.isoformat(),
+            'num_phases': NUM_PHASES,
+            'tolerance_seconds': settings.PHASE_TOLERANCE_SECONDS,
+            'ephemeris_path': settings.EPHE_PATH
+        }, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    logging.info(f"Caché de fases actualizada en {table_path}")
+    return merged
+
+@profiler.profile('phases', rows=len)
+def generate_lunar_phase_changes():
+    """Genera un DataFrame con los momentos exactos de cambio de fase."""
+    logging.info(f"Calculando cambios de fase desde {settings.START_DATE} hasta {settings.END_DATE}")
+    phase_changes = load_phase_changes(settings.start_date, settings.end_date)
+
+    # Recortar al rango solicitado; la primera fila es la fase vigente en start_date
+    timestamps = phase_changes['TimestampUTC']
+    current = phase_changes[timestamps <= settings.start_date].tail(1)
+    inside = phase_changes[(timestamps > settings.start_date) & (timestamps < settings.end_date)]
+    df = pd.concat([current.assign(TimestampUTC=pd.Timestamp(settings.start_date)), inside], ignore_index=True)
 
-    df = pd.DataFrame(phase_changes)
     output_dir = 'data/lunar_data'
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, 'lunar_phase_changes.csv')
@@ -133,37 +262,62 @@ def generate_lunar_phase_changes():
     logging.info(f"Cambios de fase guardados en {output_path}")
     return df
 
-def combine_financial_data():
-    """Combina datos financieros M1 con fases lunares y períodos."""
-    logging.info(f"Combinando datos financieros desde {FINANCIAL_CSV}")
-
-    # Cargar variables de entorno desde .env
-    load_dotenv()
-    
-    # Leer CSV financiero
-    financial_path = os.path.join(FINANCIAL_DATA_PATH, FINANCIAL_CSV)
-    if not os.path.exists(financial_path):
-        logging.error(f"Archivo financiero no encontrado: {financial_path}")
-        raise FileNotFoundError(f"Archivo financiero no encontrado: {financial_path}")
+REQUIRED_FINANCIAL_COLS = ['date', 'time', 'open', 'high', 'low', 'close', 'volume']
 
-    # Intentar leer con nombres de columnas
+def financial_csv_options(financial_path):
+    """Determina si el CSV financiero tiene fila de nombres y devuelve las opciones de lectura."""
     try:
-        df_financial = pd.read_csv(financial_path, header=0)
-        columns = df_financial.columns.str.lower()
-        required_cols = ['date', 'time', 'open', 'high', 'low', 'close', 'volume']
-        if not all(col in columns for col in required_cols):
-            logging.warning("Nombres de columnas no coinciden. Intentando sin nombres...")
-            df_financial = pd.read_csv(financial_path, header=None, names=required_cols)
-            if df_financial.shape[1] != 7:
-                logging.error(f"El archivo '{FINANCIAL_CSV}' no tiene nombres de columnas en la primera fila o no tiene exactamente 7 columnas. Por favor, añada una fila con los nombres: date, time, open, high, low, close, volume.")
-                raise ValueError(f"Formato de CSV inválido: {FINANCIAL_CSV}")
+        columns = pd.read_csv(financial_path, nrows=0).columns.str.lower()
     except Exception as e:
         logging.error(f"Error al leer el archivo financiero: {e}")
         raise
+    if all(col in columns for col in REQUIRED_FINANCIAL_COLS):
+        return {'header': 0}
+    logging.warning("Nombres de columnas no coinciden. Intentando sin nombres...")
+    if len(columns) != 7:
+        logging.error(f"El archivo '{os.path.basename(financial_path)}' no tiene nombres de columnas en la primera fila o no tiene exactamente 7 columnas. Por favor, añada una fila con los nombres: date, time, open, high, low, close, volume.")
+        raise ValueError(f"Formato de CSV inválido: {os.path.basename(financial_path)}")
+    return {'header': None, 'names': REQUIRED_FINANCIAL_COLS}
+
+def localize_to_utc(timestamps, timezone, quality):
+    """Convierte horas locales a UTC resolviendo el cambio de horario.
+
+    Las horas repetidas al atrasar el reloj se asignan por orden de llegada
+    (quality.repeated_hours, con estado entre bloques, así que el corte de
+    FINANCIAL_CHUNK_SIZE no influye) y las que no existen al adelantarlo
+    quedan en NaT.
+    """
+    utc = timestamps.dt.tz_localize(timezone, ambiguous='NaT', nonexistent='NaT')
+    shifted = utc.isna().to_numpy()
+    if not shifted.any():
+        quality.repeated_hours.is_dst(to_epoch_ns(utc), shifted)
+        return utc.dt.tz_convert(pytz.UTC)
+    # Candidata de verano de cada hora repetida; las inexistentes quedan en NaT
+    utc = timestamps.dt.tz_localize(timezone, ambiguous=np.ones(len(timestamps), dtype=bool), nonexistent='NaT')
+    present = utc.notna().to_numpy()
+    ambiguous = shifted & present
+    quality.add_dst_counts(ambiguous.sum(), (~present).sum())
+    dst = np.ones(len(timestamps), dtype=bool)
+    dst[present] = quality.repeated_hours.is_dst(to_epoch_ns(utc[present]), ambiguous[present])
+    if not dst.all():
+        utc = timestamps.dt.tz_localize(timezone, ambiguous=dst, nonexistent='NaT')
+    return utc.dt.tz_convert(pytz.UTC)
+
+@profiler.profile('prepare', rows=len, memory=True)
+def prepare_financial_data(df_financial, boundaries_ns, boundary_codes, quality=None):
+    """Valida un bloque de datos M1, convierte sus fechas a UTC y lo etiqueta con fase, período y elongación.
 
-    # Validar datos financieros
+    quality (QualityScan) acumula la revisión de calidad entre bloques; las
+    barras en horas locales inexistentes se descartan (y, con
+    DROP_INVALID_BARS, las duplicadas y las de high < low) y el bloque sale
+    ordenado por tiempo.
+    """
+    quality = quality or QualityScan()
+    # Validar datos financieros y conservar los precios ya convertidos
+    prices = {}
     for col in ['open', 'high', 'low', 'close']:
-        if not pd.to_numeric(df_financial[col], errors='coerce').notnull().all():
+        prices[col] = pd.to_numeric(df_financial[col], errors='coerce').to_numpy(dtype=np.float64)
+        if not np.isfinite(prices[col]).all():
             logging.error(f"Valores inválidos en '{col}'. Asegúrese de que sean números no negativos.")
             raise ValueError(f"Valores inválidos en '{col}'")
     if df_financial[['date', 'time']].isnull().any().any():
@@ -172,60 +326,116 @@ def combine_financial_data():
 
     # Convertir date y time a timestamp en UTC
     try:
-        df_financial['timestamp'] = pd.to_datetime(df_financial['date'] + ' ' + df_financial['time'], format='%Y.%m.%d %H:%M')
-        timezone = pytz.timezone(FINANCIAL_DATA_TIMEZONE) if FINANCIAL_DATA_TIMEZONE else pytz.UTC
-        if not FINANCIAL_DATA_TIMEZONE:
+        timestamps = pd.to_datetime(df_financial['date'] + ' ' + df_financial['time'], format='%Y.%m.%d %H:%M')
+        timezone = pytz.timezone(settings.FINANCIAL_DATA_TIMEZONE) if settings.FINANCIAL_DATA_TIMEZONE else pytz.UTC
+        if not settings.FINANCIAL_DATA_TIMEZONE:
             logging.warning("No se especificó FINANCIAL_DATA_TIMEZONE en .env. Asumiendo UTC para los datos financieros.")
-        df_financial['timestamp'] = df_financial['timestamp'].dt.tz_localize(timezone).dt.tz_convert(pytz.UTC)
+        timestamps = localize_to_utc(timestamps, timezone, quality)
     except Exception as e:
         logging.error(f"Error al procesar fechas en el CSV financiero: {e}")
         raise
+    volume = df_financial['volume'].to_numpy()
+    if timestamps.isna().any():
+        # Horas locales que no existen por el cambio de horario: se descartan
+        present = timestamps.notna().to_numpy()
+        timestamps = timestamps[present]
+        prices = {col: values[present] for col, values in prices.items()}
+        volume = volume[present]
 
     # Validar rango de fechas
-    logging.info(f"start_date: {start_date}, end_date: {end_date}")
-    logging.info(f"df_financial['timestamp'].min(): {df_financial['timestamp'].min()}, df_financial['timestamp'].max(): {df_financial['timestamp'].max()}")
-    min_timestamp = df_financial['timestamp'].min().replace(hour=0, minute=0, second=0, microsecond=0)
-    max_timestamp = df_financial['timestamp'].max().replace(hour=0, minute=0, second=0, microsecond=0)
-    if min_timestamp < start_date or max_timestamp > end_date:
-        logging.error(f"Las fechas del CSV financiero están fuera del rango [{START_DATE}, {END_DATE}].")
+    logging.info(f"timestamp min: {timestamps.min()}, timestamp max: {timestamps.max()}")
+    min_timestamp = timestamps.min().replace(hour=0, minute=0, second=0, microsecond=0)
+    max_timestamp = timestamps.max().replace(hour=0, minute=0, second=0, microsecond=0)
+    if min_timestamp < settings.start_date or max_timestamp > settings.end_date:
+        logging.error(f"Las fechas del CSV financiero están fuera del rango [{settings.START_DATE}, {settings.END_DATE}].")
         raise ValueError("Rango de fechas inválido")
 
-    # Leer cambios de fase
-    df_phases = generate_lunar_phase_changes()
-
-    # Asignar fases lunares
-    df_financial['lunar_phase'] = None
-    for i in range(len(df_phases) - 1):
-        start_time = df_phases['TimestampUTC'].iloc[i]
-        end_time = df_phases['TimestampUTC'].iloc[i + 1]
-        phase = df_phases['PhaseName'].iloc[i]
-        mask = (df_financial['timestamp'] >= start_time) & (df_financial['timestamp'] < end_time)
-        df_financial.loc[mask, 'lunar_phase'] = phase
-    df_financial.loc[df_financial['timestamp'] >= df_phases['TimestampUTC'].iloc[-1], 'lunar_phase'] = df_phases['PhaseName'].iloc[-1]
-
-    # Asignar períodos
-    def assign_period(timestamp):
-        if timestamp < pre_pandemic_end:
-            return 'pre-pandemia'
-        elif timestamp <= pandemic_end:
-            return 'pandemia'
-        else:
-            return 'pos-pandemia'
-    df_financial['period'] = df_financial['timestamp'].apply(assign_period)
+    # Revisión de calidad: una pasada sobre marcas de tiempo y precios
+    timestamps_ns = to_epoch_ns(timestamps)
+    rows = quality.scan(timestamps_ns, prices['open'], prices['high'], prices['low'], prices['close'])
+    if rows is not None:
+        timestamps_ns = timestamps_ns[rows]
+        prices = {col: values[rows] for col, values in prices.items()}
+        volume = volume[rows]
 
-    # Seleccionar columnas de salida
-    output_cols = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'lunar_phase', 'period']
-    df_financial = df_financial[output_cols]
+    # Asignar fases lunares y períodos con búsqueda binaria sobre los límites ordenados
+    phase_codes = tag_intervals(timestamps_ns, boundaries_ns, boundary_codes)
+    period_codes = tag_periods(timestamps_ns, settings.period_cuts_ns)
 
-    # Guardar resultado
-    output_dir = 'data/processed'
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, 'combined_data.csv')
-    df_financial.to_csv(output_path, index=False)
-    logging.info(f"Datos combinados guardados en {output_path}")
+    with profiler.stage('elongation'):
+        lunar_angle = elongation_interpolator().elongation(timestamps_ns)
+
+    # Seleccionar columnas de salida; las etiquetas se generan sólo al escribir
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(timestamps_ns, unit='ns', utc=True),
+        **prices,
+        'volume': volume,
+        'lunar_phase': codes_to_labels(phase_codes, PHASE_NAMES_ES),
+        'period': codes_to_labels(period_codes, settings.period_labels),
+        'lunar_angle': lunar_angle
+    })
+
+def write_combined_chunk(writer, df):
+    """Escribe un bloque combinado (subpaso 'write' del perfil)."""
+    with profiler.stage('write') as step:
+        writer.write(df)
+        step.rows = len(df)
+
+@profiler.profile('combine')
+def combine_financial_data(financial_path=None, output_dir='data/processed', df_phases=None):
+    """Combina datos financieros M1 con fases lunares y períodos.
+
+    Por defecto lee FINANCIAL_CSV y calcula la tabla de fases; el modo por lotes
+    pasa la ruta del instrumento, su directorio de salida y una tabla compartida.
+
+    Con FINANCIAL_CHUNK_SIZE > 0 el CSV se procesa en bloques de ese número de
+    filas y la memoria queda acotada por el tamaño del bloque; el resultado es
+    idéntico al de la lectura completa. Un bloque con barras anteriores a las
+    de un bloque previo no se puede reordenar y detiene la combinación
+    (ValueError); esos archivos se procesan con FINANCIAL_CHUNK_SIZE=0. La salida es el dataset Parquet
+    <output_dir>/combined_data/ y, con EXPORT_COMBINED_CSV, combined_data.csv,
+    junto con el índice de sesiones y el informe de calidad (data_quality.py).
+    """
+    financial_path = financial_path or os.path.join(settings.FINANCIAL_DATA_PATH, settings.FINANCIAL_CSV)
+    logging.info(f"Combinando datos financieros desde {financial_path}")
+    logging.info(f"start_date: {settings.start_date}, end_date: {settings.end_date}")
+
+    # Leer CSV financiero
+    if not os.path.exists(financial_path):
+        logging.error(f"Archivo financiero no encontrado: {financial_path}")
+        raise FileNotFoundError(f"Archivo financiero no encontrado: {financial_path}")
+    read_options = financial_csv_options(financial_path)
+
+    # Leer cambios de fase
+    if df_phases is None:
+        df_phases = generate_lunar_phase_changes()
+    boundaries_ns, boundary_codes = phase_boundaries(df_phases, PHASE_NAMES_ES)
+
+    # Guardar resultado en Parquet particionado por año (y CSV si se exporta)
+    quality = QualityScan()
+    with CombinedWriter(output_dir, export_csv=settings.EXPORT_COMBINED_CSV) as writer:
+        if settings.FINANCIAL_CHUNK_SIZE <= 0:
+            with profiler.stage('read_csv') as step:
+                df_financial = pd.read_csv(financial_path, **read_options)
+                step.rows = len(df_financial)
+            write_combined_chunk(writer, prepare_financial_data(df_financial, boundaries_ns, boundary_codes, quality))
+        else:
+            # Modo por bloques: la salida sólo se publica si todo el archivo es válido
+            with pd.read_csv(financial_path, chunksize=settings.FINANCIAL_CHUNK_SIZE, **read_options) as reader:
+                chunks = iter(reader)
+                for chunk_num in itertools.count():
+                    with profiler.stage('read_csv') as step:
+                        chunk = next(chunks, None)
+                        step.rows = 0 if chunk is None else len(chunk)
+                    if chunk is None:
+                        break
+                    write_combined_chunk(writer, prepare_financial_data(chunk, boundaries_ns, boundary_codes, quality))
+                    logging.info(f"Bloque {chunk_num + 1} procesado ({writer.rows} filas)")
+    save_quality(quality, output_dir)
 
 def main():
     """Función principal."""
+    logging.info("Iniciando script de cálculo de fases lunares...")
     combine_financial_data()
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from phase_tagging import to_epoch_ns
+
+# Nombres de los artefactos del dataset combinado dentro del directorio de salida
+COMBINED_DATASET = 'combined_data'
+COMBINED_CSV = 'combined_data.csv'
+PARTITION_COL = 'year'
+
+# Esquema compacto (34 bytes por barra M1 frente a 58 con precios float64 y volumen int64):
+# timestamp int64 (ns UTC), precios int32 escalados por 10**PRICE_DECIMALS, volumen uint32,
+# fase y período categóricos (códigos int8 con la tabla de etiquetas compartida) y
+# elongación float32 (resolución < 3e-5°, unas décimas de segundo de movimiento lunar).
+# Los códigos son int8 con signo y no uint8 porque pandas marca con -1 las barras sin
+# fase (anteriores al primer cambio de fase cargado); caben 127 etiquetas, de sobra
+# para las 8 fases y los períodos. Los precios int32 limitan el máximo representable a
+# INT32_MAX / 10**PRICE_DECIMALS (21474.83647 con 5 decimales): todas las partes del
+# dataset deben compartir tipo, así que no se amplía a int64 por bloque y un precio
+# mayor es un error que pide bajar PRICE_DECIMALS.
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+PRICE_DECIMALS_KEY = b'price_decimals'
+INT32_MAX = np.iinfo(np.int32).max
+UINT32_MAX = np.iinfo(np.uint32).max
+
+def encode_prices(values, decimals, name='price'):
+    """Precios como int32 escalados por 10**decimals; error si pierden precisión o no caben."""
+    values = pd.to_numeric(values).to_numpy(dtype=np.float64)
+    scale = 10 ** decimals
+    scaled = np.rint(values * scale)
+    if len(values) and np.abs(scaled).max() > INT32_MAX:
+        logging.error(f"Los precios de '{name}' superan {INT32_MAX / scale} (máximo en int32 con PRICE_DECIMALS={decimals}); "
+                      f"reduzca PRICE_DECIMALS")
+        raise ValueError(f"PRICE_DECIMALS={decimals} no representa los precios de '{name}'")
+    if len(values) and np.abs(scaled / scale - values).max() > 1e-9 * np.abs(values).max():
+        logging.error(f"Los precios de '{name}' tienen más de {decimals} decimales; aumente PRICE_DECIMALS")
+        raise ValueError(f"PRICE_DECIMALS={decimals} no representa los precios de '{name}'")
+    return scaled.astype(np.int32)
+
+def encode_volume(values):
+    """Volumen como uint32 (se redondea; error si es negativo o no cabe)."""
+    values = np.rint(pd.to_numeric(values).to_numpy(dtype=np.float64))
+    if len(values) and (values.min() < 0 or values.max() > UINT32_MAX):
+        logging.error("El volumen está fuera del rango de uint32")
+        raise ValueError("Volumen fuera de rango")
+    return values.astype(np.uint32)
+
+def price_array(df, column):
+    """Precios de una columna como float64, decodificando los int32 escalados (df.attrs['price_decimals'])."""
+    decimals = df.attrs.get('price_decimals')
+    values = df[column].to_numpy(dtype=np.float64)
+    return values / 10 ** decimals if decimals is not None else values
+
+def to_columnar(df, price_decimals=None):
+    """Convierte un bloque combinado al esquema compacto (ver PRICE_COLUMNS y los tipos de arriba)."""
+    if price_decimals is None:
+        from settings import settings
+        price_decimals = settings.PRICE_DECIMALS
+    columns = {'timestamp': to_epoch_ns(df['timestamp'])}
+    for column in PRICE_COLUMNS:
+        columns[column] = encode_prices(df[column], price_decimals, column)
+    columns.update({
+        'volume': encode_volume(df['volume']),
+        'lunar_phase': df['lunar_phase'].astype('category'),
+        'period': df['period'].astype('category'),
+        'lunar_angle': df['lunar_angle'].astype('float32'),
+        PARTITION_COL: df['timestamp'].dt.year.astype('int16').to_numpy()
+    })
+    return pd.DataFrame(columns)
+
+def columnar_table(df, price_decimals):
+    """Tabla Arrow del bloque compacto con PRICE_DECIMALS en los metadatos del esquema."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(to_columnar(df, price_decimals), preserve_index=False)
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), PRICE_DECIMALS_KEY: str(price_decimals).encode()})
+
+def dataset_price_decimals(dataset_path):
+    """PRICE_DECIMALS con el que se escribió el dataset (None si guarda precios float64)."""
+    import pyarrow.parquet as pq
+    for root, _, files in sorted(os.walk(dataset_path)):
+        for name in sorted(files):
+            if name.endswith('.parquet'):
+                value = (pq.read_schema(os.path.join(root, name)).metadata or {}).get(PRICE_DECIMALS_KEY)
+                return int(value) if value is not None else None
+    return None
+
+class CombinedWriter:
+    """Escribe el dataset combinado por bloques en Parquet particionado por año.
+
+    La escritura se hace en directorios temporales que sólo reemplazan la salida
+    anterior al llamar a close(); con export_csv también se genera combined_data.csv.
+    """
+
+    def __init__(self, output_dir, export_csv=False, price_decimals=None):
+        if price_decimals is None:
+            from settings import settings
+            price_decimals = settings.PRICE_DECIMALS
+        self.price_decimals = price_decimals
+        self.dataset_path = os.path.join(output_dir, COMBINED_DATASET)
+        self.csv_path = os.path.join(output_dir, COMBINED_CSV) if export_csv else None
+        self.rows = 0
+        self.chunks = 0
+        os.makedirs(output_dir, exist_ok=True)
+        shutil.rmtree(self.dataset_path + '.tmp', ignore_errors=True)
+
+    def write(self, df):
+        """Añade un bloque (con timestamp tz-aware y columnas lunar_phase/period/lunar_angle) a la salida."""
+        import pyarrow.parquet as pq
+        table = columnar_table(df, self.price_decimals)
+        pq.write_to_dataset(table, self.dataset_path + '.tmp', partition_cols=[PARTITION_COL],
+                            basename_template=f'part-{self.chunks:05d}-{{i}}.parquet')
+        if self.csv_path:
+            df.to_csv(self.csv_path + '.tmp', index=False, header=(self.chunks == 0), mode='w' if self.chunks == 0 else 'a')
+        self.rows += len(df)
+        self.chunks += 1
+
+    def close(self):
+        """Publica la salida escrita."""
+        if self.chunks == 0:
+            raise ValueError("No se escribió ningún bloque en el dataset combinado")
+        shutil.rmtree(self.dataset_path, ignore_errors=True)
+        os.replace(self.dataset_path + '.tmp', self.dataset_path)
+        logging.info(f"Dataset combinado guardado en {self.dataset_path} ({self.rows} filas)")
+        if self.csv_path:
+            os.replace(self.csv_path + '.tmp', self.csv_path)
+            logging.info(f"Datos combinados exportados a {self.csv_path}")
+
+    def abort(self):
+        """Descarta la salida parcial."""
+        shutil.rmtree(self.dataset_path + '.tmp', ignore_errors=True)
+        if self.csv_path and os.path.exists(self.csv_path + '.tmp'):
+            os.remove(self.csv_path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def append_combined(df, output_dir, tag):
+    """Añade un bloque al dataset combinado existente sin reescribirlo.
+
+    Los archivos nuevos se nombran con tag (p. ej. la marca de agua anterior)
+    para no pisar partes previas y usan la escala de precios del dataset; si
+    existe combined_data.csv también se amplía.
+    """
+    dataset_path = os.path.join(output_dir, COMBINED_DATASET)
+    if not os.path.isdir(dataset_path):
+        logging.error(f"No existe el dataset combinado {dataset_path}; genere primero la versión completa")
+        raise FileNotFoundError(f"Dataset no encontrado: {dataset_path}")
+    import pyarrow.parquet as pq
+    price_decimals = dataset_price_decimals(dataset_path)
+    if price_decimals is None:
+        logging.error(f"El dataset {dataset_path} es anterior al esquema compacto; regenérelo antes de ampliarlo")
+        raise ValueError(f"Dataset sin PRICE_DECIMALS: {dataset_path}")
+    table = columnar_table(df, price_decimals)
+    pq.write_to_dataset(table, dataset_path, partition_cols=[PARTITION_COL],
+                        basename_template=f'append-{tag}-{{i}}.parquet')
+    csv_path = os.path.join(output_dir, COMBINED_CSV)
+    if os.path.exists(csv_path):
+        df.to_csv(csv_path, index=False, header=False, mode='a')
+    logging.info(f"{len(df)} filas añadidas a {dataset_path}")
+
+def combined_years(input_dir='data/processed'):
+    """Años (particiones) del dataset combinado en orden, o None si no hay dataset Parquet."""
+    dataset_path = os.path.join(input_dir, COMBINED_DATASET)
+    if not os.path.isdir(dataset_path):
+        return None
+    prefix = f'{PARTITION_COL}='
+    return sorted(int(name[len(prefix):]) for name in os.listdir(dataset_path) if name.startswith(prefix))
+
+def read_combined(input_dir='data/processed', columns=None, periods=None, years=None, compact=False):
+    """Lee el dataset combinado cargando sólo las columnas y particiones pedidas.
+
+    Usa el dataset Parquet si existe y, si no, combined_data.csv. La columna
+    timestamp se devuelve como datetime64[ns, UTC]. Los precios se devuelven
+    como float64; con compact=True se mantienen como int32 escalados y
+    df.attrs['price_decimals'] indica la escala (price_array los decodifica).
+    """
+    dataset_path = os.path.join(input_dir, COMBINED_DATASET)
+    csv_path = os.path.join(input_dir, COMBINED_CSV)
+    if os.path.isdir(dataset_path):
+        filters = []
+        if periods is not None:
+            filters.append(('period', 'in', list(periods)))
+        if years is not None:
+            filters.append((PARTITION_COL, 'in', [int(year) for year in years]))
+        import pyarrow.parquet as pq
+        table = pq.read_table(dataset_path, columns=columns, filters=filters or None)
+        price_decimals = (table.schema.metadata or {}).get(PRICE_DECIMALS_KEY)
+        df = table.to_pandas()
+        df = df.drop(columns=PARTITION_COL, errors='ignore')
+        if price_decimals is not None:
+            df.attrs['price_decimals'] = int(price_decimals)
+            if not compact:
+                for column in PRICE_COLUMNS:
+                    if column in df.columns:
+                        df[column] = price_array(df, column)
+                del df.attrs['price_decimals']
+        if 'timestamp' in df.columns:
+            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ns', utc=True)
+            if not df['timestamp'].is_monotonic_increasing:
+                df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+        logging.info(f"Datos cargados desde {dataset_path}")
+        return df
+
+    if os.path.exists(csv_path):
+        df = pd.read_csv(csv_path, usecols=columns, parse_dates=['timestamp'] if columns is None or 'timestamp' in columns else False)
+        if periods is not None:
+            df = df[df['period'].isin(list(periods))]
+        if years is not None:
+            df = df[df['timestamp'].dt.year.isin([int(year) for year in years])]
+        logging.info(f"Datos cargados desde {csv_path}")
+        return df.reset_index(drop=True)
+
+    logging.error(f"Archivo no encontrado: {dataset_path} ni {csv_path}")
+    raise FileNotFoundError(f"Archivo no encontrado: {dataset_path}")
@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from phase_tagging import NS_PER_MINUTE, to_epoch_ns
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SESSIONS_FILE = 'sessions.parquet'
+QUALITY_REPORT = 'data_quality.json'
+# Contadores del informe, en el orden en que se muestran
+ISSUE_COUNTERS = ['duplicates', 'out_of_order', 'high_below_low', 'open_close_outside_range',
+                  'dst_ambiguous', 'dst_nonexistent']
+
+class RepeatedHours:
+    """Resolución por orden de llegada de las horas locales que se repiten al atrasar el reloj.
+
+    Cada barra de la hora repetida va en horario de verano mientras su
+    candidata de verano (en UTC) no retroceda respecto a la barra anterior;
+    desde el primer retroceso (la segunda pasada de la hora) y hasta que
+    acaba la hora repetida va en horario estándar. El estado (UTC de la
+    última barra y si estaba en la segunda pasada) se conserva entre
+    llamadas, así que el resultado no depende de cómo se trocee la entrada.
+    """
+
+    def __init__(self):
+        self.last_ns = None
+        self.last_standard = False
+
+    def is_dst(self, candidates_ns, ambiguous):
+        """Resuelve un bloque en el orden de entrada; True donde la hora repetida es de verano.
+
+        candidates_ns es el UTC de cada barra (la candidata de verano en las
+        horas repetidas); el valor devuelto en las demás barras es True.
+        """
+        candidates_ns = np.asarray(candidates_ns, dtype=np.int64)
+        ambiguous = np.asarray(ambiguous, dtype=bool)
+        dst = np.ones(len(candidates_ns), dtype=bool)
+        if ambiguous.any():
+            backwards = np.empty(len(candidates_ns), dtype=bool)
+            backwards[0] = self.last_standard or (self.last_ns is not None and candidates_ns[0] < self.last_ns)
+            np.less(candidates_ns[1:], candidates_ns[:-1], out=backwards[1:])
+            # Tramos de barras consecutivas en la hora repetida: un retroceso pasa el resto del tramo a horario estándar
+            starts = ambiguous.copy()
+            starts[1:] &= ~ambiguous[:-1]
+            breaks = ambiguous & backwards
+            seen = np.cumsum(breaks)
+            start_index = np.flatnonzero(starts)
+            before_run = (seen[start_index] - breaks[start_index])[np.cumsum(starts)[ambiguous] - 1]
+            dst[ambiguous] = seen[ambiguous] == before_run
+        if len(candidates_ns):
+            self.last_ns = int(candidates_ns[-1])
+            self.last_standard = bool(ambiguous[-1] and not dst[-1])
+        return dst
+
+    def is_dst_one(self, candidate_ns, ambiguous):
+        """La misma regla para una sola barra (modo en vivo)."""
+        dst = not (ambiguous and (self.last_standard or (self.last_ns is not None and candidate_ns < self.last_ns)))
+        self.last_ns = candidate_ns
+        self.last_standard = not dst
+        return dst
+
+class QualityScan:
+    """Revisión de calidad de las barras M1 en una sola pasada vectorizada por bloque.
+
+    scan() recibe cada bloque (en el orden del CSV) y detecta duplicados,
+    marcas de tiempo desordenadas, barras con high < low u open/close fuera
+    del rango, minutos faltantes y huecos de sesión. El estado entre bloques
+    es la última barra vista y la última aceptada; un bloque con barras
+    anteriores a la última vista se rechaza, porque ordenarlo exigiría
+    reescribir bloques ya escritos. Así el resultado no depende de
+    FINANCIAL_CHUNK_SIZE. Una sesión es un tramo de barras sin huecos de más
+    de SESSION_GAP_MINUTES (fines de semana, festivos, cortes de datos).
+    Con drop_invalid (DROP_INVALID_BARS) los duplicados y las barras con
+    high < low se descartan; si no, sólo se cuentan. repeated_hours resuelve las horas locales repetidas con el mismo estado
+    entre bloques.
+    """
+
+    def __init__(self, session_gap_minutes=None, drop_invalid=None):
+        session_gap_minutes = settings.SESSION_GAP_MINUTES if session_gap_minutes is None else session_gap_minutes
+        self.session_gap_ns = int(session_gap_minutes * NS_PER_MINUTE)
+        self.drop_invalid = settings.DROP_INVALID_BARS if drop_invalid is None else drop_invalid
+        self.counts = dict.fromkeys(['rows_in', 'rows_out', 'rows_dropped', *ISSUE_COUNTERS, 'missing_minutes', 'closed_minutes'], 0)
+        self.max_gap_minutes = 0
+        self.last_ns = None
+        self.last_seen_ns = None
+        # Sesiones cerradas (arrays por bloque) y la sesión abierta [inicio, fin, barras, minutos faltantes]
+        self.sessions = []
+        self.current = None
+        self.repeated_hours = RepeatedHours()
+
+    def scan(self, timestamps_ns, open_, high, low, close):
+        """Revisa un bloque y devuelve los índices de las filas que se conservan (None si son todas, en orden).
+
+        Con drop_invalid se descartan los duplicados (se queda la primera
+        barra de cada marca de tiempo) y las barras con high < low; el bloque
+        se ordena por tiempo si venía desordenado. ValueError si el bloque tiene barras
+        anteriores a la última de los bloques previos.
+        """
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        n = len(timestamps_ns)
+        self.counts['rows_in'] += n
+        if n == 0:
+            return None
+        backwards = timestamps_ns[1:] < timestamps_ns[:-1]
+        order = np.argsort(timestamps_ns, kind='stable') if backwards.any() else None
+        ts = timestamps_ns if order is None else timestamps_ns[order]
+        if self.last_seen_ns is not None and ts[0] < self.last_seen_ns:
+            logging.error(f"Barra de {pd.Timestamp(int(ts[0]), tz='UTC')} anterior a la última del bloque previo "
+                          f"({pd.Timestamp(self.last_seen_ns, tz='UTC')}); use FINANCIAL_CHUNK_SIZE=0 para ordenar el archivo completo")
+            raise ValueError("Barras desordenadas entre bloques")
+        self.counts['out_of_order'] += int(backwards.sum())
+
+        open_, high, low, close = (np.asarray(values, dtype=np.float64) for values in (open_, high, low, close))
+        inverted = high < low
+        outside = ~inverted & ((open_ > high) | (open_ < low) | (close > high) | (close < low))
+        if order is not None:
+            inverted = inverted[order]
+        duplicate = np.empty(n, dtype=bool)
+        duplicate[0] = ts[0] == self.last_seen_ns
+        np.equal(ts[1:], ts[:-1], out=duplicate[1:])
+        self.last_seen_ns = int(ts[-1])
+        self.counts['duplicates'] += int(duplicate.sum())
+        self.counts['high_below_low'] += int(inverted.sum())
+        self.counts['open_close_outside_range'] += int(outside.sum())
+
+        keep = ~(duplicate | inverted) if self.drop_invalid else np.ones(n, dtype=bool)
+        kept = ts[keep]
+        self.counts['rows_out'] += len(kept)
+        self.counts['rows_dropped'] += n - len(kept)
+        if len(kept):
+            self._track_sessions(kept)
+        if order is None and keep.all():
+            return None
+        return order[keep] if order is not None else np.flatnonzero(keep)
+
+    def _track_sessions(self, kept):
+        """Actualiza huecos y sesiones con las marcas de tiempo aceptadas (ordenadas) de un bloque."""
+        gaps = np.empty(len(kept), dtype=np.int64)
+        gaps[0] = kept[0] - self.last_ns if self.last_ns is not None else -1
+        np.subtract(kept[1:], kept[:-1], out=gaps[1:])
+        # -1 marca la primera barra de la revisión: abre la primera sesión
+        breaks = (gaps > self.session_gap_ns) | (gaps < 0)
+        inner = ~breaks & (gaps > NS_PER_MINUTE)
+        missing = np.where(inner, gaps // NS_PER_MINUTE - 1, 0)
+        self.counts['missing_minutes'] += int(missing.sum())
+        self.counts['closed_minutes'] += int(gaps[breaks & (gaps > 0)].sum() // NS_PER_MINUTE)
+        if inner.any():
+            self.max_gap_minutes = max(self.max_gap_minutes, int(gaps[inner].max() // NS_PER_MINUTE))
+        self.last_ns = int(kept[-1])
+
+        starts = np.flatnonzero(breaks)
+        first = starts[0] if len(starts) else len(kept)
+        if first > 0:
+            # Las barras anteriores a la primera ruptura continúan la sesión abierta
+            self.current[1] = int(kept[first - 1])
+            self.current[2] += int(first)
+            self.current[3] += int(missing[:first].sum())
+        if not len(starts):
+            return
+        if self.current is not None:
+            self.sessions.append(np.array([self.current], dtype=np.int64))
+        bounds = np.append(starts, len(kept))
+        blocks = np.column_stack([kept[starts], kept[bounds[1:] - 1], np.diff(bounds),
+                                  np.add.reduceat(missing, starts)])
+        self.sessions.append(blocks[:-1])
+        self.current = [int(value) for value in blocks[-1]]
+
+    def add_dst_counts(self, ambiguous, nonexistent):
+        """Suma las horas locales repetidas (resueltas por orden) y las inexistentes (descartadas) por el cambio de horario."""
+        self.counts['dst_ambiguous'] += int(ambiguous)
+        self.counts['dst_nonexistent'] += int(nonexistent)
+        self.counts['rows_in'] += int(nonexistent)
+
+    def _session_blocks(self):
+        """Filas [inicio, fin, barras, minutos faltantes] de todas las sesiones, incluida la abierta."""
+        parts = self.sessions + ([np.array([self.current], dtype=np.int64)] if self.current is not None else [])
+        return np.concatenate(parts) if parts else np.empty((0, 4), dtype=np.int64)
+
+    def session_starts_ns(self):
+        """Inicios de sesión en ns UTC (ordenados) de las barras revisadas hasta ahora."""
+        return np.sort(self._session_blocks()[:, 0])
+
+    def sessions_frame(self):
+        """Índice de sesiones: inicio y fin (última barra) en UTC, barras y minutos faltantes."""
+        blocks = self._session_blocks()
+        return pd.DataFrame({
+            'session_start': pd.to_datetime(blocks[:, 0], unit='ns', utc=True),
+            'session_end': pd.to_datetime(blocks[:, 1], unit='ns', utc=True),
+            'bars': blocks[:, 2],
+            'missing_minutes': blocks[:, 3]
+        })
+
+    def report(self, sessions=None):
+        """Resumen de la revisión (lo que se guarda en data_quality.json)."""
+        sessions = self.sessions_frame() if sessions is None else sessions
+        report = dict(self.counts)
+        report.update({
+            'drop_invalid_bars': self.drop_invalid,
+            'sessions': len(sessions),
+            'session_gap_minutes': self.session_gap_ns / NS_PER_MINUTE,
+            'max_gap_minutes_within_session': self.max_gap_minutes,
+            'first_bar': sessions['session_start'].min().isoformat() if len(sessions) else None,
+            'last_bar': sessions['session_end'].max().isoformat() if len(sessions) else None
+        })
+        return report
+
+    def to_dict(self):
+        """Estado de la revisión para continuarla en otra ejecución (modo incremental)."""
+        return {'session_gap_ns': self.session_gap_ns, 'drop_invalid': self.drop_invalid, 'counts': self.counts, 'max_gap_minutes': self.max_gap_minutes,
+                'last_ns': self.last_ns, 'last_seen_ns': self.last_seen_ns, 'sessions': np.concatenate(self.sessions).tolist() if self.sessions else [],
+                'current': self.current,
+                'repeated_hours': {'last_ns': self.repeated_hours.last_ns, 'last_standard': self.repeated_hours.last_standard}}
+
+    @classmethod
+    def from_dict(cls, data):
+        scan = cls(data['session_gap_ns'] / NS_PER_MINUTE, data['drop_invalid'])
+        scan.session_gap_ns = data['session_gap_ns']
+        scan.counts = dict(data['counts'])
+        scan.max_gap_minutes = data['max_gap_minutes']
+        scan.last_ns = data['last_ns']
+        scan.last_seen_ns = data.get('last_seen_ns', data['last_ns'])
+        scan.sessions = [np.array(data['sessions'], dtype=np.int64).reshape(-1, 4)]
+        scan.current = data['current']
+        scan.repeated_hours.last_ns = data['repeated_hours']['last_ns']
+        scan.repeated_hours.last_standard = data['repeated_hours']['last_standard']
+        return scan
+
+def save_quality(scan, output_dir='data/processed'):
+    """Guarda el índice de sesiones (sessions.parquet) y el informe (data_quality.json)."""
+    os.makedirs(output_dir, exist_ok=True)
+    sessions = scan.sessions_frame()
+    report = scan.report(sessions)
+    sessions_path = os.path.join(output_dir, SESSIONS_FILE)
+    report_path = os.path.join(output_dir, QUALITY_REPORT)
+    sessions.to_parquet(sessions_path, index=False)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    issues = {name: report[name] for name in ISSUE_COUNTERS if report[name]}
+    if issues:
+        logging.warning("Problemas de calidad en los datos M1: " + ', '.join(f"{name}={count}" for name, count in issues.items()))
+    if report['rows_dropped']:
+        logging.warning(f"DROP_INVALID_BARS: {report['rows_dropped']} barras descartadas del dataset combinado "
+                        f"(duplicates={report['duplicates']}, high_below_low={report['high_below_low']})")
+    logging.info(f"{report['sessions']} sesiones y {report['missing_minutes']} minutos faltantes dentro de sesión; "
+                 f"índice en {sessions_path} e informe en {report_path}")
+    return report
+
+def read_sessions(input_dir='data/processed'):
+    """Lee el índice de sesiones que guarda la combinación."""
+    path = os.path.join(input_dir, SESSIONS_FILE)
+    if not os.path.exists(path):
+        logging.error(f"Índice de sesiones no encontrado: {path}. Ejecute primero la combinación de datos.")
+        raise FileNotFoundError(f"Índice de sesiones no encontrado: {path}")
+    return pd.read_parquet(path)
+
+def session_starts_ns(input_dir='data/processed'):
+    """Inicios de sesión en ns UTC (ordenados): los retornos en esas barras cruzan un cierre de mercado."""
+    return np.sort(to_epoch_ns(read_sessions(input_dir)['session_start']))
+
+def main():
+    """Función principal: muestra el informe de la última combinación."""
+    path = os.path.join('data/processed', QUALITY_REPORT)
+    try:
+        with open(path, encoding='utf-8') as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        logging.error(f"Informe de calidad no encontrado: {path}. Ejecute primero la combinación de datos.")
+        raise
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import logging
+import os
+import numpy as np
+import pandas as pd
+from combined_storage import price_array
+from metrics_engine import segment_starts
+from phase_tagging import NS_PER_MINUTE, tag_periods, to_epoch_ns
+from profiling import profiler
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STUDY_COLUMNS = ['timestamp', 'close']
+
+def phase_events():
+    """Instantes (ns UTC) y nombre de la fase que empieza en cada cambio de fase entre START_DATE y END_DATE."""
+    import calculate_lunar_phases as phases
+    changes = phases.load_phase_changes(settings.start_date, settings.end_date)
+    timestamps_ns = to_epoch_ns(changes['TimestampUTC'])
+    start_ns, end_ns = to_epoch_ns(pd.DatetimeIndex([settings.start_date, settings.end_date]))
+    inside = (timestamps_ns > start_ns) & (timestamps_ns < end_ns)
+    return timestamps_ns[inside], pd.Categorical(changes['PhaseName'][inside], categories=phases.PHASE_NAMES_ES)
+
+def asof_index(timestamps_ns, targets_ns):
+    """Índice de la última barra con timestamp <= target (-1 si no hay ninguna), para arrays de cualquier forma."""
+    return np.searchsorted(timestamps_ns, targets_ns, side='right') - 1
+
+def event_paths(timestamps_ns, log_close, events_ns, window_minutes, step_minutes, estimation_minutes):
+    """Retornos anormales por paso en una rejilla (eventos × desplazamientos) alrededor de cada evento.
+
+    El precio en cada punto de la rejilla es el último cierre conocido (as-of),
+    así que los minutos sin barra no desplazan la rejilla. El retorno normal
+    es la media por barra de la ventana de estimación anterior a la ventana
+    del evento multiplicada por las barras de cada paso. Devuelve
+    (desplazamientos en minutos, retornos anormales, pasos con barra,
+    eventos con datos en toda la ventana); los pasos sin barra valen 0.
+    """
+    steps = window_minutes // step_minutes
+    offsets = np.arange(-steps, steps + 1) * step_minutes
+    if not len(timestamps_ns):
+        shape = (len(events_ns), len(offsets))
+        return offsets, np.zeros(shape), np.zeros(shape, dtype=bool), np.zeros(len(events_ns), dtype=bool)
+    # Una sola búsqueda binaria vectorizada para toda la rejilla: las filas van
+    # ordenadas por evento, así que los accesos a timestamps_ns son casi secuenciales
+    grid = events_ns[:, None] + np.append(offsets[0] - step_minutes, offsets)[None, :] * NS_PER_MINUTE
+    index = asof_index(timestamps_ns, grid)
+    estimation = asof_index(timestamps_ns, grid[:, 0] - estimation_minutes * NS_PER_MINUTE)
+    covered = (estimation >= 0) & (grid[:, -1] <= timestamps_ns[-1])
+
+    clipped = np.maximum(index, 0)
+    bars = np.diff(index, axis=1)
+    returns = np.diff(log_close[clipped], axis=1)
+    estimation_bars = index[:, 0] - estimation
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normal = np.where(estimation_bars > 0, (log_close[clipped[:, 0]] - log_close[np.maximum(estimation, 0)]) / estimation_bars, 0.0)
+    abnormal = returns - normal[:, None] * bars
+    return offsets, abnormal, bars > 0, covered
+
+def group_profiles(offsets, abnormal, traded, group_codes, confidence):
+    """Perfiles por grupo de eventos: CAR medio, volatilidad por paso y bandas de confianza.
+
+    El CAR de cada evento vale 0 en el instante del evento (la parte previa
+    es el movimiento que lleva hasta él). La volatilidad es la media del
+    retorno anormal absoluto en los pasos con barra. Las bandas son
+    media ± t(n-1) · desviación / sqrt(n) entre eventos. Devuelve un dict de
+    arrays (grupos × desplazamientos) y los códigos de grupo.
+    """
+    import scipy.stats as stats
+
+    order = np.argsort(group_codes, kind='stable')
+    codes = group_codes[order]
+    car = np.cumsum(abnormal[order], axis=1)
+    car -= car[:, [int(np.flatnonzero(offsets == 0)[0])]]
+    absolute = np.where(traded[order], np.abs(abnormal[order]), np.nan)
+    starts = segment_starts(codes)
+    lengths = np.diff(np.append(starts, len(codes)))
+
+    def reduce(values):
+        """Media, desviación (ddof=1) y n por grupo y desplazamiento ignorando NaN."""
+        valid = ~np.isnan(values)
+        clean = np.where(valid, values, 0.0)
+        counts = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.add.reduceat(clean, starts, axis=0) / counts
+            deviations = np.where(valid, clean - np.repeat(means, lengths, axis=0), 0.0)
+            std = np.sqrt(np.add.reduceat(deviations * deviations, starts, axis=0) / (counts - 1))
+            # Pocos n distintos: el cuantil t se evalúa una vez por valor
+            dof, inverse = np.unique(np.maximum(counts - 1, 1), return_inverse=True)
+            critical = stats.t.ppf(0.5 + confidence / 2, dof)[inverse].reshape(counts.shape)
+            half = critical * std / np.sqrt(counts)
+        return means, std, counts, half
+
+    car_mean, car_std, events, car_half = reduce(car)
+    vol_mean, _, traded_events, vol_half = reduce(absolute)
+    profiles = {
+        'events': events, 'mean_car': car_mean, 'std_car': car_std,
+        'car_low': car_mean - car_half, 'car_high': car_mean + car_half,
+        'traded_events': traded_events, 'volatility': vol_mean,
+        'volatility_low': vol_mean - vol_half, 'volatility_high': vol_mean + vol_half
+    }
+    return profiles, codes[starts]
+
+@profiler.profile('event_study', rows=len)
+def event_study(df, window_minutes=None, step_minutes=None, estimation_minutes=None, confidence=None):
+    """Estudio de eventos alrededor de los cambios de fase: CAR y volatilidad por fase que empieza y período.
+
+    df son barras M1 del dataset combinado (timestamp y close). Sólo entran
+    los eventos con datos en toda la ventana y en la ventana de estimación.
+    Devuelve una fila por (lunar_phase, period, offset_minutes). Los
+    parámetros omitidos se leen de EVENT_WINDOW_MINUTES, EVENT_STEP_MINUTES,
+    EVENT_ESTIMATION_MINUTES y EVENT_CONFIDENCE.
+    """
+    window_minutes = settings.EVENT_WINDOW_MINUTES if window_minutes is None else window_minutes
+    step_minutes = settings.EVENT_STEP_MINUTES if step_minutes is None else step_minutes
+    estimation_minutes = settings.EVENT_ESTIMATION_MINUTES if estimation_minutes is None else estimation_minutes
+    confidence = settings.EVENT_CONFIDENCE if confidence is None else confidence
+    if window_minutes < step_minutes or step_minutes < 1 or window_minutes % step_minutes:
+        logging.error(f"EVENT_WINDOW_MINUTES ({window_minutes}) debe ser un múltiplo positivo de EVENT_STEP_MINUTES ({step_minutes})")
+        raise ValueError("Ventana del estudio de eventos inválida")
+    if not df['timestamp'].is_monotonic_increasing:
+        attrs = df.attrs
+        df = df.sort_values('timestamp', kind='stable')
+        df.attrs = attrs
+    timestamps_ns = to_epoch_ns(df['timestamp'])
+    log_close = np.log(price_array(df, 'close'))
+    events_ns, event_phases = phase_events()
+
+    with profiler.stage('paths') as step:
+        offsets, abnormal, traded, covered = event_paths(timestamps_ns, log_close, events_ns, window_minutes,
+                                                         step_minutes, estimation_minutes)
+        step.rows = int(covered.sum()) * len(offsets)
+    logging.info(f"{int(covered.sum())} de {len(events_ns)} cambios de fase con datos en ±{window_minutes} min "
+                 f"y {estimation_minutes} min de estimación")
+    if not covered.any():
+        logging.error("Ningún cambio de fase tiene datos suficientes alrededor para el estudio de eventos")
+        raise ValueError("Sin eventos para el estudio")
+
+    phase_codes = event_phases.codes[covered].astype(np.int64)
+    period_codes = tag_periods(events_ns[covered], settings.period_cuts_ns).astype(np.int64)
+    n_periods = len(settings.period_labels)
+    with profiler.stage('profiles'):
+        profiles, groups = group_profiles(offsets, abnormal[covered], traded[covered],
+                                          phase_codes * n_periods + period_codes, confidence)
+
+    n_groups, n_offsets = len(groups), len(offsets)
+    frame = {
+        'lunar_phase': pd.Categorical.from_codes(np.repeat(groups // n_periods, n_offsets), categories=event_phases.categories),
+        'period': pd.Categorical.from_codes(np.repeat(groups % n_periods, n_offsets), categories=settings.period_labels),
+        'offset_minutes': np.tile(offsets, n_groups)
+    }
+    frame.update({name: values.ravel() for name, values in profiles.items()})
+    return pd.DataFrame(frame)
+
+def save_event_study(study_df, output_dir='data/processed'):
+    """Guarda event_study.csv."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, 'event_study.csv')
+    study_df.to_csv(output_path, index=False)
+    logging.info(f"Estudio de eventos guardado en {output_path}")
+    return output_path
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="CAR y volatilidad alrededor de cada cambio de fase lunar.")
+    parser.add_argument('--window-minutes', type=int, help="Minutos antes y después de cada cambio de fase (EVENT_WINDOW_MINUTES)")
+    parser.add_argument('--step-minutes', type=int, help="Paso de la rejilla en minutos (EVENT_STEP_MINUTES)")
+    parser.add_argument('--estimation-minutes', type=int, help="Ventana de estimación del retorno normal (EVENT_ESTIMATION_MINUTES)")
+    args = parser.parse_args()
+
+    import analyze_lunar_phases as analysis
+    df = analysis.load_data(columns=STUDY_COLUMNS)
+    save_event_study(event_study(df, args.window_minutes, args.step_minutes, args.estimation_minutes))
+
+if __name__ == "__main__":
+    main()
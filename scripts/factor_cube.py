@@ -0,0 +1,235 @@
+import argparse
+import logging
+import os
+import numpy as np
+import pandas as pd
+from combined_storage import price_array
+from data_quality import session_starts_ns
+from metrics_engine import log_returns
+from phase_tagging import NS_PER_DAY, NS_PER_HOUR, NS_PER_MINUTE, to_epoch_ns
+from profiling import profiler
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+WEEKDAYS = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
+SESSIONS = ['Asia', 'Londres', 'Nueva York']
+FACTORS = ['lunar_phase', 'period', 'weekday', 'hour', 'session']
+VALUES = ['return', 'abs_return']
+QUANTILES = {'p25': 0.25, 'median': 0.5, 'p75': 0.75}
+
+def session_of_hour(session_hours=None):
+    """Código de sesión (índice en SESSIONS) de cada hora UTC 0-23.
+
+    session_hours (TRADING_SESSION_HOURS por defecto) es la hora UTC de apertura
+    de cada sesión; cada una dura hasta la apertura de la siguiente.
+    """
+    session_hours = settings.TRADING_SESSION_HOURS if session_hours is None else session_hours
+    opens = [int(hour) for hour in session_hours.split(',')]
+    if len(opens) != len(SESSIONS) or not all(0 <= hour < 24 for hour in opens) or len(set(opens)) != len(opens):
+        logging.error(f"TRADING_SESSION_HOURS necesita {len(SESSIONS)} horas UTC distintas: {session_hours}")
+        raise ValueError(f"TRADING_SESSION_HOURS inválido: {session_hours}")
+    table = np.empty(24, dtype=np.int8)
+    for code, hour in sorted(enumerate(opens), key=lambda item: item[1]):
+        table[hour:] = code
+    # Las horas anteriores a la primera apertura pertenecen a la última sesión del día
+    first = min(opens)
+    table[:first] = table[23]
+    return table
+
+def factor_codes(df, factors):
+    """Códigos enteros y categorías de cada factor para las barras de df.
+
+    weekday, hour y session se derivan del timestamp UTC; lunar_phase y
+    period son las columnas categóricas del dataset combinado.
+    """
+    unknown = [factor for factor in factors if factor not in FACTORS]
+    if unknown:
+        logging.error(f"Factores desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(FACTORS)}")
+        raise ValueError(f"Factores desconocidos: {unknown}")
+    timestamps_ns = to_epoch_ns(df['timestamp'])
+    hours = (timestamps_ns // NS_PER_HOUR) % 24
+    codes, categories = [], []
+    for factor in factors:
+        if factor in ('lunar_phase', 'period'):
+            labels = pd.Categorical(df[factor])
+            codes.append(labels.codes)
+            categories.append(labels.categories)
+        elif factor == 'weekday':
+            # 1970-01-01 fue jueves (3 con lunes = 0)
+            codes.append(((timestamps_ns // NS_PER_DAY + 3) % 7).astype(np.int8))
+            categories.append(pd.Index(WEEKDAYS))
+        elif factor == 'hour':
+            codes.append(hours.astype(np.int8))
+            categories.append(pd.RangeIndex(24))
+        else:
+            codes.append(session_of_hour()[hours])
+            categories.append(pd.Index(SESSIONS))
+    return codes, categories
+
+def cell_index(codes, shape):
+    """Clave entera combinada (base mixta) de cada fila; -1 si algún factor falta."""
+    missing = np.zeros(len(codes[0]), dtype=bool)
+    for factor_codes_ in codes:
+        missing |= factor_codes_ < 0
+    cells = np.ravel_multi_index([np.where(missing, 0, c) for c in codes], shape)
+    cells[missing] = -1
+    return cells
+
+def key_dtype(n_cells):
+    # Con claves de 16 bits la ordenación estable de numpy es radix, lineal en filas
+    return np.int16 if n_cells <= np.iinfo(np.int16).max else np.int32 if n_cells <= np.iinfo(np.int32).max else np.int64
+
+class FactorCube:
+    """Recuentos, medias, varianzas y cuantiles exactos de valores por celda de varios factores.
+
+    values se guarda ordenado globalmente y cells tiene la celda de cada
+    valor, así que una ordenación estable por celda deja cada celda contigua
+    y ya ordenada: los cuantiles son lecturas por índice. marginal() combina
+    los momentos de las celdas (sin tocar los valores) y reagrupa las claves
+    para los cuantiles, sin volver a leer ni a ordenar los datos.
+    """
+
+    def __init__(self, factors, categories, values, cells, counts, means, m2):
+        self.factors = list(factors)
+        self.categories = list(categories)
+        self.shape = tuple(len(category) for category in self.categories)
+        self.values = values
+        self.cells = cells
+        self.counts = counts
+        self.means = means
+        self.m2 = m2
+
+    @classmethod
+    def build(cls, factors, categories, codes, values):
+        """Cubo de un valor por barra: una ordenación de los valores y reducciones por celda."""
+        shape = tuple(len(category) for category in categories)
+        n_cells = int(np.prod(shape))
+        cells = cell_index(codes, shape)
+        valid = (cells >= 0) & np.isfinite(values)
+        order = np.argsort(values[valid], kind='stable')
+        values = values[valid][order]
+        cells = cells[valid][order].astype(key_dtype(n_cells))
+        counts = np.bincount(cells, minlength=n_cells)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.bincount(cells, weights=values, minlength=n_cells) / counts
+        deviations = values - means[cells]
+        m2 = np.bincount(cells, weights=deviations * deviations, minlength=n_cells)
+        return cls(factors, categories, values, cells, counts, means, m2)
+
+    def marginal(self, factors):
+        """Cubo con sólo los factores pedidos (suma sobre el resto), a partir de las celdas."""
+        keep = [self.factors.index(factor) for factor in factors]
+        shape = tuple(self.shape[axis] for axis in keep)
+        n_cells = int(np.prod(shape))
+        fine = np.unravel_index(np.arange(len(self.counts)), self.shape)
+        coarse_of_fine = np.ravel_multi_index([fine[axis] for axis in keep], shape)
+        # Fusión de momentos de grupos (Chan et al.): M2 = sum M2_i + sum n_i (media_i - media)^2
+        counts = np.bincount(coarse_of_fine, weights=self.counts, minlength=n_cells).astype(np.int64)
+        filled = self.counts > 0
+        weighted = np.where(filled, self.counts * np.nan_to_num(self.means), 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.bincount(coarse_of_fine, weights=weighted, minlength=n_cells) / counts
+        spread = np.where(filled, self.counts * (np.nan_to_num(self.means) - means[coarse_of_fine]) ** 2, 0.0)
+        m2 = np.bincount(coarse_of_fine, weights=self.m2 + spread, minlength=n_cells)
+        cells = coarse_of_fine.astype(key_dtype(n_cells))[self.cells]
+        return FactorCube([self.factors[axis] for axis in keep], [self.categories[axis] for axis in keep],
+                          self.values, cells, counts, means, m2)
+
+    def quantiles(self, quantiles=QUANTILES):
+        """Cuantiles exactos por celda con la interpolación lineal de np.percentile."""
+        grouped = self.values[np.argsort(self.cells, kind='stable')]
+        starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        result = {}
+        filled = self.counts > 0
+        for name, q in quantiles.items():
+            position = q * (self.counts[filled] - 1)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, self.counts[filled] - 1)
+            low_values = grouped[starts[filled] + lower]
+            column = np.full(len(self.counts), np.nan)
+            column[filled] = low_values + (grouped[starts[filled] + upper] - low_values) * (position - lower)
+            result[name] = column
+        return result
+
+    def frame(self, quantiles=QUANTILES):
+        """Una fila por celda con datos: etiquetas de los factores, count, mean, std y cuantiles."""
+        filled = np.flatnonzero(self.counts > 0)
+        axes = np.unravel_index(filled, self.shape)
+        frame = {factor: category[axis] for factor, category, axis in zip(self.factors, self.categories, axes)}
+        counts = self.counts[filled]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.where(counts > 1, np.sqrt(self.m2[filled] / (counts - 1)), np.nan)
+        frame.update({'count': counts, 'mean': self.means[filled], 'std': std})
+        frame.update({name: values[filled] for name, values in self.quantiles(quantiles).items()})
+        return pd.DataFrame(frame)
+
+def bar_values(df, input_dir='data/processed'):
+    """Retorno logarítmico y su valor absoluto por barra, con los mismos cortes que calculate_metrics."""
+    if not df['timestamp'].is_monotonic_increasing:
+        attrs = df.attrs
+        df = df.sort_values('timestamp', kind='stable')
+        df.attrs = attrs
+    gap_ns = int(settings.RETURN_GAP_MINUTES * NS_PER_MINUTE) if settings.RETURN_GAP_MINUTES > 0 else None
+    starts = session_starts_ns(input_dir) if settings.RESET_RETURNS_AT_SESSIONS else None
+    returns = log_returns(price_array(df, 'close'), to_epoch_ns(df['timestamp']), gap_ns, starts)
+    return df, {'return': returns, 'abs_return': np.abs(returns)}
+
+@profiler.profile('factor_cube', rows=lambda cubes: len(next(iter(cubes.values())).values))
+def build_factor_cubes(df, factors=None, input_dir='data/processed'):
+    """Un FactorCube por valor (VALUES) sobre los factores pedidos (FACTOR_CUBE_FACTORS por defecto)."""
+    factors = factors or [factor.strip() for factor in settings.FACTOR_CUBE_FACTORS.split(',')]
+    df, values = bar_values(df, input_dir)
+    codes, categories = factor_codes(df, factors)
+    cubes = {name: FactorCube.build(factors, categories, codes, series) for name, series in values.items()}
+    logging.info(f"Cubo de factores {' × '.join(factors)}: {int(np.prod(cubes['return'].shape))} celdas, "
+                 f"{int((cubes['return'].counts > 0).sum())} con datos")
+    return cubes
+
+def parse_marginals(marginals=None):
+    """Conjuntos de factores separados por ';' (factores separados por ','); por defecto FACTOR_MARGINALS."""
+    marginals = settings.FACTOR_MARGINALS if marginals is None else marginals
+    return [[factor.strip() for factor in group.split(',') if factor.strip()] for group in marginals.split(';') if group.strip()]
+
+def factor_statistics(cubes, marginals=None):
+    """Tabla larga con el cubo completo y cada marginal: columna factors y una columna por factor (vacía si se suma)."""
+    marginals = parse_marginals() if marginals is None else marginals
+    frames = []
+    for value, cube in cubes.items():
+        for factors in [cube.factors] + marginals:
+            missing = [factor for factor in factors if factor not in cube.factors]
+            if missing:
+                logging.error(f"Los marginales sólo pueden usar factores del cubo ({', '.join(cube.factors)}): {missing}")
+                raise ValueError(f"Factores fuera del cubo: {missing}")
+            frame = (cube if factors == cube.factors else cube.marginal(factors)).frame()
+            frame.insert(0, 'value', value)
+            frame.insert(0, 'factors', '×'.join(factors))
+            frames.append(frame)
+    columns = ['factors', 'value'] + cubes[next(iter(cubes))].factors + ['count', 'mean', 'std'] + list(QUANTILES)
+    stats_df = pd.concat(frames, ignore_index=True).reindex(columns=columns)
+    if 'hour' in stats_df:
+        stats_df['hour'] = stats_df['hour'].astype('Int64')
+    return stats_df
+
+def save_factor_statistics(stats_df, output_dir='data/processed'):
+    """Guarda factor_statistics.csv."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, 'factor_statistics.csv')
+    stats_df.to_csv(output_path, index=False)
+    logging.info(f"Estadísticas por factores guardadas en {output_path}")
+    return output_path
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Estadísticas de retornos M1 por combinación de factores (fase, período, día, hora, sesión).")
+    parser.add_argument('--factors', default=settings.FACTOR_CUBE_FACTORS, help="Factores del cubo separados por comas")
+    parser.add_argument('--marginals', default=settings.FACTOR_MARGINALS, help="Conjuntos de factores separados por ';'")
+    args = parser.parse_args()
+
+    import analyze_lunar_phases as analysis
+    cubes = build_factor_cubes(analysis.load_data(), [factor.strip() for factor in args.factors.split(',')])
+    save_factor_statistics(factor_statistics(cubes, parse_marginals(args.marginals)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import logging
+import os
+import numpy as np
+import pandas as pd
+from phase_tagging import NS_PER_MINUTE
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# La semana Forex va del domingo a las 17:00 al viernes a las 17:00 de Nueva York;
+# así los cambios de horario de verano de EE. UU. y Europa caen con el mercado cerrado
+MARKET_TIMEZONE = 'America/New_York'
+MARKET_CLOSE_HOUR = 17
+# Días sin cotización (mes, día de Nueva York)
+HOLIDAYS = [(12, 25), (1, 1)]
+# Actividad relativa por hora UTC (Asia baja, Londres y solapamiento con Nueva York altos)
+HOURLY_ACTIVITY = np.array([0.6, 0.5, 0.5, 0.5, 0.55, 0.6, 0.75, 1.1, 1.4, 1.3, 1.2, 1.15,
+                            1.3, 1.6, 1.7, 1.6, 1.3, 1.0, 0.85, 0.75, 0.7, 0.65, 0.6, 0.6])
+
+def parse_span(span):
+    """Convierte '6m', '2y' o '20y' en un desplazamiento de calendario."""
+    try:
+        amount, unit = int(span[:-1]), span[-1].lower()
+        return {'m': pd.DateOffset(months=amount), 'y': pd.DateOffset(years=amount)}[unit]
+    except (ValueError, KeyError, IndexError):
+        logging.error(f"Duración inválida: {span} (use p. ej. 1m, 6m, 2y, 20y)")
+        raise ValueError(f"Duración inválida: {span}")
+
+def market_minutes(start_ns, end_ns):
+    """Minutos UTC (ns) en [start_ns, end_ns) con el mercado abierto."""
+    timestamps_ns = np.arange(start_ns, end_ns, NS_PER_MINUTE, dtype=np.int64)
+    local = pd.DatetimeIndex(timestamps_ns, tz='UTC').tz_convert(MARKET_TIMEZONE)
+    # Día de sesión: las barras desde las 17:00 pertenecen al día siguiente de Nueva York
+    session_day = (local + pd.Timedelta(hours=24 - MARKET_CLOSE_HOUR)).normalize()
+    weekday = session_day.dayofweek.to_numpy()
+    holiday = np.zeros(len(timestamps_ns), dtype=bool)
+    for month, day in HOLIDAYS:
+        holiday |= (session_day.month.to_numpy() == month) & (session_day.day.to_numpy() == day)
+    return timestamps_ns[(weekday < 5) & ~holiday]
+
+def unambiguous_minutes(timestamps_ns, timezone):
+    """Descarta los minutos cuya hora local es ambigua o inexistente en timezone (no se podrían volver a UTC)."""
+    local = pd.DatetimeIndex(timestamps_ns, tz='UTC').tz_convert(timezone).tz_localize(None)
+    roundtrip = local.tz_localize(timezone, ambiguous='NaT', nonexistent='NaT')
+    keep = ~roundtrip.isna()
+    if not keep.all():
+        logging.warning(f"{(~keep).sum()} minutos descartados por el cambio de horario de {timezone}")
+    return timestamps_ns[keep]
+
+def simulate_bars(timestamps_ns, rng, last_close, regime, price_digits=5):
+    """Simula barras OHLCV: innovaciones t de Student, estacionalidad horaria y régimen de volatilidad persistente."""
+    n = len(timestamps_ns)
+    hour = (timestamps_ns // (60 * NS_PER_MINUTE)) % 24
+    activity = HOURLY_ACTIVITY[hour]
+    # Régimen AR(1) diario en logaritmo: días tranquilos y agitados agrupados
+    day = timestamps_ns // (1440 * NS_PER_MINUTE)
+    day_index = np.unique(day, return_inverse=True)[1]
+    regimes = np.empty(day_index[-1] + 1 if n else 0)
+    for i in range(len(regimes)):
+        regime = 0.97 * regime + 0.2 * rng.standard_normal()
+        regimes[i] = regime
+    sigma = 1.1e-4 * activity * np.exp(0.35 * regimes[day_index])
+
+    returns = sigma * rng.standard_t(5, n) / np.sqrt(5 / 3)
+    close = last_close * np.exp(np.cumsum(returns))
+    open_ = np.concatenate(([last_close], close[:-1]))
+    wick = sigma * np.abs(rng.standard_normal((2, n))) * 0.6
+    scale = 10 ** price_digits
+    open_, close = np.round(open_ * scale) / scale, np.round(close * scale) / scale
+    high = np.maximum(np.round(np.maximum(open_, close) * np.exp(wick[0]) * scale) / scale, np.maximum(open_, close))
+    low = np.minimum(np.round(np.minimum(open_, close) * np.exp(-wick[1]) * scale) / scale, np.minimum(open_, close))
+    volume = rng.poisson(120 * activity * np.exp(0.5 * regimes[day_index])) + 1
+    return open_, high, low, close, volume, regime
+
+def format_bars(timestamps_ns, timezone, open_, high, low, close, volume):
+    """Da formato date/time '%Y.%m.%d', '%H:%M' en la zona horaria de salida (sin strftime por fila)."""
+    local = pd.DatetimeIndex(timestamps_ns, tz='UTC').tz_convert(timezone).tz_localize(None)
+    local_ns = local.asi8
+    days, day_index = np.unique(local_ns // (1440 * NS_PER_MINUTE), return_inverse=True)
+    day_labels = pd.to_datetime(days, unit='D').strftime('%Y.%m.%d').to_numpy()
+    minute_labels = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)], dtype=object)
+    minute_of_day = (local_ns // NS_PER_MINUTE) % 1440
+    return pd.DataFrame({
+        'date': day_labels[day_index],
+        'time': minute_labels[minute_of_day],
+        'open': open_, 'high': high, 'low': low, 'close': close,
+        'volume': volume
+    })
+
+def generate_m1(output_path, start, end, timezone='UTC', seed=0, start_price=1.15, missing_rate=0.002, price_digits=5):
+    """Genera un CSV M1 sintético y determinista en el formato de combine_financial_data.
+
+    Incluye fines de semana y festivos sin barras, minutos sueltos sin
+    cotización (missing_rate) y horas en la zona `timezone` con sus cambios
+    de horario. Se escribe año a año, así que la memoria no depende de la
+    duración. Devuelve el número de barras escritas.
+    """
+    start_ns = pd.Timestamp(start, tz='UTC').value
+    end_ns = pd.Timestamp(end, tz='UTC').value
+    if end_ns <= start_ns:
+        logging.error(f"El rango de fechas está vacío: {start} - {end}")
+        raise ValueError("Rango de fechas vacío")
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    rng = np.random.default_rng(seed)
+    last_close, regime, rows = start_price, 0.0, 0
+    year_starts = [pd.Timestamp(year=y, month=1, day=1, tz='UTC').value
+                   for y in range(pd.Timestamp(start_ns).year + 1, pd.Timestamp(end_ns).year + 1)]
+    bounds = [start_ns] + [ns for ns in year_starts if start_ns < ns < end_ns] + [end_ns]
+
+    with open(output_path + '.tmp', 'w', encoding='utf-8', newline='') as f:
+        f.write(','.join(['date', 'time', 'open', 'high', 'low', 'close', 'volume']) + '\n')
+        for block_start, block_end in zip(bounds[:-1], bounds[1:]):
+            timestamps_ns = market_minutes(block_start, block_end)
+            timestamps_ns = unambiguous_minutes(timestamps_ns[rng.random(len(timestamps_ns)) >= missing_rate], timezone)
+            if len(timestamps_ns) == 0:
+                continue
+            open_, high, low, close, volume, regime = simulate_bars(timestamps_ns, rng, last_close, regime, price_digits)
+            last_close = close[-1]
+            bars = format_bars(timestamps_ns, timezone, open_, high, low, close, volume)
+            bars.to_csv(f, header=False, index=False, float_format=f'%.{price_digits}f', lineterminator='\n')
+            rows += len(bars)
+            logging.info(f"{pd.Timestamp(block_start).year}: {len(bars)} barras")
+    os.replace(output_path + '.tmp', output_path)
+    logging.info(f"Datos sintéticos guardados en {output_path} ({rows} barras M1, zona {timezone})")
+    return rows
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Genera datos M1 OHLCV sintéticos y deterministas para pruebas y benchmarks.")
+    parser.add_argument('--end', default='2024-01-01', help="Fecha final UTC (exclusiva)")
+    parser.add_argument('--span', default='2y', help="Duración hacia atrás desde --end: 1m ... 20y")
+    parser.add_argument('--start', help="Fecha inicial UTC (sustituye a --span)")
+    parser.add_argument('--timezone', default=None, help="Zona horaria de date/time (por defecto FINANCIAL_DATA_TIMEZONE)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing-rate', type=float, default=0.002, help="Fracción de minutos de mercado sin barra")
+    parser.add_argument('--output', default=None, help="CSV de salida (por defecto FINANCIAL_DATA_PATH/FINANCIAL_CSV)")
+    args = parser.parse_args()
+
+    end = pd.Timestamp(args.end)
+    start = pd.Timestamp(args.start) if args.start else end - parse_span(args.span)
+    output_path = args.output or os.path.join(settings.FINANCIAL_DATA_PATH, settings.FINANCIAL_CSV)
+    generate_m1(output_path, start, end, args.timezone or settings.FINANCIAL_DATA_TIMEZONE or 'UTC', args.seed, missing_rate=args.missing_rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import calculate_lunar_phases as phases
+from combined_storage import CombinedWriter, append_combined
+from data_quality import QualityScan, save_quality
+from metrics_engine import segment_metrics
+from phase_tagging import NS_PER_DAY, NS_PER_MINUTE, to_epoch_ns
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Bytes finales del tramo ya leído que se comparan para comprobar que el CSV sólo ha crecido
+TAIL_BYTES = 256
+PENDING_DTYPES = {'timestamp': 'int64', 'close': 'float64', 'high': 'float64', 'low': 'float64',
+                  'phase_code': 'int8', 'period_code': 'int8'}
+PENDING_COLUMNS = list(PENDING_DTYPES)
+
+class QuantileSketch:
+    """Boceto de cuantiles fusionable.
+
+    Guarda los valores exactos hasta `capacity` (QUANTILE_SKETCH_CAPACITY por
+    defecto); a partir de ahí los agrupa en
+    centroides ponderados de peso similar. Mientras no se comprime, quantile()
+    coincide con np.percentile (interpolación lineal).
+    """
+
+    def __init__(self, capacity=None, values=None, weights=None):
+        self.capacity = settings.QUANTILE_SKETCH_CAPACITY if capacity is None else capacity
+        self.values = np.asarray(values if values is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else np.ones(len(self.values)), dtype=np.float64)
+
+    def add(self, values, weights=None):
+        """Añade valores (ignorando NaN) y comprime si se supera la capacidad."""
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+        finite = np.isfinite(values)
+        self.values = np.concatenate((self.values, values[finite]))
+        self.weights = np.concatenate((self.weights, weights[finite]))
+        if len(self.values) > self.capacity:
+            self._compress()
+
+    def merge(self, other):
+        """Incorpora otro boceto."""
+        self.add(other.values, other.weights)
+
+    def _compress(self):
+        """Reduce el boceto a capacity // 2 centroides de peso acumulado equiespaciado."""
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        cumulative = np.cumsum(weights)
+        groups = np.minimum((cumulative - weights / 2) / cumulative[-1] * (self.capacity // 2), self.capacity // 2 - 1).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        group_weights = np.add.reduceat(weights, starts)
+        self.values = np.add.reduceat(values * weights, starts) / group_weights
+        self.weights = group_weights
+
+    def quantile(self, q):
+        """Cuantil q (0-1) de los valores añadidos."""
+        if len(self.values) == 0:
+            return np.nan
+        if np.all(self.weights == 1.0):
+            return float(np.percentile(self.values, q * 100))
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        centers = np.cumsum(weights) - weights / 2
+        return float(np.interp(q * weights.sum(), centers, values))
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'values': self.values.tolist(), 'weights': self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['capacity'], data['values'], data['weights'])
+
+class PhaseAccumulator:
+    """Estadísticos suficientes de las métricas diarias de una combinación (fase, período).
+
+    Mantiene el estado de Welford (n, media, M2) del retorno medio diario, la suma
+    de volatilidades, el número de barras y un boceto de cuantiles; dos
+    acumuladores se pueden fusionar sin volver a los datos.
+    """
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, volatility_sum=0.0, volatility_n=0, bars=0, sketch=None):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+        self.volatility_sum = volatility_sum
+        self.volatility_n = volatility_n
+        self.bars = bars
+        self.sketch = sketch or QuantileSketch()
+
+    def add(self, mean_returns, volatilities, counts):
+        """Añade las filas diarias de un bloque (fusión de Welford con los momentos del bloque)."""
+        returns = np.asarray(mean_returns, dtype=np.float64)
+        returns = returns[np.isfinite(returns)]
+        if len(returns):
+            self.merge_moments(len(returns), returns.mean(), ((returns - returns.mean()) ** 2).sum())
+            self.sketch.add(returns)
+        volatilities = np.asarray(volatilities, dtype=np.float64)
+        volatilities = volatilities[np.isfinite(volatilities)]
+        self.volatility_sum += float(volatilities.sum())
+        self.volatility_n += len(volatilities)
+        self.bars += int(np.sum(counts))
+
+    def merge_moments(self, n, mean, m2):
+        """Fusiona media y M2 de otro conjunto (Chan et al.)."""
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+
+    def merge(self, other):
+        """Fusiona otro acumulador."""
+        if other.n:
+            self.merge_moments(other.n, other.mean, other.m2)
+        self.volatility_sum += other.volatility_sum
+        self.volatility_n += other.volatility_n
+        self.bars += other.bars
+        self.sketch.merge(other.sketch)
+
+    def copy(self):
+        return PhaseAccumulator.from_dict(self.to_dict())
+
+    def result(self):
+        """Estadísticos con las mismas columnas que statistics_by_phase_period.csv."""
+        return {
+            'mean_return': self.mean if self.n else np.nan,
+            'median_return': self.sketch.quantile(0.5),
+            'std_return': np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan,
+            'return_p25': self.sketch.quantile(0.25),
+            'return_p75': self.sketch.quantile(0.75),
+            'mean_volatility': self.volatility_sum / self.volatility_n if self.volatility_n else np.nan,
+            'count_days': self.bars
+        }
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2, 'volatility_sum': self.volatility_sum,
+                'volatility_n': self.volatility_n, 'bars': self.bars, 'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['n'], data['mean'], data['m2'], data['volatility_sum'], data['volatility_n'],
+                   data['bars'], QuantileSketch.from_dict(data['sketch']))
+
+def accumulate_days(accumulators, metrics):
+    """Suma las filas diarias de segment_metrics a los acumuladores por (fase, período)."""
+    keys = np.stack((metrics['phase_code'], metrics['period_code']), axis=1)
+    for phase_code, period_code in np.unique(keys, axis=0):
+        mask = (metrics['phase_code'] == phase_code) & (metrics['period_code'] == period_code)
+        key = f'{int(phase_code)},{int(period_code)}'
+        accumulators.setdefault(key, PhaseAccumulator()).add(
+            metrics['mean_return'][mask], metrics['volatility'][mask], metrics['count'][mask])
+
+def frame_metrics(frame, gap_ns=None, session_starts_ns=None):
+    """segment_metrics diario sobre un bloque con columnas PENDING_COLUMNS."""
+    return segment_metrics(frame['timestamp'].to_numpy(), frame['close'].to_numpy(), frame['high'].to_numpy(),
+                           frame['low'].to_numpy(), frame['phase_code'].to_numpy(), frame['period_code'].to_numpy(),
+                           gap_ns=gap_ns, session_starts_ns=session_starts_ns)
+
+def state_config(gap_ns):
+    """Configuración de la que dependen los acumuladores; si cambia, el estado se descarta."""
+    return {'phases': phases.phase_cache_key(), 'period_cuts': [int(cut) for cut in settings.period_cuts_ns],
+            'period_labels': list(settings.period_labels), 'timezone': settings.FINANCIAL_DATA_TIMEZONE, 'gap_ns': gap_ns,
+            'price_decimals': settings.PRICE_DECIMALS, 'session_gap_minutes': settings.SESSION_GAP_MINUTES,
+            'reset_sessions': settings.RESET_RETURNS_AT_SESSIONS, 'drop_invalid_bars': settings.DROP_INVALID_BARS}
+
+def file_tail_hash(path, offset):
+    """Hash de los TAIL_BYTES anteriores a offset."""
+    with open(path, 'rb') as f:
+        f.seek(max(offset - TAIL_BYTES, 0))
+        return hashlib.sha256(f.read(min(offset, TAIL_BYTES))).hexdigest()
+
+class IncrementalState:
+    """Estado persistente del modo incremental: marca de agua, posición en el CSV, día pendiente y acumuladores.
+
+    quality es el estado de la revisión de calidad (QualityScan.to_dict) al
+    final de la última lectura completa, junto con offset.
+    """
+
+    def __init__(self, state_dir=None):
+        state_dir = settings.INCREMENTAL_STATE_DIR if state_dir is None else state_dir
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, 'state.json')
+        self.pending_path = os.path.join(state_dir, 'pending.parquet')
+        self.watermark = None
+        self.source = None
+        self.offset = 0
+        self.tail_hash = None
+        self.config = None
+        self.anchor = False
+        self.accumulators = {}
+        self.quality = None
+        self.pending = pd.DataFrame({col: pd.Series(dtype=PENDING_DTYPES[col]) for col in PENDING_COLUMNS})
+
+    @property
+    def exists(self):
+        return os.path.exists(self.state_path)
+
+    def load(self):
+        with open(self.state_path, encoding='utf-8') as f:
+            data = json.load(f)
+        self.watermark = data['watermark']
+        self.source = data['source']
+        self.offset = data['offset']
+        self.tail_hash = data['tail_hash']
+        self.config = data['config']
+        self.anchor = data['anchor']
+        self.accumulators = {key: PhaseAccumulator.from_dict(value) for key, value in data['accumulators'].items()}
+        self.quality = data.get('quality')
+        if os.path.exists(self.pending_path):
+            self.pending = pd.read_parquet(self.pending_path)
+        return self
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.pending.to_parquet(self.pending_path + '.tmp', index=False)
+        os.replace(self.pending_path + '.tmp', self.pending_path)
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                'watermark': self.watermark,
+                'source': self.source,
+                'offset': self.offset,
+                'tail_hash': self.tail_hash,
+                'config': self.config,
+                'anchor': self.anchor,
+                'accumulators': {key: acc.to_dict() for key, acc in self.accumulators.items()},
+                'quality': self.quality
+            }, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def ingest(self, bars, gap_ns=None, session_starts_ns=None):
+        """Procesa barras nuevas ya etiquetadas (timestamp en ns y códigos de fase/período).
+
+        Las barras se unen al día pendiente y a la barra ancla (la última de un
+        día ya contabilizado, que sólo aporta el cierre para el primer retorno);
+        los días completos pasan a los acumuladores y el último día queda
+        pendiente hasta la próxima ejecución.
+        """
+        frame = pd.concat([self.pending, bars[PENDING_COLUMNS]], ignore_index=True)
+        days = frame['timestamp'].to_numpy() // NS_PER_DAY
+        metrics = frame_metrics(frame, gap_ns, session_starts_ns)
+        bucket_days = metrics['bucket'] // NS_PER_DAY
+        complete = bucket_days < days[-1]
+        if self.anchor:
+            complete &= bucket_days != days[0]
+        accumulate_days(self.accumulators, {name: values[complete] for name, values in metrics.items()})
+
+        first_pending = int(np.searchsorted(days, days[-1], side='left'))
+        self.anchor = first_pending > 0
+        self.pending = frame.iloc[max(first_pending - 1, 0):].reset_index(drop=True)
+        self.watermark = int(frame['timestamp'].iloc[-1])
+
+    def statistics(self, gap_ns=None, session_starts_ns=None):
+        """Estadísticos por (fase, período) incluyendo el día pendiente, sin modificar el estado."""
+        accumulators = {key: acc.copy() for key, acc in self.accumulators.items()}
+        if len(self.pending):
+            metrics = frame_metrics(self.pending, gap_ns, session_starts_ns)
+            if self.anchor:
+                anchor_bucket = self.pending['timestamp'].iloc[0] // NS_PER_DAY * NS_PER_DAY
+                metrics = {name: values[metrics['bucket'] != anchor_bucket] for name, values in metrics.items()}
+            accumulate_days(accumulators, metrics)
+
+        rows = []
+        for key in sorted(accumulators, key=lambda k: tuple(int(code) for code in k.split(','))):
+            phase_code, period_code = (int(code) for code in key.split(','))
+            rows.append({'lunar_phase': phases.PHASE_NAMES_ES[phase_code], 'period': settings.period_labels[period_code],
+                         **accumulators[key].result()})
+        return pd.DataFrame(rows)
+
+def appended_only(state, financial_path):
+    """True si el CSV sólo ha crecido desde la última lectura completa (el tramo ya leído no cambió)."""
+    size = os.path.getsize(financial_path)
+    return (state.source == os.path.abspath(financial_path) and 0 < state.offset <= size
+            and file_tail_hash(financial_path, state.offset) == state.tail_hash)
+
+def read_new_bars(state, financial_path, chunksize, appended_only):
+    """Itera sobre los bloques del CSV posteriores a la marca de agua.
+
+    Si el CSV sólo ha crecido desde la última ejecución se lee a partir de la
+    posición guardada; en otro caso se relee entero y se filtra por timestamp.
+    """
+    read_options = phases.financial_csv_options(financial_path)
+    names = list(pd.read_csv(financial_path, nrows=0).columns) if read_options['header'] == 0 else read_options['names']
+    size = os.path.getsize(financial_path)
+
+    if appended_only and state.offset == size:
+        logging.info(f"{financial_path} no tiene datos nuevos desde la última ejecución")
+        return
+
+    with open(financial_path, 'rb') as f:
+        if appended_only:
+            logging.info(f"Leyendo {financial_path} desde el byte {state.offset} ({size - state.offset} bytes nuevos)")
+            f.seek(state.offset)
+            reader = pd.read_csv(f, header=None, names=names, chunksize=chunksize)
+        else:
+            if state.exists:
+                logging.warning(f"{financial_path} cambió desde la última ejecución; se relee completo y se filtra por la marca de agua")
+            reader = pd.read_csv(f, chunksize=chunksize, **read_options)
+        for chunk in reader:
+            yield chunk
+    state.source = os.path.abspath(financial_path)
+    state.offset = size
+    state.tail_hash = file_tail_hash(financial_path, size)
+
+def run_incremental(financial_path=None, output_dir='data/processed', state_dir=None, reset=False):
+    """Ingiere sólo las barras nuevas, actualiza el dataset combinado y statistics_by_phase_period.csv.
+
+    El estado se guarda en state_dir (INCREMENTAL_STATE_DIR por defecto).
+    """
+    financial_path = financial_path or os.path.join(settings.FINANCIAL_DATA_PATH, settings.FINANCIAL_CSV)
+    state_dir = settings.INCREMENTAL_STATE_DIR if state_dir is None else state_dir
+    gap_ns = int(settings.RETURN_GAP_MINUTES * NS_PER_MINUTE) if settings.RETURN_GAP_MINUTES > 0 else None
+    config = state_config(gap_ns)
+    state = IncrementalState(state_dir)
+    if state.exists and not reset and state.load().config != config:
+        logging.warning("La configuración de fases, períodos o retornos cambió; se reprocesa todo el histórico")
+        reset = True
+    if reset:
+        shutil.rmtree(state_dir, ignore_errors=True)
+        state = IncrementalState(state_dir)
+    bootstrap = not state.exists
+    state.config = config
+
+    df_phases = phases.generate_lunar_phase_changes()
+    boundaries_ns, boundary_codes = phases.phase_boundaries(df_phases, phases.PHASE_NAMES_ES)
+    chunksize = settings.FINANCIAL_CHUNK_SIZE if settings.FINANCIAL_CHUNK_SIZE > 0 else 500_000
+    writer = CombinedWriter(output_dir, export_csv=settings.EXPORT_COMBINED_CSV) if bootstrap else None
+    # La revisión de calidad continúa desde la última lectura completa si el CSV sólo ha crecido;
+    # si se relee entero, se revisa entero de nuevo
+    appended = appended_only(state, financial_path)
+    quality = QualityScan.from_dict(state.quality) if appended and state.quality else QualityScan()
+    new_rows = 0
+    try:
+        for chunk in read_new_bars(state, financial_path, chunksize, appended):
+            if chunk.empty:
+                continue
+            bars = phases.prepare_financial_data(chunk, boundaries_ns, boundary_codes, quality)
+            if state.watermark is not None:
+                bars = bars[to_epoch_ns(bars['timestamp']) > state.watermark]
+            if bars.empty:
+                continue
+            if writer:
+                writer.write(bars)
+            else:
+                append_combined(bars, output_dir, tag=f'{state.watermark}')
+            session_starts = quality.session_starts_ns() if settings.RESET_RETURNS_AT_SESSIONS else None
+            state.ingest(pd.DataFrame({
+                'timestamp': to_epoch_ns(bars['timestamp']),
+                'close': pd.to_numeric(bars['close']).astype('float64').to_numpy(),
+                'high': pd.to_numeric(bars['high']).astype('float64').to_numpy(),
+                'low': pd.to_numeric(bars['low']).astype('float64').to_numpy(),
+                'phase_code': bars['lunar_phase'].cat.codes.to_numpy(),
+                'period_code': bars['period'].cat.codes.to_numpy()
+            }), gap_ns, session_starts)
+            new_rows += len(bars)
+            if not writer:
+                # El dataset ya incluye el bloque: la marca de agua evita duplicarlo si se interrumpe.
+                # state.quality sigue siendo el de la última lectura completa, como offset
+                state.save()
+        if writer:
+            writer.close()
+    except Exception:
+        if writer:
+            writer.abort()
+        raise
+
+    # Índice de sesiones e informe de calidad ampliados con las barras nuevas
+    state.quality = quality.to_dict()
+    save_quality(quality, output_dir)
+    state.save()
+    stats_df = state.statistics(gap_ns, quality.session_starts_ns() if settings.RESET_RETURNS_AT_SESSIONS else None)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, 'statistics_by_phase_period.csv')
+    stats_df.to_csv(output_path, index=False)
+    logging.info(f"{new_rows} barras nuevas procesadas; marca de agua {pd.Timestamp(state.watermark, tz='UTC') if state.watermark else '-'}")
+    logging.info(f"Estadísticas descriptivas actualizadas en {output_path}")
+    return stats_df
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Actualiza el dataset y las estadísticas con las barras nuevas desde la última ejecución.")
+    parser.add_argument('--reset', action='store_true', help="Descarta el estado y reprocesa todo el histórico")
+    args = parser.parse_args()
+    run_incremental(reset=args.reset)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Presupuesto de arranque en frío (ms) por subcomando: intérprete nuevo, importaciones
+# y preparación del subcomando, sin procesar datos (ver `lunar_cli.py startup`)
+STARTUP_BUDGET_MS = {'phases': 1000, 'stats': 1200}
+
+# Cada subcomando importa sus dependencias al cargarse y devuelve la función que lo ejecuta
+def _phases():
+    import calculate_lunar_phases as phases
+    return phases.generate_lunar_phase_changes
+
+def _events():
+    import lunar_events
+    return lunar_events.generate_lunar_events
+
+def _combine():
+    import calculate_lunar_phases as phases
+    return phases.combine_financial_data
+
+def _quality():
+    import data_quality
+    return data_quality.main
+
+def _cube():
+    import ohlc_cube
+    return ohlc_cube.build_cube
+
+def _analysis(step):
+    def load():
+        import analyze_lunar_phases as analysis
+
+        def run():
+            daily_metrics = analysis.calculate_metrics(analysis.load_data())
+            getattr(analysis, step)(daily_metrics)
+        return run
+    return load
+
+def _rolling():
+    import analyze_lunar_phases as analysis
+    import rolling_window
+
+    def run():
+        daily_metrics = analysis.calculate_metrics(analysis.load_data())
+        rolling_window.save_rolling(*rolling_window.rolling_statistics(daily_metrics))
+    return run
+
+def _factors():
+    import analyze_lunar_phases as analysis
+    import factor_cube
+
+    def run():
+        cubes = factor_cube.build_factor_cubes(analysis.load_data())
+        factor_cube.save_factor_statistics(factor_cube.factor_statistics(cubes))
+    return run
+
+def _event_study():
+    import analyze_lunar_phases as analysis
+    import event_study
+
+    def run():
+        df = analysis.load_data(columns=event_study.STUDY_COLUMNS)
+        event_study.save_event_study(event_study.event_study(df))
+    return run
+
+def _stream():
+    import streaming_tagger
+    return streaming_tagger.serve
+
+def _summary():
+    import summarize_results_for_analysis as summary
+    return summary.main
+
+COMMANDS = {
+    'phases': ("Calcula la tabla de cambios de fase (data/lunar_data/lunar_phase_changes.csv)", _phases),
+    'events': ("Fases, perigeos/apogeos, nodos, ingresos zodiacales y eclipses (data/lunar_data/lunar_events.parquet)", _events),
+    'combine': ("Combina los datos M1 con fases y períodos (data/processed/combined_data/)", _combine),
+    'quality': ("Informe de calidad de la última combinación (duplicados, huecos, sesiones, cambios de horario)", _quality),
+    'cube': ("Barras OHLCV M5/M15/H1/H4/D1 precalculadas desde M1 (data/processed/ohlc_cube/)", _cube),
+    'stats': ("Estadísticas descriptivas por fase y período", _analysis('descriptive_statistics')),
+    'tests': ("Pruebas ANOVA, Kruskal-Wallis y de permutación", _analysis('statistical_tests')),
+    'plots': ("Boxplots y gráfico de tendencia", _analysis('generate_boxplots')),
+    'rolling': ("Estadísticas y pruebas por fase en ventanas móviles (ROLLING_WINDOW_MONTHS)", _rolling),
+    'factors': ("Retornos M1 por fase × período × día × hora × sesión y sus marginales (FACTOR_CUBE_FACTORS)", _factors),
+    'event-study': ("CAR y volatilidad en ±EVENT_WINDOW_MINUTES alrededor de cada cambio de fase (data/processed/event_study.csv)", _event_study),
+    'stream': ("Etiqueta en vivo las barras de stdin (fase, período, elongación) con latencias p50/p99", _stream),
+    'summary': ("Resumen en Markdown de los resultados", _summary)
+}
+
+def load_command(name):
+    """Importa los módulos de un subcomando y devuelve la función que lo ejecuta."""
+    return COMMANDS[name][1]()
+
+def measure_startup(name, repeats=3):
+    """Arranque en frío de un subcomando en segundos (mejor de `repeats` intérpretes nuevos)."""
+    code = f"import sys; sys.path.insert(0, {SCRIPTS_DIR!r}); import lunar_cli; lunar_cli.load_command({name!r})"
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def startup_report(names, repeats=3):
+    """Mide el arranque en frío de los subcomandos; devuelve los que superan su presupuesto."""
+    over_budget = []
+    for name in names:
+        elapsed_ms = measure_startup(name, repeats) * 1000
+        budget = STARTUP_BUDGET_MS.get(name)
+        if budget is not None and elapsed_ms > budget:
+            over_budget.append(name)
+            logging.warning(f"Arranque de {name}: {elapsed_ms:.0f} ms (presupuesto {budget} ms)")
+        else:
+            logging.info(f"Arranque de {name}: {elapsed_ms:.0f} ms" + (f" (presupuesto {budget} ms)" if budget else ""))
+    return over_budget
+
+def main(argv=None):
+    """Función principal."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Análisis de fases lunares y mercado Forex.")
+    parser.add_argument('--profile', action='store_true',
+                        help="Mide cada etapa (tiempo, CPU, filas/s, memoria, swe.calc_ut) y guarda reports/profile_<fecha>.json")
+    parser.add_argument('--no-tracemalloc', action='store_true', help="Con --profile, no mide el pico de tracemalloc (más rápido)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (help_text, _) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text)
+    startup = subparsers.add_parser('startup', help="Mide el arranque en frío de los subcomandos frente a su presupuesto")
+    startup.add_argument('names', nargs='*', help=f"Subcomandos a medir (por defecto: {', '.join(STARTUP_BUDGET_MS)})")
+    startup.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup':
+        unknown = [name for name in args.names if name not in COMMANDS]
+        if unknown:
+            parser.error(f"subcomandos desconocidos: {', '.join(unknown)}")
+        sys.exit(1 if startup_report(args.names or list(STARTUP_BUDGET_MS), args.repeats) else 0)
+    run = load_command(args.command)
+    if not args.profile:
+        run()
+        return
+
+    from profiling import profiler
+    profiler.enable(trace_memory=not args.no_tracemalloc)
+    try:
+        run()
+    finally:
+        profiler.write(command=args.command)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import itertools
+import logging
+import threading
+import numpy as np
+import swisseph as swe
+from numpy.polynomial import chebyshev
+from phase_tagging import NS_PER_DAY
+from settings import settings
+
+UNIX_EPOCH_JD = 2440587.5
+
+# Grado de los ajustes de Chebyshev por día UTC (CHEB_DEGREE + 1 muestras, 2 llamadas a swe.calc_ut por muestra).
+# Con grado 6 el error frente a swe.calc_ut directo es < 5e-7° en elongación y < 1e-8 en
+# iluminación en 2018-2024 (ver check_accuracy); grados mayores no lo reducen porque es el
+# ruido de interpolación de los archivos .se1, muy por debajo de su precisión (~0.001").
+CHEB_DEGREE = 6
+# Días UTC cuyos coeficientes conserva la caché (~11 años, unos pocos MB); al
+# superarlo se descartan los ajustados hace más tiempo, así que un proceso de
+# larga duración (p. ej. streaming_tagger) no crece sin límite.
+MAX_CACHED_DAYS = 4096
+
+class LunarElongation:
+    """Elongación Luna-Sol continua para arrays de timestamps mediante ajustes de Chebyshev por día.
+
+    Cada día UTC se muestrea una sola vez en los nodos de Chebyshev y los
+    coeficientes quedan en caché (como mucho max_days días); la evaluación
+    posterior es vectorial y no llama a la efeméride.
+    """
+
+    def __init__(self, degree=CHEB_DEGREE, ephe_path=None, max_days=MAX_CACHED_DAYS):
+        ephe_path = settings.EPHE_PATH if ephe_path is None else ephe_path
+        self.degree = degree
+        self.max_days = max_days
+        self.calc_ut_calls = 0
+        self._coeffs = {}
+        # streaming_tagger prepara tablas en hilos: la caché (y swe) se usan de uno en uno
+        self._lock = threading.Lock()
+        # Nodos de Chebyshev en [-1, 1] y su posición como fracción del día
+        self._nodes = np.cos(np.pi * (np.arange(degree + 1) + 0.5) / (degree + 1))
+        if ephe_path:
+            swe.set_ephe_path(ephe_path)
+
+    def _fit_day(self, day):
+        """Ajusta la diferencia de longitudes Luna-Sol (desenrollada) y la latitud lunar de un día."""
+        jd = UNIX_EPOCH_JD + day + (self._nodes + 1.0) / 2.0
+        elongation = np.empty(len(jd))
+        latitude = np.empty(len(jd))
+        for i, jd_ut in enumerate(jd):
+            sun = swe.calc_ut(jd_ut, swe.SUN)[0]
+            moon = swe.calc_ut(jd_ut, swe.MOON)[0]
+            elongation[i] = (moon[0] - sun[0]) % 360
+            latitude[i] = moon[1]
+        self.calc_ut_calls += 2 * len(jd)
+        # Los nodos van de mayor a menor x: desenrollar en orden temporal
+        order = np.argsort(self._nodes)
+        elongation[order] = np.unwrap(elongation[order], period=360.0)
+        return (chebyshev.chebfit(self._nodes, elongation, self.degree),
+                chebyshev.chebfit(self._nodes, latitude, self.degree))
+
+    def _day_fits(self, days):
+        """Coeficientes (elongación, latitud) de cada día, ajustando los que falten en la caché.
+
+        Después descarta los días más antiguos de la caché por encima de
+        max_days; los de esta llamada ya están recogidos, así que una petición
+        mayor que la caché sigue siendo correcta.
+        """
+        fits = []
+        with self._lock:
+            for day in days:
+                day = int(day)
+                if day not in self._coeffs:
+                    self._coeffs[day] = self._fit_day(day)
+                fits.append(self._coeffs[day])
+            for day in list(itertools.islice(self._coeffs, max(0, len(self._coeffs) - self.max_days))):
+                del self._coeffs[day]
+        return fits
+
+    def _evaluate(self, timestamps_ns):
+        """Evalúa los ajustes por día; devuelve (elongación desenrollada, latitud) en grados."""
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        days = timestamps_ns // NS_PER_DAY
+        x = 2.0 * (timestamps_ns - days * NS_PER_DAY) / NS_PER_DAY - 1.0
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        fits = self._day_fits(unique_days)
+        lon_coeffs = np.array([lon for lon, _ in fits])
+        lat_coeffs = np.array([lat for _, lat in fits])
+        return _clenshaw(lon_coeffs, inverse, x), _clenshaw(lat_coeffs, inverse, x)
+
+    def day_coefficients(self, first_day, last_day):
+        """Coeficientes de elongación (desenrollada) de los días UTC [first_day, last_day], uno por fila.
+
+        Ajusta los días que falten; evaluar después esas series no llama a la efeméride.
+        """
+        fits = self._day_fits(range(int(first_day), int(last_day) + 1))
+        return np.array([lon for lon, _ in fits])
+
+    def elongation(self, timestamps_ns):
+        """Elongación Luna-Sol en grados [0, 360) para timestamps int64 (ns UTC)."""
+        lon, _ = self._evaluate(timestamps_ns)
+        return lon % 360.0
+
+    def illumination(self, timestamps_ns):
+        """Fracción iluminada del disco lunar (0 = luna nueva, 1 = llena).
+
+        Usa la elongación geocéntrica en 3D (diferencia de longitudes y latitud
+        lunar) como ángulo de fase; al no corregir por la distancia Tierra-Luna
+        difiere de swe.pheno_ut en menos de 2e-3.
+        """
+        lon, lat = self._evaluate(timestamps_ns)
+        cos_elongation = np.cos(np.radians(lon)) * np.cos(np.radians(lat))
+        return (1.0 - cos_elongation) / 2.0
+
+def _clenshaw(coeffs, rows, x):
+    """Evalúa series de Chebyshev por fila: coeffs[rows[i]] en x[i] (algoritmo de Clenshaw)."""
+    b1 = np.zeros(len(x))
+    b2 = np.zeros(len(x))
+    for k in range(coeffs.shape[1] - 1, 0, -1):
+        b1, b2 = coeffs[rows, k] + 2.0 * x * b1 - b2, b1
+    return coeffs[rows, 0] + x * b1 - b2
+
+def elongation_bins(angles, num_bins):
+    """Discretiza elongaciones en num_bins sectores iguales (num_bins=8 reproduce las fases de calculate_lunar_phases)."""
+    return (np.floor(np.asarray(angles) % 360.0 / (360.0 / num_bins)).astype(np.int16)) % num_bins
+
+_default = None
+
+def lunar_elongation(timestamps_ns):
+    """Elongación continua con la caché compartida del proceso."""
+    global _default
+    if _default is None:
+        settings.configure_ephemeris()
+        _default = LunarElongation()
+    return _default.elongation(timestamps_ns)
+
+def check_accuracy(start='2018-01-01', end='2025-01-01', samples=2000, seed=0, degree=CHEB_DEGREE):
+    """Compara la interpolación con swe.calc_ut directo en instantes aleatorios; devuelve los errores máximos.
+
+    La iluminación se compara con la misma fórmula sobre swe.calc_ut
+    (error de interpolación) y con swe.pheno_ut (error del modelo).
+    """
+    rng = np.random.default_rng(seed)
+    lo = np.datetime64(start, 'ns').astype(np.int64)
+    hi = np.datetime64(end, 'ns').astype(np.int64)
+    timestamps_ns = np.sort(rng.integers(lo, hi, samples))
+    interpolator = LunarElongation(degree)
+    elongation = interpolator.elongation(timestamps_ns)
+    illumination = interpolator.illumination(timestamps_ns)
+
+    direct_elongation = np.empty(samples)
+    direct_illumination = np.empty(samples)
+    pheno_illumination = np.empty(samples)
+    for i, ts in enumerate(timestamps_ns):
+        jd_ut = UNIX_EPOCH_JD + ts / NS_PER_DAY
+        sun = swe.calc_ut(jd_ut, swe.SUN)[0]
+        moon = swe.calc_ut(jd_ut, swe.MOON)[0]
+        direct_elongation[i] = (moon[0] - sun[0]) % 360
+        cos_elongation = np.cos(np.radians(moon[0] - sun[0])) * np.cos(np.radians(moon[1]))
+        direct_illumination[i] = (1.0 - cos_elongation) / 2.0
+        pheno_illumination[i] = swe.pheno_ut(jd_ut, swe.MOON)[1]
+
+    elongation_error = np.abs((elongation - direct_elongation + 180.0) % 360.0 - 180.0)
+    return {
+        'samples': samples,
+        'max_elongation_error_deg': float(elongation_error.max()),
+        'max_illumination_error': float(np.abs(illumination - direct_illumination).max()),
+        'max_pheno_illumination_error': float(np.abs(illumination - pheno_illumination).max()),
+        'calc_ut_calls': interpolator.calc_ut_calls
+    }
+
+def main():
+    """Función principal: verifica la precisión de la interpolación."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Verifica la elongación interpolada frente a swe.calc_ut.")
+    parser.add_argument('--start', default='2018-01-01')
+    parser.add_argument('--end', default='2025-01-01')
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--degree', type=int, default=CHEB_DEGREE)
+    args = parser.parse_args()
+    result = check_accuracy(args.start, args.end, args.samples, degree=args.degree)
+    logging.info(f"Error máximo de elongación: {result['max_elongation_error_deg']:.3e}° | "
+                 f"iluminación: {result['max_illumination_error']:.3e} (frente a swe.pheno_ut: "
+                 f"{result['max_pheno_illumination_error']:.3e}) ({result['samples']} muestras)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+import swisseph as swe
+import calculate_lunar_phases as phases
+from profiling import profiler
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EVENTS_PATH = 'data/lunar_data/lunar_events.parquet'
+
+# Tipos de evento. Los de intervalo definen un estado vigente hasta el siguiente
+# evento del mismo tipo (su primera fila es el estado al inicio del rango); los
+# eclipses son instantes sueltos.
+EVENT_TYPES = ['phase', 'apsis', 'node', 'ingress', 'eclipse']
+INTERVAL_TYPES = ['phase', 'apsis', 'node', 'ingress']
+APSIS_NAMES = ['Perigeo', 'Apogeo']
+NODE_NAMES = ['Nodo ascendente', 'Nodo descendente']
+ZODIAC_SIGNS = ['Aries', 'Tauro', 'Géminis', 'Cáncer', 'Leo', 'Virgo',
+                'Libra', 'Escorpio', 'Sagitario', 'Capricornio', 'Acuario', 'Piscis']
+ECLIPSE_NAMES = ['Eclipse solar total', 'Eclipse solar anular', 'Eclipse solar híbrido', 'Eclipse solar parcial',
+                 'Eclipse lunar total', 'Eclipse lunar parcial', 'Eclipse lunar penumbral']
+EVENT_NAMES = {'phase': phases.PHASE_NAMES_ES, 'apsis': APSIS_NAMES, 'node': NODE_NAMES,
+               'ingress': ZODIAC_SIGNS, 'eclipse': ECLIPSE_NAMES}
+EVENT_COLUMNS = ['TimestampUTC', 'EventType', 'EventCode', 'EventName']
+
+# Paso (días) del muestreo que acota los cruces. La Luna recorre menos de 8° de
+# longitud en medio día, y entre dos ápsides o dos nodos pasan más de 12 días,
+# así que cada intervalo contiene como mucho un cambio de cada tipo.
+SCAN_STEP_DAYS = 0.5
+
+def moon_position(jd_ut):
+    """Longitud, latitud, distancia y sus velocidades geocéntricas de la Luna."""
+    phases.calc_ut_calls += 1
+    return swe.calc_ut(jd_ut, swe.MOON)[0]
+
+# Estado de cada tipo de intervalo en un instante y función continua que se anula en el cambio a new_state
+def apsis_state(jd_ut):
+    """0 tras el perigeo (la distancia crece), 1 tras el apogeo."""
+    return 0 if moon_position(jd_ut)[5] > 0 else 1
+
+def node_state(jd_ut):
+    """0 tras el nodo ascendente (latitud positiva), 1 tras el descendente."""
+    return 0 if moon_position(jd_ut)[1] >= 0 else 1
+
+def ingress_state(jd_ut):
+    """Signo del zodíaco tropical en el que está la Luna."""
+    return int(moon_position(jd_ut)[0] // 30.0) % 12
+
+CROSSINGS = {
+    'apsis': (apsis_state, lambda jd_ut, new_state: moon_position(jd_ut)[5]),
+    'node': (node_state, lambda jd_ut, new_state: moon_position(jd_ut)[1]),
+    'ingress': (ingress_state, lambda jd_ut, new_state: (moon_position(jd_ut)[0] - new_state * 30.0 + 180.0) % 360.0 - 180.0)
+}
+
+def snap_to_grid(jd_root, state, new_state):
+    """Primer instante de la rejilla de PHASE_TOLERANCE_SECONDS que ya está en new_state (como los cambios de fase)."""
+    step = timedelta(seconds=settings.PHASE_TOLERANCE_SECONDS)
+    change_dt = phases.ceil_to_tolerance(phases.jd_to_datetime(jd_root))
+    if state(phases.datetime_to_jd(change_dt - step)) == new_state:
+        change_dt -= step
+    elif state(phases.datetime_to_jd(change_dt)) != new_state:
+        change_dt += step
+    return change_dt
+
+def scan_crossings(event_type, range_start, range_end):
+    """Estado al inicio y cambios de un tipo de intervalo en [range_start, range_end): lista de (datetime, código).
+
+    Muestrea cada SCAN_STEP_DAYS y refina cada cambio de estado con el método de Brent.
+    """
+    from scipy.optimize import brentq
+
+    state, function = CROSSINGS[event_type]
+    jd_start, jd_end = phases.datetime_to_jd(range_start), phases.datetime_to_jd(range_end)
+    xtol = settings.PHASE_TOLERANCE_SECONDS / 86400.0 / 10.0
+    current = state(jd_start)
+    rows = [(range_start, current)]
+    for jd_a in np.arange(jd_start, jd_end, SCAN_STEP_DAYS):
+        jd_b = min(jd_a + SCAN_STEP_DAYS, jd_end)
+        new_state = state(jd_b)
+        if new_state == current:
+            continue
+        try:
+            root = brentq(function, jd_a, jd_b, args=(new_state,), xtol=xtol)
+        except ValueError as e:
+            logging.error(f"No se pudo acotar el evento {event_type} entre {phases.jd_to_datetime(jd_a)} y {phases.jd_to_datetime(jd_b)}: {e}")
+            raise RuntimeError(f"No se pudo encontrar el evento {event_type}") from e
+        change_dt = snap_to_grid(root, state, new_state)
+        if change_dt < range_end:
+            rows.append((max(change_dt, range_start), new_state))
+        current = new_state
+    return rows
+
+def eclipse_code(kind, flags):
+    """Código en ECLIPSE_NAMES según el tipo de eclipse devuelto por Swiss Ephemeris."""
+    if kind == 'solar':
+        if flags & swe.ECL_ANNULAR_TOTAL:
+            return 2
+        if flags & swe.ECL_TOTAL:
+            return 0
+        return 1 if flags & swe.ECL_ANNULAR else 3
+    if flags & swe.ECL_TOTAL:
+        return 4
+    return 5 if flags & swe.ECL_PARTIAL else 6
+
+def find_eclipses(range_start, range_end):
+    """Eclipses solares (globales) y lunares con máximo en [range_start, range_end): lista de (datetime, código)."""
+    jd_end = phases.datetime_to_jd(range_end)
+    rows = []
+    for kind, search in (('solar', swe.sol_eclipse_when_glob), ('lunar', swe.lun_eclipse_when)):
+        jd = phases.datetime_to_jd(range_start)
+        while True:
+            flags, times = search(jd, swe.FLG_SWIEPH, 0, False)
+            if times[0] >= jd_end:
+                break
+            rows.append((phases.ceil_to_tolerance(phases.jd_to_datetime(times[0])), eclipse_code(kind, flags)))
+            jd = times[0] + 1.0
+    return rows
+
+def events_frame(rows_by_type):
+    """Tabla tipada de eventos a partir de {tipo: [(datetime, código), ...]}."""
+    frames = []
+    for event_type, rows in rows_by_type.items():
+        if not rows:
+            continue
+        timestamps, codes = zip(*rows)
+        frames.append(pd.DataFrame({'TimestampUTC': pd.to_datetime(list(timestamps), utc=True),
+                                    'EventType': event_type,
+                                    'EventCode': np.asarray(codes, dtype=np.int8),
+                                    'EventName': [EVENT_NAMES[event_type][code] for code in codes]}))
+    events = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=EVENT_COLUMNS)
+    events['TimestampUTC'] = pd.to_datetime(events['TimestampUTC'], utc=True)
+    events['EventType'] = pd.Categorical(events['EventType'], categories=EVENT_TYPES)
+    events['EventCode'] = events['EventCode'].astype(np.int8)
+    events['EventName'] = pd.Categorical(events['EventName'], categories=[name for t in EVENT_TYPES for name in EVENT_NAMES[t]])
+    return events.sort_values(['TimestampUTC', 'EventType'], kind='stable').reset_index(drop=True)[EVENT_COLUMNS]
+
+def compute_shard(range_start, range_end, event_types=EVENT_TYPES):
+    """Eventos de un tramo [range_start, range_end); los tramos son independientes entre sí."""
+    settings.configure_ephemeris()
+    rows = {}
+    for event_type in event_types:
+        if event_type == 'phase':
+            table = phases.compute_phase_changes(range_start, range_end)
+            codes = pd.Categorical(table['PhaseName'], categories=phases.PHASE_NAMES_ES).codes
+            rows[event_type] = list(zip(table['TimestampUTC'], codes))
+        elif event_type == 'eclipse':
+            rows[event_type] = find_eclipses(range_start, range_end)
+        else:
+            rows[event_type] = scan_crossings(event_type, range_start, range_end)
+    return events_frame(rows)
+
+def year_shards(range_start, range_end):
+    """Divide [range_start, range_end) en tramos por año natural."""
+    bounds = [range_start] + [datetime(year, 1, 1, tzinfo=timezone.utc) for year in range(range_start.year + 1, range_end.year + 1)]
+    bounds = [bound for bound in bounds if bound < range_end] + [range_end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def stitch_shards(tables):
+    """Une los tramos: en los tipos de intervalo descarta las filas que no cambian de estado (la primera de cada tramo salvo cambio justo en el límite)."""
+    events = pd.concat(tables, ignore_index=True).sort_values(['TimestampUTC', 'EventType'], kind='stable')
+    events = events.drop_duplicates(['TimestampUTC', 'EventType', 'EventCode'])
+    previous = events.groupby('EventType', observed=True)['EventCode'].shift()
+    repeated = events['EventType'].isin(INTERVAL_TYPES) & (events['EventCode'] == previous)
+    return events[~repeated].reset_index(drop=True)
+
+def _init_worker():
+    """Configura Swiss Ephemeris una vez por proceso del pool."""
+    logging.getLogger().setLevel(logging.WARNING)
+    settings.configure_ephemeris()
+
+@profiler.profile('events', rows=len)
+def compute_events(range_start=None, range_end=None, event_types=EVENT_TYPES, workers=None):
+    """Tabla de eventos lunares de [range_start, range_end) calculada por años en paralelo (EVENT_WORKERS procesos por defecto).
+
+    Columnas: TimestampUTC (datetime UTC), EventType y EventName (categóricas) y
+    EventCode (int8, índice de EventName dentro de su tipo).
+    """
+    range_start = range_start or settings.start_date
+    range_end = range_end or settings.end_date
+    workers = settings.EVENT_WORKERS if workers is None else workers
+    unknown = [event_type for event_type in event_types if event_type not in EVENT_TYPES]
+    if unknown:
+        logging.error(f"Tipos de evento desconocidos: {unknown}")
+        raise ValueError(f"Tipos de evento desconocidos: {unknown}")
+    shards = year_shards(range_start, range_end)
+    logging.info(f"Calculando eventos {', '.join(event_types)} de {range_start} a {range_end} en {len(shards)} tramos con {workers} procesos")
+    if workers > 1 and len(shards) > 1:
+        # spawn: un proceso bifurcado heredaría los archivos de efemérides ya abiertos y su posición de lectura compartida
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker) as executor:
+            tables = list(executor.map(compute_shard, *zip(*shards), [event_types] * len(shards)))
+    else:
+        tables = [compute_shard(start, end, event_types) for start, end in shards]
+    events = stitch_shards(tables)
+    logging.info(f"{len(events)} eventos: " + ", ".join(f"{t} {n}" for t, n in events['EventType'].value_counts(sort=False).items() if n))
+    return events
+
+def save_events(events, output_path=EVENTS_PATH):
+    """Guarda la tabla en Parquet (conserva los tipos categóricos)."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    events.to_parquet(output_path + '.tmp', index=False)
+    os.replace(output_path + '.tmp', output_path)
+    logging.info(f"Eventos lunares guardados en {output_path}")
+    return output_path
+
+def read_events(path=EVENTS_PATH):
+    """Lee la tabla de eventos guardada por save_events."""
+    if not os.path.exists(path):
+        logging.error(f"Archivo no encontrado: {path}")
+        raise FileNotFoundError(f"Archivo no encontrado: {path}")
+    return pd.read_parquet(path)
+
+def generate_lunar_events(event_types=EVENT_TYPES, workers=None):
+    """Calcula y guarda los eventos de START_DATE a END_DATE."""
+    return save_events(compute_events(event_types=event_types, workers=workers))
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Calcula fases, perigeos/apogeos, nodos, ingresos zodiacales y eclipses por años en paralelo.")
+    parser.add_argument('--types', nargs='+', default=EVENT_TYPES, choices=EVENT_TYPES, help="Tipos de evento (por defecto todos)")
+    parser.add_argument('--workers', type=int, help="Número de procesos (EVENT_WORKERS)")
+    args = parser.parse_args()
+    generate_lunar_events(args.types, args.workers)
+
+if __name__ == "__main__":
+    main()
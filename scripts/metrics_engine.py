@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+from combined_storage import price_array
+from phase_tagging import NS_PER_DAY, to_epoch_ns
+
+# Campos que devuelve segment_metrics
+METRIC_FIELDS = ('bucket', 'phase_code', 'period_code', 'mean_return', 'volatility', 'high', 'low', 'count',
+                 'range', 'mean_abs_return', 'realized_variance')
+INTEGER_FIELDS = ('bucket', 'phase_code', 'period_code', 'count')
+
+def log_returns(close, timestamps_ns=None, gap_ns=None, session_starts_ns=None):
+    """Retornos logarítmicos barra a barra; con gap_ns, el retorno que cruza un hueco mayor queda en NaN.
+
+    Con session_starts_ns (índice de sesiones de data_quality.py) también
+    queda en NaN el retorno de la primera barra de cada sesión.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    returns = np.empty(len(close))
+    returns[:1] = np.nan
+    np.log(close[1:] / close[:-1], out=returns[1:])
+    if gap_ns is not None and timestamps_ns is not None:
+        returns[1:][np.diff(timestamps_ns) > gap_ns] = np.nan
+    if session_starts_ns is not None and timestamps_ns is not None:
+        returns[np.isin(timestamps_ns, session_starts_ns)] = np.nan
+    return returns
+
+def segment_starts(*keys):
+    """Índices donde empieza cada tramo contiguo con las mismas claves (arrays ya ordenados)."""
+    n = len(keys[0])
+    change = np.zeros(max(n - 1, 0), dtype=bool)
+    for key in keys:
+        change |= key[1:] != key[:-1]
+    return np.concatenate(([0], np.flatnonzero(change) + 1)) if n else np.array([], dtype=np.int64)
+
+def segment_metrics(timestamps_ns, close, high, low, phase_codes, period_codes, bucket_ns=NS_PER_DAY, gap_ns=None,
+                    session_starts_ns=None):
+    """Métricas por (intervalo de bucket_ns, fase, período) mediante reducciones por tramos.
+
+    Los arrays deben estar ordenados por tiempo, de modo que cada grupo es un
+    tramo contiguo. Los tramos con código de fase o período negativo (sin
+    etiqueta) se descartan, igual que groupby con dropna. Devuelve un dict de
+    arrays: bucket (ns), phase_code, period_code, mean_return, volatility
+    (desviación estándar con ddof=1), high, low, count, range,
+    mean_abs_return y realized_variance.
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    if len(timestamps_ns) == 0:
+        return {name: np.array([], dtype=np.int64 if name in INTEGER_FIELDS else np.float64) for name in METRIC_FIELDS}
+    returns = log_returns(close, timestamps_ns, gap_ns, session_starts_ns)
+    buckets = timestamps_ns // bucket_ns
+    phase_codes = np.asarray(phase_codes)
+    period_codes = np.asarray(period_codes)
+
+    starts = segment_starts(buckets, phase_codes, period_codes)
+    lengths = np.diff(np.append(starts, len(timestamps_ns)))
+    # Los retornos no válidos (NaN) cuentan como 0 en las sumas y no en los conteos
+    valid = np.isfinite(returns)
+    clean = np.where(valid, returns, 0.0)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, np.add.reduceat(clean, starts) / counts, np.nan)
+
+    # Segunda pasada: desviaciones respecto a la media de su tramo
+    deviations = clean - np.repeat(np.nan_to_num(means), lengths)
+    deviations[~valid] = 0.0
+    squared_dev = np.add.reduceat(deviations * deviations, starts)
+    squared = np.add.reduceat(clean * clean, starts)
+    absolute = np.add.reduceat(np.abs(clean), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        volatility = np.where(counts > 1, np.sqrt(squared_dev / (counts - 1)), np.nan)
+        mean_abs = np.where(counts > 0, absolute / counts, np.nan)
+    realized_variance = np.where(counts > 0, squared, np.nan)
+
+    seg_high = np.maximum.reduceat(np.asarray(high, dtype=np.float64), starts)
+    seg_low = np.minimum.reduceat(np.asarray(low, dtype=np.float64), starts)
+    seg_phase = phase_codes[starts]
+    seg_period = period_codes[starts]
+    keep = (seg_phase >= 0) & (seg_period >= 0)
+    result = {
+        'bucket': buckets[starts] * bucket_ns,
+        'phase_code': seg_phase,
+        'period_code': seg_period,
+        'mean_return': means,
+        'volatility': volatility,
+        'high': seg_high,
+        'low': seg_low,
+        'count': lengths,
+        'range': seg_high - seg_low,
+        'mean_abs_return': mean_abs,
+        'realized_variance': realized_variance
+    }
+    return {name: values[keep] for name, values in result.items()}
+
+def daily_metrics_frame(df, bucket_ns=NS_PER_DAY, gap_ns=None, session_starts_ns=None):
+    """Calcula las métricas por día (o bucket_ns), fase lunar y período de un DataFrame combinado.
+
+    Las columnas lunar_phase y period se tratan como códigos categóricos y los
+    precios pueden estar en el esquema compacto; el resultado sigue el orden
+    de groupby(['date', 'lunar_phase', 'period']).
+    """
+    if not df['timestamp'].is_monotonic_increasing:
+        attrs = df.attrs
+        df = df.sort_values('timestamp', kind='stable')
+        df.attrs = attrs
+    phases = pd.Categorical(df['lunar_phase'])
+    periods = pd.Categorical(df['period'])
+    metrics = segment_metrics(to_epoch_ns(df['timestamp']), price_array(df, 'close'), price_array(df, 'high'),
+                              price_array(df, 'low'), phases.codes, periods.codes, bucket_ns, gap_ns, session_starts_ns)
+    return metrics_frame(metrics, phases.categories, periods.categories)
+
+def metrics_frame(metrics, phase_categories, period_categories):
+    """DataFrame de métricas (dict de segment_metrics) ordenado por bucket, fase y período."""
+    order = np.lexsort((metrics['period_code'], metrics['phase_code'], metrics['bucket']))
+    metrics = {name: values[order] for name, values in metrics.items()}
+    return pd.DataFrame({
+        'date': pd.to_datetime(metrics['bucket'], unit='ns'),
+        'lunar_phase': pd.Categorical.from_codes(metrics['phase_code'], categories=phase_categories),
+        'period': pd.Categorical.from_codes(metrics['period_code'], categories=period_categories),
+        'mean_return': metrics['mean_return'],
+        'volatility': metrics['volatility'],
+        'high': metrics['high'],
+        'low': metrics['low'],
+        'count': metrics['count'],
+        'range': metrics['range'],
+        'mean_abs_return': metrics['mean_abs_return'],
+        'realized_variance': metrics['realized_variance']
+    })
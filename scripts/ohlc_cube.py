@@ -0,0 +1,281 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from combined_storage import COMBINED_CSV, COMBINED_DATASET, combined_years, price_array, read_combined
+from data_quality import session_starts_ns
+from metrics_engine import METRIC_FIELDS, log_returns, metrics_frame, segment_starts
+from phase_tagging import NS_PER_DAY, NS_PER_MINUTE, to_epoch_ns
+from profiling import frame_bytes, profiler
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CUBE_DIR = 'ohlc_cube'
+CUBE_METADATA = 'metadata.json'
+# Cambiar al modificar el formato de las barras para reconstruir los cubos existentes
+CUBE_VERSION = 1
+# Resoluciones del cubo; todas dividen el día UTC, así que cada una se agrega desde M5
+RESOLUTIONS = {
+    'M5': 5 * NS_PER_MINUTE,
+    'M15': 15 * NS_PER_MINUTE,
+    'H1': 60 * NS_PER_MINUTE,
+    'H4': 240 * NS_PER_MINUTE,
+    'D1': NS_PER_DAY
+}
+BASE_RESOLUTION = 'M5'
+SOURCE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'lunar_phase', 'period']
+
+def m1_to_bars(timestamps_ns, open_, high, low, close, volume, returns, phase_codes, period_codes, bucket_ns):
+    """Barras OHLCV por (intervalo de bucket_ns, fase, período) a partir de barras M1 ordenadas.
+
+    Como en segment_metrics, una barra que cruza un cambio de fase se divide y
+    las barras sin etiqueta se descartan. Además de OHLCV y count (barras M1)
+    guarda las sumas que permiten agregar a cualquier resolución mayor sin
+    volver a M1: log_return (suma de los retornos M1 válidos, NaN si no hay),
+    return_count, return_m2 (suma de cuadrados centrada), abs_return_sum y
+    realized_variance.
+    """
+    starts = segment_starts(timestamps_ns // bucket_ns, phase_codes, period_codes)
+    lengths = np.diff(np.append(starts, len(timestamps_ns)))
+    ends = starts + lengths - 1
+    valid = np.isfinite(returns)
+    clean = np.where(valid, returns, 0.0)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+    sums = np.add.reduceat(clean, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, 0.0)
+    deviations = clean - np.repeat(means, lengths)
+    deviations[~valid] = 0.0
+    bars = {
+        'bucket': timestamps_ns[starts] // bucket_ns * bucket_ns,
+        'phase_code': phase_codes[starts],
+        'period_code': period_codes[starts],
+        'open': open_[starts],
+        'high': np.maximum.reduceat(high, starts),
+        'low': np.minimum.reduceat(low, starts),
+        'close': close[ends],
+        'volume': np.add.reduceat(volume, starts),
+        'count': lengths,
+        'log_return': np.where(counts > 0, sums, np.nan),
+        'return_count': counts,
+        'return_m2': np.add.reduceat(deviations * deviations, starts),
+        'abs_return_sum': np.add.reduceat(np.abs(clean), starts),
+        'realized_variance': np.add.reduceat(clean * clean, starts)
+    }
+    keep = (bars['phase_code'] >= 0) & (bars['period_code'] >= 0)
+    return {name: values[keep] for name, values in bars.items()}
+
+def merge_bars(bars, bucket_ns):
+    """Agrega barras del cubo a una resolución mayor (bucket_ns múltiplo de la suya) sin volver a M1.
+
+    return_m2 se combina con la fórmula de Chan: la suma de los M2 de cada
+    barra más n·(media de la barra − media del grupo)².
+    """
+    if len(bars['bucket']) == 0:
+        return {name: values[:0] for name, values in bars.items()}
+    starts = segment_starts(bars['bucket'] // bucket_ns, bars['phase_code'], bars['period_code'])
+    lengths = np.diff(np.append(starts, len(bars['bucket'])))
+    counts = np.add.reduceat(bars['return_count'], starts)
+    bar_sums = np.nan_to_num(bars['log_return'])
+    sums = np.add.reduceat(bar_sums, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, 0.0)
+        bar_means = np.where(bars['return_count'] > 0, bar_sums / bars['return_count'], 0.0)
+    spread = bars['return_count'] * (bar_means - np.repeat(means, lengths)) ** 2
+    return {
+        'bucket': bars['bucket'][starts] // bucket_ns * bucket_ns,
+        'phase_code': bars['phase_code'][starts],
+        'period_code': bars['period_code'][starts],
+        'open': bars['open'][starts],
+        'high': np.maximum.reduceat(bars['high'], starts),
+        'low': np.minimum.reduceat(bars['low'], starts),
+        'close': bars['close'][starts + lengths - 1],
+        'volume': np.add.reduceat(bars['volume'], starts),
+        'count': np.add.reduceat(bars['count'], starts),
+        'log_return': np.where(counts > 0, sums, np.nan),
+        'return_count': counts,
+        'return_m2': np.add.reduceat(bars['return_m2'] + spread, starts),
+        'abs_return_sum': np.add.reduceat(bars['abs_return_sum'], starts),
+        'realized_variance': np.add.reduceat(bars['realized_variance'], starts)
+    }
+
+def bar_metrics(bars):
+    """Métricas de segment_metrics (mean_return, volatility, ...) a partir de barras del cubo."""
+    counts = bars['return_count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        metrics = {
+            'bucket': bars['bucket'],
+            'phase_code': bars['phase_code'],
+            'period_code': bars['period_code'],
+            'mean_return': np.where(counts > 0, bars['log_return'] / counts, np.nan),
+            'volatility': np.where(counts > 1, np.sqrt(bars['return_m2'] / (counts - 1)), np.nan),
+            'high': bars['high'],
+            'low': bars['low'],
+            'count': bars['count'],
+            'range': bars['high'] - bars['low'],
+            'mean_abs_return': np.where(counts > 0, bars['abs_return_sum'] / counts, np.nan),
+            'realized_variance': np.where(counts > 0, bars['realized_variance'], np.nan)
+        }
+    return {name: metrics[name] for name in METRIC_FIELDS}
+
+def frame_to_bars(df):
+    """Convierte un DataFrame del cubo (read_cube) a dict de arrays y devuelve también las categorías."""
+    phases = pd.Categorical(df['lunar_phase'])
+    periods = pd.Categorical(df['period'])
+    bars = {name: df[name].to_numpy() for name in ['open', 'high', 'low', 'close', 'volume', 'count', 'log_return',
+                                                   'return_count', 'return_m2', 'abs_return_sum', 'realized_variance']}
+    bars.update({'bucket': to_epoch_ns(df['timestamp']), 'phase_code': phases.codes, 'period_code': periods.codes})
+    return bars, phases.categories, periods.categories
+
+def cube_metrics_frame(df, bucket_ns):
+    """Métricas por (bucket_ns, fase, período) desde barras del cubo, con las columnas de daily_metrics_frame."""
+    bars, phase_categories, period_categories = frame_to_bars(df)
+    return metrics_frame(bar_metrics(merge_bars(bars, bucket_ns)), phase_categories, period_categories)
+
+def source_signature(input_dir):
+    """Firma del dataset combinado (rutas, tamaños y mtimes) para detectar un cubo desactualizado."""
+    dataset_path = os.path.join(input_dir, COMBINED_DATASET)
+    paths = [os.path.join(root, name) for root, _, files in os.walk(dataset_path) for name in files] \
+        if os.path.isdir(dataset_path) else [os.path.join(input_dir, COMBINED_CSV)]
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.relpath(path, input_dir)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def gap_ns_from_settings():
+    return int(settings.RETURN_GAP_MINUTES * NS_PER_MINUTE) if settings.RETURN_GAP_MINUTES > 0 else None
+
+def bars_frame(bars, phase_categories, period_categories):
+    """DataFrame de barras para guardar en Parquet (timestamp int64 en ns UTC)."""
+    frame = {'timestamp': bars['bucket'],
+             'lunar_phase': pd.Categorical.from_codes(bars['phase_code'], categories=phase_categories),
+             'period': pd.Categorical.from_codes(bars['period_code'], categories=period_categories)}
+    frame.update({name: values for name, values in bars.items() if name not in ('bucket', 'phase_code', 'period_code')})
+    return pd.DataFrame(frame)
+
+@profiler.profile('cube')
+def build_cube(input_dir='data/processed', gap_ns=None):
+    """Construye las barras M5/M15/H1/H4/D1 en una sola pasada sobre los datos M1 combinados.
+
+    Lee el dataset año a año (la memoria queda acotada por un año de M1) y
+    encadena los retornos entre años. M5 se calcula desde M1 y las demás
+    resoluciones desde M5. Guarda <input_dir>/ohlc_cube/<resolución>.parquet
+    y metadata.json con la firma de la fuente, RETURN_GAP_MINUTES y
+    RESET_RETURNS_AT_SESSIONS.
+    """
+    gap_ns = gap_ns_from_settings() if gap_ns is None else gap_ns
+    reset_sessions = settings.RESET_RETURNS_AT_SESSIONS
+    starts = session_starts_ns(input_dir) if reset_sessions else None
+    years = combined_years(input_dir) or [None]
+    levels = {resolution: [] for resolution in RESOLUTIONS}
+    signature = source_signature(input_dir)
+    previous = None
+    phase_categories = period_categories = None
+    for year in years:
+        with profiler.stage('read') as step:
+            df = read_combined(input_dir, columns=SOURCE_COLUMNS, years=None if year is None else [year], compact=True)
+            step.rows = len(df)
+            step.frame_bytes = frame_bytes(df)
+        if df.empty:
+            continue
+        if phase_categories is None:
+            phase_categories = pd.Categorical(df['lunar_phase']).categories
+            period_categories = pd.Categorical(df['period']).categories
+        phase_codes = pd.Categorical(df['lunar_phase'], categories=phase_categories).codes
+        period_codes = pd.Categorical(df['period'], categories=period_categories).codes
+        if ((phase_codes < 0) & df['lunar_phase'].notna().to_numpy()).any() or ((period_codes < 0) & df['period'].notna().to_numpy()).any():
+            logging.error(f"Las etiquetas de fase o período del año {year} no coinciden con las del resto del dataset")
+            raise ValueError("Etiquetas inconsistentes en el dataset combinado")
+
+        with profiler.stage('bars') as step:
+            timestamps_ns = to_epoch_ns(df['timestamp'])
+            close = price_array(df, 'close')
+            # El primer retorno del año usa la última barra del año anterior
+            if previous is None:
+                returns = log_returns(close, timestamps_ns, gap_ns, starts)
+            else:
+                returns = log_returns(np.r_[previous[1], close], np.r_[previous[0], timestamps_ns], gap_ns, starts)[1:]
+            previous = (timestamps_ns[-1], close[-1])
+            base = m1_to_bars(timestamps_ns, price_array(df, 'open'), price_array(df, 'high'),
+                              price_array(df, 'low'), close, df['volume'].to_numpy(dtype=np.float64),
+                              returns, phase_codes, period_codes, RESOLUTIONS[BASE_RESOLUTION])
+            levels[BASE_RESOLUTION].append(base)
+            for resolution, bucket_ns in RESOLUTIONS.items():
+                if resolution != BASE_RESOLUTION:
+                    levels[resolution].append(merge_bars(base, bucket_ns))
+            step.rows = len(df)
+        logging.info(f"Cubo OHLC: {year if year is not None else 'datos'} procesado ({len(df)} barras M1)")
+
+    if phase_categories is None:
+        logging.error(f"El dataset combinado de {input_dir} está vacío")
+        raise ValueError("Dataset combinado vacío")
+
+    output_path = os.path.join(input_dir, CUBE_DIR)
+    shutil.rmtree(output_path + '.tmp', ignore_errors=True)
+    os.makedirs(output_path + '.tmp')
+    metadata = {'version': CUBE_VERSION, 'gap_ns': gap_ns, 'reset_sessions': reset_sessions, 'source': signature, 'rows': {}}
+    with profiler.stage('write'):
+        for resolution, parts in levels.items():
+            bars = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+            bars_frame(bars, phase_categories, period_categories).to_parquet(
+                os.path.join(output_path + '.tmp', f'{resolution}.parquet'), index=False)
+            metadata['rows'][resolution] = len(bars['bucket'])
+        with open(os.path.join(output_path + '.tmp', CUBE_METADATA), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=1)
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(output_path + '.tmp', output_path)
+    logging.info(f"Cubo OHLC guardado en {output_path}: " + ', '.join(f"{res} {rows} barras" for res, rows in metadata['rows'].items()))
+    return metadata
+
+def cube_is_current(input_dir='data/processed', gap_ns=None):
+    """True si el cubo existe y corresponde al dataset combinado actual, a RETURN_GAP_MINUTES y a RESET_RETURNS_AT_SESSIONS."""
+    gap_ns = gap_ns_from_settings() if gap_ns is None else gap_ns
+    try:
+        with open(os.path.join(input_dir, CUBE_DIR, CUBE_METADATA), encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return (metadata.get('version') == CUBE_VERSION and metadata.get('gap_ns') == gap_ns
+            and metadata.get('reset_sessions', False) == settings.RESET_RETURNS_AT_SESSIONS
+            and metadata.get('source') == source_signature(input_dir))
+
+def read_cube(input_dir='data/processed', resolution='D1', periods=None, years=None, rebuild=True):
+    """Lee las barras de una resolución del cubo (reconstruyéndolo si falta o está desactualizado).
+
+    La columna timestamp es el inicio de la barra como datetime64[ns, UTC];
+    df.attrs guarda la resolución, el gap_ns y reset_sessions con que se calcularon los retornos.
+    """
+    if resolution not in RESOLUTIONS:
+        logging.error(f"Resolución desconocida: {resolution}. Disponibles: {', '.join(RESOLUTIONS)}")
+        raise ValueError(f"Resolución desconocida: {resolution}")
+    gap_ns = gap_ns_from_settings()
+    if not cube_is_current(input_dir, gap_ns):
+        if not rebuild:
+            logging.error(f"El cubo OHLC de {input_dir} no existe o está desactualizado")
+            raise FileNotFoundError(f"Cubo OHLC no disponible en {input_dir}")
+        logging.info("El cubo OHLC no existe o está desactualizado; reconstruyendo desde M1")
+        build_cube(input_dir, gap_ns)
+
+    path = os.path.join(input_dir, CUBE_DIR, f'{resolution}.parquet')
+    filters = [('period', 'in', list(periods))] if periods is not None else None
+    df = pd.read_parquet(path, filters=filters)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ns', utc=True)
+    if years is not None:
+        df = df[df['timestamp'].dt.year.isin([int(year) for year in years])].reset_index(drop=True)
+    df.attrs.update({'resolution': resolution, 'gap_ns': gap_ns, 'reset_sessions': settings.RESET_RETURNS_AT_SESSIONS})
+    logging.info(f"Barras {resolution} cargadas desde {path} ({len(df)} filas)")
+    return df
+
+def main():
+    """Función principal."""
+    logging.info("Construyendo el cubo OHLC multirresolución...")
+    build_cube()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# Código para marcas de tiempo anteriores al primer límite (sin etiqueta)
+MISSING_CODE = -1
+
+# Duraciones en ns para operar con marcas de tiempo int64
+NS_PER_SECOND = 1_000_000_000
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+def to_epoch_ns(values):
+    """Convierte timestamps (Series, DatetimeIndex o array datetime64) a int64 en ns desde la época Unix (UTC)."""
+    if isinstance(values, pd.Series):
+        values = values.array
+    if isinstance(values, (pd.DatetimeIndex, pd.arrays.DatetimeArray)):
+        return np.asarray(values.asi8, dtype=np.int64)
+    return np.asarray(values, dtype='datetime64[ns]').view(np.int64)
+
+def tag_intervals(timestamps_ns, boundaries_ns, boundary_codes):
+    """Asigna a cada timestamp el código del último límite <= timestamp.
+
+    boundaries_ns debe estar ordenado; las marcas anteriores al primer límite
+    reciben MISSING_CODE. Cada timestamp se resuelve con una búsqueda binaria.
+    """
+    boundary_codes = np.asarray(boundary_codes, dtype=np.int8)
+    idx = np.searchsorted(boundaries_ns, timestamps_ns, side='right') - 1
+    codes = boundary_codes[np.clip(idx, 0, None)]
+    codes[idx < 0] = MISSING_CODE
+    return codes
+
+def tag_periods(timestamps_ns, cuts_ns):
+    """Asigna el índice de período: número de cortes <= timestamp (cada corte inicia un período nuevo)."""
+    return np.searchsorted(cuts_ns, timestamps_ns, side='right').astype(np.int8)
+
+def phase_boundaries(df_phases, phase_names):
+    """Extrae los límites (ns) y códigos de fase de una tabla TimestampUTC/PhaseName."""
+    boundaries_ns = to_epoch_ns(df_phases['TimestampUTC'])
+    codes = pd.Categorical(df_phases['PhaseName'], categories=phase_names).codes
+    if (codes < 0).any():
+        raise ValueError("La tabla de fases contiene nombres de fase desconocidos")
+    return boundaries_ns, codes
+
+def codes_to_labels(codes, labels):
+    """Convierte códigos enteros a una columna categórica (MISSING_CODE queda como NaN)."""
+    return pd.Categorical.from_codes(codes, categories=labels)
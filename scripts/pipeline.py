@@ -0,0 +1,311 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import pandas as pd
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PHASES_CSV = 'data/lunar_data/lunar_phase_changes.csv'
+PROCESSED_DIR = 'data/processed'
+DAILY_METRICS = os.path.join(PROCESSED_DIR, 'daily_metrics.parquet')
+
+# Variables de .env que afectan a cada grupo de etapas
+PHASE_ENV = ['START_DATE', 'END_DATE', 'EPHE_PATH', 'PHASE_TOLERANCE_SECONDS', 'PHASE_CACHE_DIR']
+COMBINE_ENV = ['FINANCIAL_CSV', 'FINANCIAL_DATA_PATH', 'FINANCIAL_DATA_TIMEZONE', 'PRE_PANDEMIC_END', 'PANDEMIC_END',
+               'PERIOD_CUTS', 'PERIOD_LABELS', 'EXPORT_COMBINED_CSV', 'PRICE_DECIMALS', 'SESSION_GAP_MINUTES', 'DROP_INVALID_BARS']
+RESAMPLING_ENV = ['N_PERMUTATIONS', 'N_BOOTSTRAP', 'BOOTSTRAP_BLOCK_DAYS', 'RESAMPLING_SEED']
+# Código que entra en la huella de todas las etapas (valores por defecto de la configuración)
+COMMON_SOURCES = ['settings.py']
+
+class Stage:
+    """Etapa del pipeline: función, dependencias, entradas que determinan su huella y artefactos que produce.
+
+    Las etapas con default=False sólo se ejecutan si se piden explícitamente.
+    """
+
+    def __init__(self, name, run, deps=(), sources=(), env=(), inputs=(), outputs=(), default=True):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.sources = COMMON_SOURCES + list(sources)
+        self.env = list(env)
+        self.inputs = inputs
+        self.outputs = list(outputs)
+        self.default = default
+
+def file_digest(path):
+    """sha256 del contenido de un archivo."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def artifact_signature(path):
+    """Firma barata de un artefacto (archivo o directorio): ruta, tamaño y mtime de cada archivo."""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [[path, stat.st_size, stat.st_mtime_ns]]
+    signature = []
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            stat = os.stat(file_path)
+            signature.append([file_path, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+def stage_fingerprint(stage, state):
+    """Huella de las entradas de una etapa: código fuente, variables de entorno, archivos de entrada y artefactos previos."""
+    inputs = stage.inputs() if callable(stage.inputs) else stage.inputs
+    payload = {
+        'sources': {source: file_digest(os.path.join(SCRIPTS_DIR, source)) for source in stage.sources},
+        'env': {key: settings.env(key) for key in stage.env},
+        'inputs': [artifact_signature(path) if os.path.exists(path) else None for path in inputs],
+        'deps': {dep: state.get(dep, {}).get('outputs') for dep in stage.deps}
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def outputs_signature(stage):
+    """Firma actual de los artefactos de una etapa (None si falta alguno)."""
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return None
+    return [artifact_signature(path) for path in stage.outputs]
+
+def run_phases():
+    import calculate_lunar_phases as phases
+    phases.generate_lunar_phase_changes()
+
+def run_events():
+    import lunar_events
+    lunar_events.generate_lunar_events()
+
+def run_combine():
+    import calculate_lunar_phases as phases
+    df_phases = pd.read_csv(PHASES_CSV, parse_dates=['TimestampUTC'])
+    phases.combine_financial_data(output_dir=PROCESSED_DIR, df_phases=df_phases)
+
+def run_cube():
+    import ohlc_cube
+    ohlc_cube.build_cube(PROCESSED_DIR)
+
+def run_metrics():
+    import analyze_lunar_phases as analysis
+    daily_metrics = analysis.calculate_metrics(analysis.load_data(input_dir=PROCESSED_DIR))
+    daily_metrics.to_parquet(DAILY_METRICS + '.tmp', index=False)
+    os.replace(DAILY_METRICS + '.tmp', DAILY_METRICS)
+    logging.info(f"Métricas diarias guardadas en {DAILY_METRICS}")
+
+def run_stats():
+    import analyze_lunar_phases as analysis
+    analysis.descriptive_statistics(pd.read_parquet(DAILY_METRICS), PROCESSED_DIR)
+
+def run_tests():
+    import analyze_lunar_phases as analysis
+    analysis.statistical_tests(pd.read_parquet(DAILY_METRICS), PROCESSED_DIR)
+
+def run_plots():
+    import analyze_lunar_phases as analysis
+    analysis.generate_boxplots(pd.read_parquet(DAILY_METRICS), os.path.join(PROCESSED_DIR, 'plots'))
+
+def run_rolling():
+    import rolling_window
+    rolling_window.save_rolling(*rolling_window.rolling_statistics(pd.read_parquet(DAILY_METRICS)), PROCESSED_DIR)
+
+def run_factors():
+    import analyze_lunar_phases as analysis
+    import factor_cube
+    cubes = factor_cube.build_factor_cubes(analysis.load_data(input_dir=PROCESSED_DIR), input_dir=PROCESSED_DIR)
+    factor_cube.save_factor_statistics(factor_cube.factor_statistics(cubes), PROCESSED_DIR)
+
+def run_event_study():
+    import analyze_lunar_phases as analysis
+    import event_study
+    df = analysis.load_data(columns=event_study.STUDY_COLUMNS, input_dir=PROCESSED_DIR)
+    event_study.save_event_study(event_study.event_study(df), PROCESSED_DIR)
+
+def run_summary():
+    import summarize_results_for_analysis as summary
+    summary.main()
+
+def financial_inputs():
+    return [os.path.join(settings.FINANCIAL_DATA_PATH, settings.FINANCIAL_CSV)]
+
+def ephemeris_inputs():
+    ephe_path = settings.EPHE_PATH
+    return [os.path.join(ephe_path, name) for name in sorted(os.listdir(ephe_path)) if name.endswith('.se1')] if os.path.isdir(ephe_path) else []
+
+STAGES = [
+    Stage('phases', run_phases, sources=['calculate_lunar_phases.py', 'lunar_ephemeris.py', 'phase_tagging.py'], env=PHASE_ENV,
+          inputs=ephemeris_inputs, outputs=[PHASES_CSV]),
+    Stage('events', run_events,
+          sources=['lunar_events.py', 'calculate_lunar_phases.py', 'lunar_ephemeris.py'], env=PHASE_ENV,
+          inputs=ephemeris_inputs, outputs=['data/lunar_data/lunar_events.parquet'], default=False),
+    Stage('combine', run_combine, deps=['phases'],
+          sources=['calculate_lunar_phases.py', 'combined_storage.py', 'phase_tagging.py', 'lunar_ephemeris.py', 'data_quality.py'],
+          env=COMBINE_ENV + ['FINANCIAL_CHUNK_SIZE'], inputs=financial_inputs,
+          outputs=[os.path.join(PROCESSED_DIR, 'combined_data'), os.path.join(PROCESSED_DIR, 'sessions.parquet'),
+                   os.path.join(PROCESSED_DIR, 'data_quality.json')]),
+    Stage('cube', run_cube, deps=['combine'],
+          sources=['ohlc_cube.py', 'metrics_engine.py', 'combined_storage.py', 'data_quality.py', 'phase_tagging.py'],
+          env=['RETURN_GAP_MINUTES', 'RESET_RETURNS_AT_SESSIONS'], outputs=[os.path.join(PROCESSED_DIR, 'ohlc_cube')]),
+    Stage('metrics', run_metrics, deps=['combine'],
+          sources=['analyze_lunar_phases.py', 'metrics_engine.py', 'combined_storage.py', 'data_quality.py', 'ohlc_cube.py',
+                   'phase_tagging.py', 'profiling.py'],
+          env=['RETURN_GAP_MINUTES', 'RESET_RETURNS_AT_SESSIONS'], outputs=[DAILY_METRICS]),
+    Stage('stats', run_stats, deps=['metrics'], sources=['analyze_lunar_phases.py'],
+          outputs=[os.path.join(PROCESSED_DIR, 'statistics_by_phase_period.csv')]),
+    Stage('tests', run_tests, deps=['metrics'], sources=['analyze_lunar_phases.py', 'resampling.py'], env=RESAMPLING_ENV,
+          outputs=[os.path.join(PROCESSED_DIR, 'statistical_tests.csv')]),
+    Stage('plots', run_plots, deps=['metrics'], sources=['analyze_lunar_phases.py', 'plot_rendering.py'],
+          outputs=[os.path.join(PROCESSED_DIR, 'plots')]),
+    Stage('rolling', run_rolling, deps=['metrics'], sources=['rolling_window.py'],
+          env=['ROLLING_WINDOW_MONTHS', 'ROLLING_STEP_MONTHS'],
+          outputs=[os.path.join(PROCESSED_DIR, 'rolling_statistics.csv'), os.path.join(PROCESSED_DIR, 'rolling_tests.csv')]),
+    Stage('factors', run_factors, deps=['combine'],
+          sources=['factor_cube.py', 'analyze_lunar_phases.py', 'metrics_engine.py', 'combined_storage.py', 'data_quality.py',
+                   'phase_tagging.py'],
+          env=['RETURN_GAP_MINUTES', 'RESET_RETURNS_AT_SESSIONS', 'FACTOR_CUBE_FACTORS', 'FACTOR_MARGINALS', 'TRADING_SESSION_HOURS'],
+          outputs=[os.path.join(PROCESSED_DIR, 'factor_statistics.csv')]),
+    Stage('event_study', run_event_study, deps=['phases', 'combine'],
+          sources=['event_study.py', 'analyze_lunar_phases.py', 'calculate_lunar_phases.py', 'combined_storage.py',
+                   'metrics_engine.py', 'phase_tagging.py'],
+          env=['EVENT_WINDOW_MINUTES', 'EVENT_STEP_MINUTES', 'EVENT_ESTIMATION_MINUTES', 'EVENT_CONFIDENCE'],
+          outputs=[os.path.join(PROCESSED_DIR, 'event_study.csv')]),
+    Stage('summary', run_summary, deps=['stats', 'tests'], sources=['summarize_results_for_analysis.py'],
+          outputs=[os.path.join(PROCESSED_DIR, 'results_summary_for_analysis.md')])
+]
+
+def select_stages(targets):
+    """Etapas necesarias para los objetivos pedidos (por defecto, las de default=True) con sus dependencias, en orden topológico."""
+    by_name = {stage.name: stage for stage in STAGES}
+    unknown = [target for target in targets if target not in by_name]
+    if unknown:
+        logging.error(f"Etapas desconocidas: {', '.join(unknown)}. Disponibles: {', '.join(by_name)}")
+        raise ValueError(f"Etapas desconocidas: {unknown}")
+    needed = set()
+    pending = list(targets or [stage.name for stage in STAGES if stage.default])
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(by_name[name].deps)
+    return [stage for stage in STAGES if stage.name in needed]
+
+def load_state(path=None):
+    path = settings.PIPELINE_STATE if path is None else path
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_state(state, path=None):
+    path = settings.PIPELINE_STATE if path is None else path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def run_stage(name, profile=False):
+    """Ejecuta una etapa en un proceso del pool; con profile devuelve los registros del perfilador ('stage:<nombre>')."""
+    from profiling import profiler
+    if profile:
+        profiler.enable()
+    stage = next(stage for stage in STAGES if stage.name == name)
+    with profiler.stage(f'stage:{name}'):
+        stage.run()
+    return profiler.records if profile else None
+
+def run_pipeline(targets=(), force=False, dry_run=False, workers=None):
+    """Ejecuta el grafo de etapas, omitiendo las que están al día.
+
+    Una etapa está al día si la huella de sus entradas coincide con la de la
+    última ejecución y sus artefactos no han cambiado desde entonces. Las
+    etapas cuyas dependencias ya terminaron se ejecutan en paralelo (p. ej.
+    estadísticas, pruebas y gráficos), hasta workers (PIPELINE_WORKERS) a la
+    vez, cada una en un proceso nuevo: no comparten el estado global de
+    matplotlib, del perfilador ni de la efeméride. Con el perfilador activo,
+    los registros de cada etapa se añaden al del proceso principal. Devuelve
+    {etapa: 'ejecutada' | 'al día'}.
+    """
+    from profiling import profiler
+    workers = settings.PIPELINE_WORKERS if workers is None else workers
+    stages = select_stages(list(targets))
+    state = load_state()
+    status = {}
+    done = set(stage.name for stage in STAGES if stage not in stages)
+    remaining = list(stages)
+    running = {}
+
+    # Un proceso por etapa (max_tasks_per_child=1 requiere spawn): la memoria y la CPU de cada etapa son las de su proceso
+    with ProcessPoolExecutor(max_workers=max(workers, 1), mp_context=multiprocessing.get_context('spawn'),
+                             max_tasks_per_child=1) as executor:
+        while remaining or running:
+            for stage in [stage for stage in remaining if all(dep in done for dep in stage.deps)]:
+                remaining.remove(stage)
+                fingerprint = stage_fingerprint(stage, state)
+                recorded = state.get(stage.name, {})
+                up_to_date = (not force and recorded.get('fingerprint') == fingerprint
+                              and recorded.get('outputs') is not None and recorded.get('outputs') == outputs_signature(stage)
+                              and not any(status.get(dep) == 'pendiente' for dep in stage.deps))
+                if up_to_date or dry_run:
+                    status[stage.name] = 'al día' if up_to_date else 'pendiente'
+                    logging.info(f"Etapa {stage.name}: {status[stage.name]}")
+                    done.add(stage.name)
+                    continue
+                logging.info(f"Etapa {stage.name}: ejecutando")
+                running[executor.submit(run_stage, stage.name, profiler.enabled)] = (stage, fingerprint)
+
+            if not running:
+                if remaining:
+                    continue
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, fingerprint = running.pop(future)
+                try:
+                    records = future.result()
+                except Exception as e:
+                    logging.error(f"La etapa {stage.name} falló: {e}")
+                    for other in running:
+                        other.cancel()
+                    save_state(state)
+                    raise
+                if records:
+                    profiler.merge(records)
+                state[stage.name] = {'fingerprint': fingerprint, 'outputs': outputs_signature(stage)}
+                save_state(state)
+                status[stage.name] = 'ejecutada'
+                done.add(stage.name)
+    return status
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Ejecuta el pipeline fases → combinación → métricas → estadísticas/pruebas/gráficos → resumen.")
+    parser.add_argument('targets', nargs='*', help=f"Etapas a actualizar (por defecto todas salvo events): {', '.join(stage.name for stage in STAGES)}")
+    parser.add_argument('--force', action='store_true', help="Ejecuta las etapas aunque estén al día")
+    parser.add_argument('--dry-run', action='store_true', help="Sólo indica qué etapas se ejecutarían")
+    parser.add_argument('--workers', type=int, help="Etapas independientes en paralelo (PIPELINE_WORKERS)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Mide cada etapa y guarda reports/profile_<fecha>.json")
+    args = parser.parse_args()
+    if args.profile:
+        from profiling import profiler
+        profiler.enable()
+    try:
+        status = run_pipeline(args.targets, args.force, args.dry_run, args.workers)
+    finally:
+        if args.profile:
+            profiler.write(command='pipeline ' + ' '.join(args.targets or ['all']))
+    for name, value in status.items():
+        print(f"{name}: {value}")
+
+if __name__ == "__main__":
+    main()
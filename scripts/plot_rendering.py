@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from settings import settings
+
+# Paleta "deep" de seaborn con la saturación de sns.boxplot (sns.color_palette("deep", 8, desat=0.75))
+PHASE_PALETTE = ['#5875a4', '#cc8963', '#5f9e6e', '#b55d60', '#857aab', '#8d7866', '#d095bf', '#8c8c8c']
+PLOT_STYLE = 'seaborn-v0_8-whitegrid'
+LINE_COLOR = '#3f3f3f'
+FINGERPRINTS_FILE = '.fingerprints.json'
+# Cambiar al modificar el dibujo para invalidar las huellas guardadas
+RENDER_VERSION = 1
+
+def box_statistics(values):
+    """Cuartiles, bigotes (1.5 IQR) y valores atípicos de una muestra, en el formato de Axes.bxp."""
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return None
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    return {
+        'med': float(median), 'q1': float(q1), 'q3': float(q3),
+        'whislo': float(inside[0]), 'whishi': float(inside[-1]),
+        'fliers': values[(values < inside[0]) | (values > inside[-1])].tolist()
+    }
+
+def grouped_box_statistics(daily_metrics, metric):
+    """Estadísticos de caja por (período, fase) con una sola ordenación de las filas diarias."""
+    phases = pd.Categorical(daily_metrics['lunar_phase'])
+    periods = pd.Categorical(daily_metrics['period'])
+    order = np.lexsort((phases.codes, periods.codes))
+    keys = np.stack((periods.codes[order], phases.codes[order]), axis=1)
+    starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+    values = daily_metrics[metric].to_numpy()[order]
+    result = {}
+    for start, end in zip(starts, np.append(starts[1:], len(order))):
+        period_code, phase_code = keys[start]
+        if period_code < 0 or phase_code < 0:
+            continue
+        stats = box_statistics(values[start:end])
+        if stats is not None:
+            stats['label'] = phases.categories[phase_code]
+            stats['color'] = PHASE_PALETTE[phase_code % len(PHASE_PALETTE)]
+            result.setdefault(periods.categories[period_code], []).append(stats)
+    return result
+
+def figure_fingerprint(spec):
+    """Huella de todo lo que determina la imagen (datos agregados, textos y versión del dibujo)."""
+    payload = json.dumps({'version': RENDER_VERSION, **spec}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def render_figure(spec, output_dir):
+    """Dibuja una figura (boxplot o líneas) con el backend Agg; se ejecuta en un proceso del pool."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    with plt.style.context(PLOT_STYLE):
+        fig, ax = plt.subplots(figsize=(12, 6))
+        if spec['kind'] == 'box':
+            boxes = ax.bxp(spec['boxes'], showfliers=True, patch_artist=True, widths=0.8,
+                           medianprops={'color': LINE_COLOR}, whiskerprops={'color': LINE_COLOR},
+                           capprops={'color': LINE_COLOR},
+                           flierprops={'marker': 'd', 'markerfacecolor': LINE_COLOR, 'markeredgecolor': LINE_COLOR, 'markersize': 4})
+            for patch, box in zip(boxes['boxes'], spec['boxes']):
+                patch.set_facecolor(box['color'])
+                patch.set_edgecolor(LINE_COLOR)
+        else:
+            for label, series in spec['series'].items():
+                ax.plot(spec['x'], series, marker='o', label=label)
+            ax.legend()
+        ax.set_title(spec['title'])
+        ax.set_xlabel(spec['xlabel'])
+        ax.set_ylabel(spec['ylabel'])
+        plt.setp(ax.get_xticklabels(), rotation=45)
+        fig.tight_layout()
+        fig.savefig(os.path.join(output_dir, spec['filename']))
+        plt.close(fig)
+    return spec['filename']
+
+def render_figures(specs, output_dir, workers=None):
+    """Dibuja en paralelo (PLOT_WORKERS procesos por defecto) las figuras cuya huella cambió y actualiza .fingerprints.json.
+
+    Devuelve la lista de archivos regenerados; las figuras con la misma huella
+    y cuyo PNG existe se omiten.
+    """
+    workers = settings.PLOT_WORKERS if workers is None else workers
+    os.makedirs(output_dir, exist_ok=True)
+    fingerprints_path = os.path.join(output_dir, FINGERPRINTS_FILE)
+    try:
+        with open(fingerprints_path, encoding='utf-8') as f:
+            fingerprints = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        fingerprints = {}
+
+    pending = []
+    for spec in specs:
+        fingerprint = figure_fingerprint(spec)
+        if fingerprints.get(spec['filename']) == fingerprint and os.path.exists(os.path.join(output_dir, spec['filename'])):
+            continue
+        pending.append((spec, fingerprint))
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            list(executor.map(render_figure, [spec for spec, _ in pending], [output_dir] * len(pending)))
+    else:
+        for spec, _ in pending:
+            render_figure(spec, output_dir)
+
+    # Sólo se guardan las huellas de figuras efectivamente escritas
+    for spec, fingerprint in pending:
+        fingerprints[spec['filename']] = fingerprint
+    with open(fingerprints_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(fingerprints, f, indent=1, sort_keys=True)
+    os.replace(fingerprints_path + '.tmp', fingerprints_path)
+    logging.info(f"Gráficos: {len(pending)} generados, {len(specs) - len(pending)} sin cambios")
+    return [spec['filename'] for spec, _ in pending]
@@ -0,0 +1,225 @@
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_DIR = 'reports'
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso hasta ahora (MB), o None si no se puede medir."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def calc_ut_calls():
+    """Llamadas a swe.calc_ut del proceso (solver de fases e interpoladores de elongación ya creados)."""
+    total = 0
+    phases = sys.modules.get('calculate_lunar_phases')
+    if phases is not None:
+        total += phases.calc_ut_calls
+        if phases._lunar_elongation is not None:
+            total += phases._lunar_elongation.calc_ut_calls
+    ephemeris = sys.modules.get('lunar_ephemeris')
+    if ephemeris is not None and ephemeris._default is not None:
+        total += ephemeris._default.calc_ut_calls
+    return total
+
+def frame_bytes(df):
+    """Memoria de un DataFrame (bytes, contando el contenido de las columnas object y las tablas de categorías)."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class StageRecord:
+    """Acumulado de una etapa (las repeticiones con el mismo nombre, p. ej. bloques, se suman)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.rows = None
+        self.frame_bytes = None
+        self.calc_ut_calls = 0
+        self.peak_rss_mb = None
+        self.tracemalloc_peak_mb = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'wall_s': round(self.wall_s, 6),
+            'cpu_s': round(self.cpu_s, 6),
+            'rows': self.rows,
+            'rows_per_s': round(self.rows / self.wall_s, 1) if self.rows and self.wall_s > 0 else None,
+            'frame_mb': None if self.frame_bytes is None else round(self.frame_bytes / 2 ** 20, 1),
+            'bytes_per_row': round(self.frame_bytes / self.rows, 1) if self.frame_bytes is not None and self.rows else None,
+            'calc_ut_calls': self.calc_ut_calls,
+            'peak_rss_mb': None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+            'tracemalloc_peak_mb': None if self.tracemalloc_peak_mb is None else round(self.tracemalloc_peak_mb, 1)
+        }
+
+class StageProfiler:
+    """Perfilador de etapas y subpasos.
+
+    profiler.stage(nombre) mide tiempo real, CPU del proceso, filas por segundo,
+    pico de RSS, pico de tracemalloc y llamadas a swe.calc_ut; con
+    step.frame_bytes también la memoria del DataFrame que produce. Las etapas
+    anidadas se nombran con su ruta ('combine/tag'). Desactivado, stage() no
+    mide nada. La CPU y tracemalloc son del proceso actual: no incluyen los
+    procesos de los pools (remuestreo, gráficos, lotes) salvo los registros
+    añadidos con merge() (etapas del pipeline).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.records = {}
+        self._merged = {'cpu_s': 0.0, 'calc_ut_calls': 0, 'peak_rss_mb': None, 'tracemalloc_peak_mb': None}
+        self._local = threading.local()
+        self._started = None
+
+    def enable(self, trace_memory=True):
+        """Activa el perfilado (y tracemalloc, que ralentiza las asignaciones de Python)."""
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.records = {}
+        self._merged = {'cpu_s': 0.0, 'calc_ut_calls': 0, 'peak_rss_mb': None, 'tracemalloc_peak_mb': None}
+        self._started = (time.perf_counter(), time.process_time(), calc_ut_calls())
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Mide un bloque; el objeto devuelto admite .rows = n (rendimiento) y .frame_bytes = b (memoria por fila)."""
+        if not self.enabled:
+            yield _NullStep()
+            return
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        path = '/'.join([frame['path'] for frame in stack[-1:]] + [name])
+        step = _Step()
+        if self.trace_memory:
+            # Conservar el pico del padre antes de reiniciarlo para medir este paso
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {'path': path, 'peak': 0}
+        stack.append(frame)
+        wall, cpu, calls = time.perf_counter(), time.process_time(), calc_ut_calls()
+        try:
+            yield step
+        finally:
+            stack.pop()
+            record = self.records.setdefault(path, StageRecord(path))
+            record.calls += 1
+            record.wall_s += time.perf_counter() - wall
+            record.cpu_s += time.process_time() - cpu
+            record.calc_ut_calls += calc_ut_calls() - calls
+            if step.rows is not None:
+                record.rows = (record.rows or 0) + step.rows
+            if step.frame_bytes is not None:
+                record.frame_bytes = (record.frame_bytes or 0) + step.frame_bytes
+            rss = peak_rss_mb()
+            if rss is not None:
+                record.peak_rss_mb = max(record.peak_rss_mb or 0.0, rss)
+            if self.trace_memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record.tracemalloc_peak_mb = max(record.tracemalloc_peak_mb or 0.0, peak / 2 ** 20)
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+    def merge(self, records):
+        """Añade los registros de otro proceso; sus etapas de primer nivel cuentan en los totales del informe."""
+        for path, record in records.items():
+            self.records[path] = record
+            if '/' not in path:
+                self._merged['cpu_s'] += record.cpu_s
+                self._merged['calc_ut_calls'] += record.calc_ut_calls
+                for key in ('peak_rss_mb', 'tracemalloc_peak_mb'):
+                    if getattr(record, key) is not None:
+                        self._merged[key] = max(self._merged[key] or 0.0, getattr(record, key))
+
+    def profile(self, name, rows=None, memory=False):
+        """Decorador: mide cada llamada como la etapa name; rows(resultado) da las filas procesadas.
+
+        Con memory=True también registra frame_bytes del DataFrame devuelto.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.stage(name) as step:
+                    result = function(*args, **kwargs)
+                    if rows is not None:
+                        step.rows = rows(result)
+                    if memory:
+                        step.frame_bytes = frame_bytes(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def report(self, command=None):
+        """Informe serializable a JSON con las etapas en orden de finalización y los totales."""
+        wall, cpu, calls = self._started or (time.perf_counter(), time.process_time(), calc_ut_calls())
+        rss = [value for value in (peak_rss_mb(), self._merged['peak_rss_mb']) if value is not None]
+        return {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'command': command,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'tracemalloc': self.trace_memory,
+            'stages': [record.to_dict() for record in self.records.values()],
+            'total': {
+                'wall_s': round(time.perf_counter() - wall, 6),
+                'cpu_s': round(time.process_time() - cpu + self._merged['cpu_s'], 6),
+                'calc_ut_calls': calc_ut_calls() - calls + self._merged['calc_ut_calls'],
+                'peak_rss_mb': round(max(rss), 1) if rss else None,
+                'tracemalloc_peak_mb': round(max(tracemalloc.get_traced_memory()[1] / 2 ** 20, self._merged['tracemalloc_peak_mb'] or 0.0), 1)
+                                       if self.trace_memory else None
+            }
+        }
+
+    def write(self, command=None, output_dir=PROFILE_DIR):
+        """Guarda el informe en reports/profile_<fecha>.json y en reports/profile_latest.json; devuelve la ruta."""
+        report = self.report(command)
+        os.makedirs(output_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output_path = os.path.join(output_dir, f'profile_{stamp}.json')
+        for path in (output_path, os.path.join(output_dir, 'profile_latest.json')):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=1)
+        logging.info(f"Perfil guardado en {output_path}")
+        for stage in report['stages']:
+            logging.info(f"  {stage['name']}: {stage['wall_s']:.3f} s real, {stage['cpu_s']:.3f} s CPU"
+                         + (f", {stage['rows_per_s']:.0f} filas/s" if stage['rows_per_s'] else "")
+                         + (f", {stage['calc_ut_calls']} swe.calc_ut" if stage['calc_ut_calls'] else ""))
+        return output_path
+
+class _Step:
+    rows = None
+    frame_bytes = None
+
+class _NullStep:
+    rows = None
+    frame_bytes = None
+
+    def __setattr__(self, name, value):
+        pass
+
+# Perfilador compartido del proceso; los scripts lo activan con --profile
+profiler = StageProfiler()
@@ -0,0 +1,153 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from settings import settings
+
+CONFIDENCE_LEVEL = 0.95
+
+# Remuestreos por tarea. La división en tareas (y las semillas de cada una) no
+# depende del número de procesos, así que los resultados son reproducibles.
+BATCH_SIZE = 1000
+# Filas remuestreadas que el bootstrap materializa a la vez (~16 MB por array int64);
+# acota la memoria por proceso aunque las muestras tengan millones de filas
+MAX_BATCH_ROWS = 2_000_000
+
+def between_group_ss(sums, counts, total, n):
+    """Suma de cuadrados entre grupos a partir de las sumas y tamaños por grupo."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums ** 2 / counts, 0.0).sum(axis=-1) - total ** 2 / n
+
+def _permutation_batch(values, codes, n_groups, observed_ssb, size, seed):
+    """Cuenta las permutaciones de etiquetas de un lote con SSB >= el observado.
+
+    Permutar las etiquetas equivale a permutar los valores con las etiquetas
+    fijas; las sumas por grupo de cada permutación son un bincount, así que
+    la memoria es O(n) sea cual sea el tamaño del lote.
+    """
+    rng = np.random.default_rng(seed)
+    sums = np.empty((size, n_groups))
+    for i in range(size):
+        sums[i] = np.bincount(codes, weights=rng.permuted(values), minlength=n_groups)
+    counts = np.bincount(codes, minlength=n_groups)
+    ssb = between_group_ss(sums, counts, values.sum(), len(values))
+    # Tolerancia relativa para que los empates numéricos con el observado cuenten
+    return int(np.count_nonzero(ssb >= observed_ssb * (1 - 1e-12)))
+
+def _bootstrap_batch(values, codes, n_groups, day_index, block_days, size, seed):
+    """Eta² de un lote de réplicas bootstrap por bloques de días consecutivos (moving block bootstrap).
+
+    Las réplicas se reducen en tramos de como mucho MAX_BATCH_ROWS filas
+    muestreadas; los días de todas se sortean antes, así que el resultado
+    no depende del tramo.
+    """
+    rng = np.random.default_rng(seed)
+    n_days = int(day_index[-1]) + 1
+    block_days = min(block_days, n_days)
+    day_starts = np.searchsorted(day_index, np.arange(n_days + 1))
+    day_lengths = np.diff(day_starts)
+
+    # Días muestreados por réplica: bloques consecutivos hasta cubrir n_days
+    n_blocks = -(-n_days // block_days)
+    starts = rng.integers(0, n_days - block_days + 1, (size, n_blocks))
+    all_days = (starts[:, :, None] + np.arange(block_days)).reshape(size, -1)[:, :n_days]
+    step = max(1, MAX_BATCH_ROWS // max(len(values), 1))
+    return np.concatenate([_bootstrap_eta(values, codes, n_groups, day_starts, day_lengths, all_days[first:first + step])
+                           for first in range(0, size, step)])
+
+def _bootstrap_eta(values, codes, n_groups, day_starts, day_lengths, sampled_days):
+    """Eta² de las réplicas cuyos días muestreados son las filas de sampled_days."""
+    size, n_days = sampled_days.shape
+    days = sampled_days.ravel()
+
+    # Filas de cada día muestreado, con el número de réplica al que pertenecen
+    lengths = day_lengths[days]
+    replicate = np.repeat(np.repeat(np.arange(size), n_days), lengths)
+    first = np.repeat(day_starts[days], lengths)
+    rows = first + np.arange(len(first)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    keys = replicate * n_groups + codes[rows]
+    sampled = values[rows]
+    sums = np.bincount(keys, weights=sampled, minlength=size * n_groups).reshape(size, n_groups)
+    counts = np.bincount(keys, minlength=size * n_groups).reshape(size, n_groups)
+    n = counts.sum(axis=1)
+    total = sums.sum(axis=1)
+    sst = np.bincount(replicate, weights=sampled ** 2, minlength=size) - total ** 2 / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return between_group_ss(sums, counts, total, n) / sst
+
+def _batch_sizes(total):
+    return [min(BATCH_SIZE, total - start) for start in range(0, total, BATCH_SIZE)]
+
+def resampling_tests(samples, n_permutations=None, n_bootstrap=None, block_days=None, seed=None, workers=None):
+    """Pruebas de permutación y bootstrap por bloques para varias muestras a la vez.
+
+    samples es un dict {clave: (values, codes, day_index)} con los valores de
+    la métrica, el código de fase de cada fila y el índice denso del día
+    (ordenado). Para cada clave devuelve el estadístico F, eta² (SSB/SST), el
+    p-valor de permutación de las etiquetas de fase y el intervalo de
+    confianza percentil de eta². Todas las tareas se reparten entre `workers`
+    procesos; con la misma semilla el resultado es idéntico. Los argumentos
+    omitidos toman N_PERMUTATIONS, N_BOOTSTRAP, BOOTSTRAP_BLOCK_DAYS,
+    RESAMPLING_SEED y RESAMPLING_WORKERS.
+    """
+    n_permutations = settings.N_PERMUTATIONS if n_permutations is None else n_permutations
+    n_bootstrap = settings.N_BOOTSTRAP if n_bootstrap is None else n_bootstrap
+    block_days = settings.BOOTSTRAP_BLOCK_DAYS if block_days is None else block_days
+    seed = settings.RESAMPLING_SEED if seed is None else seed
+    workers = settings.RESAMPLING_WORKERS if workers is None else workers
+    seeds = np.random.SeedSequence(seed).spawn(len(samples))
+    prepared = {}
+    tasks = []
+    for (key, (values, codes, day_index)), sample_seed in zip(samples.items(), seeds):
+        values = np.asarray(values, dtype=np.float64)
+        codes = np.unique(np.asarray(codes), return_inverse=True)[1].astype(np.int64)
+        day_index = np.asarray(day_index, dtype=np.int64)
+        n_groups = int(codes.max()) + 1 if len(codes) else 0
+        counts = np.bincount(codes, minlength=n_groups)
+        n = len(values)
+        ssb = float(between_group_ss(np.bincount(codes, weights=values, minlength=n_groups), counts, values.sum(), n)) if n else np.nan
+        sst = float(((values - values.mean()) ** 2).sum()) if n else np.nan
+        prepared[key] = {'n': n, 'n_groups': n_groups, 'ssb': ssb, 'sst': sst}
+        if n_groups < 2 or n <= n_groups:
+            continue
+        permutation_seed, bootstrap_seed = sample_seed.spawn(2)
+        for size, batch_seed in zip(_batch_sizes(n_permutations), permutation_seed.spawn(len(_batch_sizes(n_permutations)))):
+            tasks.append((key, 'permutation', _permutation_batch, (values, codes, n_groups, ssb, size, batch_seed)))
+        for size, batch_seed in zip(_batch_sizes(n_bootstrap), bootstrap_seed.spawn(len(_batch_sizes(n_bootstrap)))):
+            tasks.append((key, 'bootstrap', _bootstrap_batch, (values, codes, n_groups, day_index, block_days, size, batch_seed)))
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            outputs = list(executor.map(_run_task, [(function, args) for _, _, function, args in tasks]))
+    else:
+        outputs = [_run_task((function, args)) for _, _, function, args in tasks]
+
+    exceed = {key: 0 for key in samples}
+    replicates = {key: [] for key in samples}
+    for (key, kind, _, _), output in zip(tasks, outputs):
+        if kind == 'permutation':
+            exceed[key] += output
+        else:
+            replicates[key].append(output)
+
+    alpha = (1 - CONFIDENCE_LEVEL) / 2
+    results = {}
+    for key, info in prepared.items():
+        n, k = info['n'], info['n_groups']
+        valid = k >= 2 and n > k
+        eta = np.concatenate(replicates[key]) if replicates[key] else np.array([])
+        eta = eta[np.isfinite(eta)]
+        results[key] = {
+            'statistic': info['ssb'] / (k - 1) / ((info['sst'] - info['ssb']) / (n - k)) if valid else np.nan,
+            'effect_size': info['ssb'] / info['sst'] if valid else np.nan,
+            'p_value': (exceed[key] + 1) / (n_permutations + 1) if valid and n_permutations > 0 else np.nan,
+            'ci_low': float(np.quantile(eta, alpha)) if len(eta) else np.nan,
+            'ci_high': float(np.quantile(eta, 1 - alpha)) if len(eta) else np.nan
+        }
+    logging.info(f"Remuestreo completado: {len(samples)} muestras, {n_permutations} permutaciones y "
+                 f"{n_bootstrap} réplicas bootstrap (bloques de {block_days} días) en {len(tasks)} tareas")
+    return results
+
+def _run_task(task):
+    function, args = task
+    return function(*args)
@@ -0,0 +1,203 @@
+import argparse
+import bisect
+import logging
+import os
+import numpy as np
+import pandas as pd
+from profiling import profiler
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+METRICS = ['mean_return', 'volatility']
+
+class RollingMoments:
+    """Media, M2 (Welford) y valores ordenados de una muestra a la que se añaden y quitan valores.
+
+    add/remove actualizan los momentos en O(1) y la lista ordenada con
+    búsqueda binaria; los cuantiles coinciden con np.percentile (lineal).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sorted = []
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        bisect.insort(self.sorted, value)
+
+    def remove(self, value):
+        self.sorted.pop(bisect.bisect_left(self.sorted, value))
+        self.n -= 1
+        if self.n == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.n
+        # max: los redondeos al quitar valores no pueden dejar M2 negativo
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+    def quantile(self, q):
+        """Cuantil q (0-1) con la interpolación lineal de np.percentile."""
+        if self.n == 0:
+            return np.nan
+        position = q * (self.n - 1)
+        lower = int(position)
+        upper = min(lower + 1, self.n - 1)
+        return self.sorted[lower] + (self.sorted[upper] - self.sorted[lower]) * (position - lower)
+
+class RollingPhaseStats:
+    """Acumuladores de una fase dentro de la ventana: retorno medio, volatilidad y barras."""
+
+    def __init__(self):
+        self.moments = {metric: RollingMoments() for metric in METRICS}
+        self.bars = 0
+
+    def update(self, row, sign):
+        """Añade (sign=1) o quita (sign=-1) una fila diaria."""
+        for metric in METRICS:
+            value = row[metric]
+            if np.isfinite(value):
+                if sign > 0:
+                    self.moments[metric].add(value)
+                else:
+                    self.moments[metric].remove(value)
+        self.bars += sign * int(row['count'])
+
+    def result(self):
+        """Estadísticos con las columnas de statistics_by_phase_period.csv."""
+        returns, volatility = self.moments['mean_return'], self.moments['volatility']
+        return {
+            'mean_return': returns.mean if returns.n else np.nan,
+            'median_return': returns.quantile(0.5),
+            'std_return': returns.std(),
+            'return_p25': returns.quantile(0.25),
+            'return_p75': returns.quantile(0.75),
+            'mean_volatility': volatility.mean if volatility.n else np.nan,
+            'count_days': self.bars
+        }
+
+def anova_from_moments(moments):
+    """ANOVA de un factor (igual que scipy.stats.f_oneway) a partir de n, media y M2 de cada grupo."""
+    import scipy.stats as stats
+    groups = [m for m in moments if m.n > 0]
+    n_total = sum(m.n for m in groups)
+    if len(groups) < 2 or n_total <= len(groups):
+        return np.nan, np.nan
+    grand_mean = sum(m.n * m.mean for m in groups) / n_total
+    ss_between = sum(m.n * (m.mean - grand_mean) ** 2 for m in groups)
+    ss_within = sum(m.m2 for m in groups)
+    df_between, df_within = len(groups) - 1, n_total - len(groups)
+    if ss_within <= 0:
+        return np.nan, np.nan
+    f_stat = (ss_between / df_between) / (ss_within / df_within)
+    return f_stat, float(stats.f.sf(f_stat, df_between, df_within))
+
+def window_ends(dates, window_months, step_months):
+    """Fines (exclusivos) de las ventanas: inicios de mes cada step_months desde que cabe una ventana completa."""
+    first = dates.min().to_period('M').to_timestamp()
+    # La última ventana termina al empezar el mes siguiente al último día
+    last_end = dates.max().to_period('M').to_timestamp() + pd.DateOffset(months=1)
+    return pd.date_range(first + pd.DateOffset(months=window_months), last_end, freq=f'{step_months}MS')
+
+@profiler.profile('rolling', rows=lambda result: len(result[0]))
+def rolling_statistics(daily_metrics, window_months=None, step_months=None, tests=True):
+    """Estadísticos por fase y pruebas en ventanas móviles de window_months desplazadas step_months.
+
+    Cada fila diaria entra en los acumuladores de su fase una sola vez y sale
+    una sola vez al avanzar la ventana, así que el coste de los momentos es
+    lineal en la historia. ANOVA sale de los momentos de cada fase;
+    Kruskal-Wallis necesita rangos y se calcula con los valores ordenados de
+    la ventana. Los períodos se ignoran: la ventana sustituye al régimen.
+    Por defecto window_months y step_months son ROLLING_WINDOW_MONTHS y
+    ROLLING_STEP_MONTHS. Devuelve (estadísticos, pruebas), ambos indexados
+    por window_end.
+    """
+    import scipy.stats as stats
+
+    window_months = settings.ROLLING_WINDOW_MONTHS if window_months is None else window_months
+    step_months = settings.ROLLING_STEP_MONTHS if step_months is None else step_months
+    daily = daily_metrics.sort_values('date', kind='stable').reset_index(drop=True)
+    dates = pd.to_datetime(daily['date'])
+    phases = pd.Categorical(daily['lunar_phase'])
+    codes = phases.codes
+    records = daily[METRICS + ['count']].to_dict('records')
+    accumulators = [RollingPhaseStats() for _ in phases.categories]
+    date_ns = dates.to_numpy(dtype='datetime64[ns]')
+
+    stats_rows, test_rows = [], []
+    added = removed = 0
+    for end in window_ends(dates, window_months, step_months):
+        start = end - pd.DateOffset(months=window_months)
+        # Entran las filas anteriores al nuevo fin y salen las anteriores al nuevo inicio
+        upto = int(np.searchsorted(date_ns, np.datetime64(end, 'ns'), side='left'))
+        for i in range(added, upto):
+            if codes[i] >= 0:
+                accumulators[codes[i]].update(records[i], 1)
+        added = upto
+        since = int(np.searchsorted(date_ns, np.datetime64(start, 'ns'), side='left'))
+        for i in range(removed, since):
+            if codes[i] >= 0:
+                accumulators[codes[i]].update(records[i], -1)
+        removed = since
+
+        for phase, accumulator in zip(phases.categories, accumulators):
+            if accumulator.moments['mean_return'].n or accumulator.bars:
+                stats_rows.append({'window_start': start, 'window_end': end, 'lunar_phase': phase, **accumulator.result()})
+        if not tests:
+            continue
+        for metric in METRICS:
+            moments = [accumulator.moments[metric] for accumulator in accumulators]
+            f_stat, p_value = anova_from_moments(moments)
+            test_rows.append({'window_start': start, 'window_end': end, 'metric': metric, 'test': 'ANOVA_Welch',
+                              'statistic': f_stat, 'p_value': p_value, 'days': sum(m.n for m in moments)})
+            groups = [m.sorted for m in moments if m.n > 0]
+            try:
+                h_stat, p_value = stats.kruskal(*groups) if len(groups) > 1 else (np.nan, np.nan)
+            except ValueError as e:
+                logging.warning(f"Error en Kruskal-Wallis para {metric} en la ventana que termina en {end.date()}: {e}")
+                h_stat, p_value = np.nan, np.nan
+            test_rows.append({'window_start': start, 'window_end': end, 'metric': metric, 'test': 'Kruskal-Wallis',
+                              'statistic': h_stat, 'p_value': p_value, 'days': sum(m.n for m in moments)})
+
+    stats_df = pd.DataFrame(stats_rows)
+    tests_df = pd.DataFrame(test_rows)
+    if not tests_df.empty:
+        tests_df['significant'] = tests_df['p_value'] < 0.05
+    return (stats_df.set_index('window_end') if not stats_df.empty else stats_df,
+            tests_df.set_index('window_end') if not tests_df.empty else tests_df)
+
+def save_rolling(stats_df, tests_df, output_dir='data/processed'):
+    """Guarda rolling_statistics.csv y rolling_tests.csv."""
+    os.makedirs(output_dir, exist_ok=True)
+    stats_path = os.path.join(output_dir, 'rolling_statistics.csv')
+    tests_path = os.path.join(output_dir, 'rolling_tests.csv')
+    stats_df.to_csv(stats_path)
+    tests_df.to_csv(tests_path)
+    logging.info(f"Estadísticas móviles guardadas en {stats_path} y {tests_path}")
+    return stats_path, tests_path
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Estadísticas por fase lunar y pruebas en ventanas móviles.")
+    parser.add_argument('--window-months', type=int, default=settings.ROLLING_WINDOW_MONTHS)
+    parser.add_argument('--step-months', type=int, default=settings.ROLLING_STEP_MONTHS)
+    args = parser.parse_args()
+
+    import analyze_lunar_phases as analysis
+    daily_metrics = analysis.calculate_metrics(analysis.load_data())
+    stats_df, tests_df = rolling_statistics(daily_metrics, args.window_months, args.step_months)
+    logging.info(f"{stats_df.index.nunique()} ventanas de {args.window_months} meses cada {args.step_months}")
+    save_rolling(stats_df, tests_df)
+
+if __name__ == "__main__":
+    main()
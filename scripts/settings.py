@@ -0,0 +1,300 @@
+import logging
+import os
+from datetime import datetime, timezone
+from functools import cached_property
+from dotenv import load_dotenv
+
+class Settings:
+    """Configuración del proyecto leída de .env bajo demanda.
+
+    .env se carga en el primer acceso y cada valor se convierte y valida la
+    primera vez que se usa: importar un módulo no tiene efectos secundarios y
+    un comando no falla por variables que no necesita.
+    """
+
+    def __init__(self):
+        self._env_loaded = False
+        self._ephemeris_configured = False
+
+    def env(self, key, default=None):
+        """Valor de una variable de entorno (cargando .env la primera vez)."""
+        if not self._env_loaded:
+            load_dotenv()
+            self._env_loaded = True
+        return os.getenv(key, default)
+
+    def workers(self, key, default='0'):
+        """Número de procesos de una variable *_WORKERS (0 = uno por CPU)."""
+        return int(self.env(key, default)) or os.cpu_count()
+
+    # Valores de .env
+    @cached_property
+    def EPHE_PATH(self):
+        return self.env('EPHE_PATH', 'data/lunar_data/swisseph_dll')
+
+    @cached_property
+    def DLL_PATH(self):
+        return os.path.abspath(self.env('DLL_PATH', 'data/lunar_data/swisseph_dll'))
+
+    @cached_property
+    def START_DATE(self):
+        return self.env('START_DATE', '2018-01-01')
+
+    @cached_property
+    def END_DATE(self):
+        return self.env('END_DATE', '2024-12-31')
+
+    @cached_property
+    def FINANCIAL_DATA_TIMEZONE(self):
+        return self.env('FINANCIAL_DATA_TIMEZONE', 'UTC')
+
+    @cached_property
+    def PRE_PANDEMIC_END(self):
+        return self.env('PRE_PANDEMIC_END', '2020-03-01')
+
+    @cached_property
+    def PANDEMIC_END(self):
+        return self.env('PANDEMIC_END', '2021-12-31')
+
+    @cached_property
+    def PERIOD_CUTS(self):
+        return self.env('PERIOD_CUTS', '')
+
+    @cached_property
+    def PERIOD_LABELS(self):
+        return self.env('PERIOD_LABELS', 'pre-pandemia,pandemia,pos-pandemia')
+
+    @cached_property
+    def FINANCIAL_CSV(self):
+        return self.env('FINANCIAL_CSV', 'eur_usd_m1.csv')
+
+    @cached_property
+    def FINANCIAL_DATA_PATH(self):
+        return self.env('FINANCIAL_DATA_PATH', 'data/financial_data')
+
+    @cached_property
+    def FINANCIAL_CHUNK_SIZE(self):
+        return int(self.env('FINANCIAL_CHUNK_SIZE', '0'))
+
+    @cached_property
+    def EXPORT_COMBINED_CSV(self):
+        return self.env('EXPORT_COMBINED_CSV', 'false').lower() in ('1', 'true', 'yes')
+
+    @cached_property
+    def PRICE_DECIMALS(self):
+        decimals = int(self.env('PRICE_DECIMALS', '5'))
+        if not 0 <= decimals <= 9:
+            logging.error(f"PRICE_DECIMALS debe estar entre 0 y 9: {decimals}")
+            raise ValueError(f"PRICE_DECIMALS inválido: {decimals}")
+        return decimals
+
+    @cached_property
+    def PHASE_TOLERANCE_SECONDS(self):
+        tolerance = int(self.env('PHASE_TOLERANCE_SECONDS', '60'))
+        if tolerance < 1:
+            logging.error(f"PHASE_TOLERANCE_SECONDS debe ser al menos 1 segundo: {tolerance}")
+            raise ValueError(f"PHASE_TOLERANCE_SECONDS inválido: {tolerance}")
+        return tolerance
+
+    @cached_property
+    def PHASE_CACHE_DIR(self):
+        return self.env('PHASE_CACHE_DIR', 'data/lunar_data/cache')
+
+    @cached_property
+    def RETURN_GAP_MINUTES(self):
+        return float(self.env('RETURN_GAP_MINUTES', '0'))
+
+    @cached_property
+    def SESSION_GAP_MINUTES(self):
+        minutes = float(self.env('SESSION_GAP_MINUTES', '30'))
+        if minutes < 1:
+            logging.error(f"SESSION_GAP_MINUTES debe ser al menos 1 minuto: {minutes}")
+            raise ValueError(f"SESSION_GAP_MINUTES inválido: {minutes}")
+        return minutes
+
+    @cached_property
+    def DROP_INVALID_BARS(self):
+        return self.env('DROP_INVALID_BARS', 'false').lower() in ('1', 'true', 'yes')
+
+    @cached_property
+    def RESET_RETURNS_AT_SESSIONS(self):
+        return self.env('RESET_RETURNS_AT_SESSIONS', 'false').lower() in ('1', 'true', 'yes')
+
+    @cached_property
+    def ANALYSIS_RESOLUTION(self):
+        return self.env('ANALYSIS_RESOLUTION', '').strip().upper()
+
+    @cached_property
+    def N_PERMUTATIONS(self):
+        return int(self.env('N_PERMUTATIONS', '10000'))
+
+    @cached_property
+    def N_BOOTSTRAP(self):
+        return int(self.env('N_BOOTSTRAP', '2000'))
+
+    @cached_property
+    def BOOTSTRAP_BLOCK_DAYS(self):
+        return int(self.env('BOOTSTRAP_BLOCK_DAYS', '5'))
+
+    @cached_property
+    def RESAMPLING_SEED(self):
+        return int(self.env('RESAMPLING_SEED', '20240101'))
+
+    @cached_property
+    def RESAMPLING_WORKERS(self):
+        return self.workers('RESAMPLING_WORKERS')
+
+    @cached_property
+    def PLOT_WORKERS(self):
+        return self.workers('PLOT_WORKERS')
+
+    @cached_property
+    def BATCH_INSTRUMENTS(self):
+        return self.env('BATCH_INSTRUMENTS', '')
+
+    @cached_property
+    def BATCH_WORKERS(self):
+        return self.workers('BATCH_WORKERS')
+
+    @cached_property
+    def BATCH_OUTPUT_DIR(self):
+        return self.env('BATCH_OUTPUT_DIR', 'data/processed')
+
+    @cached_property
+    def INCREMENTAL_STATE_DIR(self):
+        return self.env('INCREMENTAL_STATE_DIR', 'data/processed/incremental')
+
+    @cached_property
+    def QUANTILE_SKETCH_CAPACITY(self):
+        return int(self.env('QUANTILE_SKETCH_CAPACITY', '2048'))
+
+    @cached_property
+    def ROLLING_WINDOW_MONTHS(self):
+        return int(self.env('ROLLING_WINDOW_MONTHS', '12'))
+
+    @cached_property
+    def ROLLING_STEP_MONTHS(self):
+        return int(self.env('ROLLING_STEP_MONTHS', '1'))
+
+    @cached_property
+    def FACTOR_CUBE_FACTORS(self):
+        return self.env('FACTOR_CUBE_FACTORS', 'lunar_phase,period,weekday,hour,session')
+
+    @cached_property
+    def FACTOR_MARGINALS(self):
+        return self.env('FACTOR_MARGINALS', 'lunar_phase,period;lunar_phase,weekday;lunar_phase,hour;lunar_phase,session')
+
+    @cached_property
+    def TRADING_SESSION_HOURS(self):
+        return self.env('TRADING_SESSION_HOURS', '22,7,13')
+
+    @cached_property
+    def EVENT_WINDOW_MINUTES(self):
+        return int(self.env('EVENT_WINDOW_MINUTES', '240'))
+
+    @cached_property
+    def EVENT_STEP_MINUTES(self):
+        return int(self.env('EVENT_STEP_MINUTES', '1'))
+
+    @cached_property
+    def EVENT_ESTIMATION_MINUTES(self):
+        return int(self.env('EVENT_ESTIMATION_MINUTES', '10080'))
+
+    @cached_property
+    def EVENT_CONFIDENCE(self):
+        return float(self.env('EVENT_CONFIDENCE', '0.95'))
+
+    @cached_property
+    def EVENT_WORKERS(self):
+        return self.workers('EVENT_WORKERS')
+
+    @cached_property
+    def STREAM_HORIZON_DAYS(self):
+        return int(self.env('STREAM_HORIZON_DAYS', '30'))
+
+    @cached_property
+    def STREAM_REFRESH_DAYS(self):
+        return int(self.env('STREAM_REFRESH_DAYS', '7'))
+
+    @cached_property
+    def STREAM_LATENCY_WINDOW(self):
+        return int(self.env('STREAM_LATENCY_WINDOW', '100000'))
+
+    @cached_property
+    def PIPELINE_WORKERS(self):
+        return int(self.env('PIPELINE_WORKERS', '3'))
+
+    @cached_property
+    def PIPELINE_STATE(self):
+        return self.env('PIPELINE_STATE', 'data/processed/.pipeline_state.json')
+
+    # Valores derivados
+    def _parse_date(self, key, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        except ValueError as e:
+            logging.error(f"Error en el formato de las fechas en .env ({key}): {e}")
+            raise
+
+    @cached_property
+    def start_date(self):
+        return self._parse_date('START_DATE', self.START_DATE)
+
+    @cached_property
+    def end_date(self):
+        return self._parse_date('END_DATE', self.END_DATE)
+
+    @cached_property
+    def pre_pandemic_end(self):
+        return self._parse_date('PRE_PANDEMIC_END', self.PRE_PANDEMIC_END)
+
+    @cached_property
+    def pandemic_end(self):
+        return self._parse_date('PANDEMIC_END', self.PANDEMIC_END)
+
+    @cached_property
+    def period_cuts_ns(self):
+        """Cortes de período en ns UTC: cada corte es el primer instante de un período nuevo."""
+        import numpy as np
+        import pandas as pd
+        from phase_tagging import to_epoch_ns
+        try:
+            if self.PERIOD_CUTS:
+                period_cuts = pd.to_datetime([cut.strip() for cut in self.PERIOD_CUTS.split(',')], format='%Y-%m-%d').tz_localize('UTC')
+                cuts = to_epoch_ns(period_cuts)
+            else:
+                # PANDEMIC_END es inclusivo: el período siguiente empieza 1 ns después
+                cuts = to_epoch_ns(pd.DatetimeIndex([self.pre_pandemic_end, self.pandemic_end])) + np.array([0, 1])
+        except ValueError as e:
+            logging.error(f"Error en el formato de PERIOD_CUTS en .env: {e}")
+            raise
+        labels = [label.strip() for label in self.PERIOD_LABELS.split(',')]
+        if len(labels) != len(cuts) + 1 or (np.diff(cuts) <= 0).any():
+            logging.error(f"PERIOD_LABELS necesita una etiqueta más que cortes ordenados en PERIOD_CUTS: {labels}")
+            raise ValueError("Configuración de períodos inválida")
+        return cuts
+
+    @cached_property
+    def period_labels(self):
+        labels = [label.strip() for label in self.PERIOD_LABELS.split(',')]
+        self.period_cuts_ns  # valida que etiquetas y cortes coincidan
+        return labels
+
+    def configure_ephemeris(self):
+        """Verifica y configura las rutas de Swiss Ephemeris (una sola vez por proceso)."""
+        if self._ephemeris_configured:
+            return
+        import swisseph as swe
+        if not os.path.exists(self.EPHE_PATH):
+            logging.error(f"Directorio de efemérides no encontrado: {self.EPHE_PATH}")
+            raise FileNotFoundError(f"Directorio de efemérides no encontrado: {self.EPHE_PATH}")
+        if not os.path.exists(self.DLL_PATH):
+            logging.error(f"Directorio de DLL no encontrado: {self.DLL_PATH}")
+            raise FileNotFoundError(f"Directorio de DLL no encontrado: {self.DLL_PATH}")
+        swe.set_ephe_path(self.EPHE_PATH)
+        if os.name == 'nt':  # Windows
+            os.add_dll_directory(self.DLL_PATH)
+        logging.info(f"Rutas de Swiss Ephemeris configuradas: {self.EPHE_PATH}, {self.DLL_PATH}")
+        self._ephemeris_configured = True
+
+settings = Settings()
@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import bisect
+import collections
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import date, datetime, timezone
+import numpy as np
+import pandas as pd
+import pytz
+import calculate_lunar_phases as phases
+from data_quality import RepeatedHours
+from incremental_update import PhaseAccumulator
+from phase_tagging import MISSING_CODE, NS_PER_DAY, NS_PER_MINUTE, NS_PER_SECOND, phase_boundaries
+from settings import settings
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Consultas que se pueden enviar en lugar de una barra
+QUERIES = ('stats', 'latency')
+# Swiss Ephemeris y los coeficientes de LunarElongation no son seguros entre
+# hilos: la renovación en segundo plano y la de una barra fuera de la tabla se turnan
+_ephemeris_lock = threading.Lock()
+
+class PhaseTable:
+    """Límites de fase y series de elongación precalculados para [start_ns, end_ns).
+
+    Etiquetar una barra es una búsqueda binaria sobre los límites y la
+    evaluación de un polinomio de Chebyshev del día; no llama a la efeméride.
+    """
+
+    def __init__(self, start_ns, end_ns, boundaries_ns, codes, first_day, coefficients):
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.boundaries = [int(boundary) for boundary in boundaries_ns]
+        self.codes = [int(code) for code in codes]
+        self.first_day = first_day
+        self.coefficients = coefficients.tolist()
+
+    def covers(self, timestamp_ns):
+        return self.start_ns <= timestamp_ns < self.end_ns
+
+    def phase_code(self, timestamp_ns):
+        index = bisect.bisect_right(self.boundaries, timestamp_ns) - 1
+        return self.codes[index] if index >= 0 else MISSING_CODE
+
+    def elongation(self, timestamp_ns):
+        """Elongación en grados [0, 360) (misma serie que la columna lunar_angle del modo por lotes)."""
+        day = timestamp_ns // NS_PER_DAY
+        coeffs = self.coefficients[day - self.first_day]
+        x = 2.0 * (timestamp_ns - day * NS_PER_DAY) / NS_PER_DAY - 1.0
+        b1 = b2 = 0.0
+        for coeff in coeffs[:0:-1]:
+            b1, b2 = coeff + 2.0 * x * b1 - b2, b1
+        return (coeffs[0] + x * b1 - b2) % 360.0
+
+def build_phase_table(start_ns, end_ns):
+    """Tabla de [start_ns, end_ns) a partir de la caché de cambios de fase (calcula los tramos que falten).
+
+    Se puede llamar desde varios hilos: las llamadas a la efeméride se serializan.
+    """
+    start = pd.Timestamp(start_ns, tz='UTC').to_pydatetime()
+    end = pd.Timestamp(end_ns, tz='UTC').to_pydatetime()
+    first_day, last_day = start_ns // NS_PER_DAY, (end_ns - 1) // NS_PER_DAY
+    with _ephemeris_lock:
+        changes = phases.load_phase_changes(start, end)
+        coefficients = phases.elongation_interpolator().day_coefficients(first_day, last_day)
+    boundaries_ns, codes = phase_boundaries(changes, phases.PHASE_NAMES_ES)
+    return PhaseTable(start_ns, end_ns, boundaries_ns, codes, first_day, coefficients)
+
+class BarParser:
+    """Convierte líneas date,time,open,high,low,close,volume (hora local de FINANCIAL_DATA_TIMEZONE) a ns UTC.
+
+    El desfase horario se calcula una vez por hora local y se guarda. Las horas
+    repetidas al atrasar el reloj se resuelven por orden de llegada con la
+    misma regla que el modo por lotes (RepeatedHours) y las que no existen al
+    adelantarlo se rechazan.
+    """
+
+    def __init__(self, timezone_name=None):
+        self.timezone = pytz.timezone(timezone_name) if timezone_name else pytz.UTC
+        self.repeated_hours = RepeatedHours()
+        self._hour_start = {}
+
+    def _hour_start_seconds(self, date_text, hour):
+        """(segundos UTC desde la época del inicio de la hora local, segundos a sumar en horario estándar).
+
+        En horas repetidas el inicio es el de la pasada en horario de verano; el
+        desplazamiento es None fuera de ellas y el inicio es None si la hora no existe.
+        """
+        year, month, day = (int(part) for part in date_text.split('.'))
+        local = datetime(year, month, day, hour)
+        seconds = (date(year, month, day).toordinal() - EPOCH_ORDINAL) * 86400 + hour * 3600
+        try:
+            return seconds - int(self.timezone.localize(local, is_dst=None).utcoffset().total_seconds()), None
+        except pytz.AmbiguousTimeError:
+            summer = self.timezone.localize(local, is_dst=True).utcoffset()
+            standard = self.timezone.localize(local, is_dst=False).utcoffset()
+            return seconds - int(summer.total_seconds()), int((summer - standard).total_seconds())
+        except pytz.NonExistentTimeError:
+            return None, None
+
+    def parse(self, line):
+        """Devuelve (timestamp_ns, campos de texto, cierre); ValueError si la línea no es una barra."""
+        fields = line.split(',')
+        if len(fields) != 7:
+            raise ValueError(f"se esperaban 7 columnas y hay {len(fields)}")
+        clock = fields[1].split(':')
+        key = (fields[0], int(clock[0]))
+        cached = self._hour_start.get(key)
+        if cached is None:
+            cached = self._hour_start[key] = self._hour_start_seconds(*key)
+        hour_start, standard_shift = cached
+        if hour_start is None:
+            raise ValueError(f"hora local inexistente {fields[0]} {fields[1]}")
+        seconds = hour_start + int(clock[1]) * 60 + (int(clock[2]) if len(clock) > 2 else 0)
+        close = float(fields[5])
+        if not close > 0:
+            raise ValueError(f"cierre inválido {fields[5]}")
+        if not self.repeated_hours.is_dst_one(seconds * NS_PER_SECOND, standard_shift is not None):
+            seconds += standard_shift
+        return seconds * NS_PER_SECOND, fields, close
+
+class LivePhaseStats:
+    """Estadísticos por (fase, período) actualizados barra a barra.
+
+    Reproduce las métricas diarias del modo por lotes: el retorno de cada barra
+    (desde el cierre anterior, NaN tras un hueco mayor que gap_ns) se acumula
+    con Welford en el tramo abierto (día UTC, fase, período); al cambiar de
+    tramo, su media, volatilidad y número de barras pasan al PhaseAccumulator
+    de la combinación, como en incremental_update.
+    """
+
+    def __init__(self, gap_ns=None):
+        self.gap_ns = gap_ns
+        self.accumulators = {}
+        self.segment = None
+        self.n, self.mean, self.m2, self.bars = 0, 0.0, 0.0, 0
+        self.last_ns = None
+        self.last_close = None
+
+    def add(self, timestamp_ns, close, phase_code, period_code):
+        """Añade una barra; devuelve False (sin contarla) si no es posterior a la anterior."""
+        if self.last_ns is not None and timestamp_ns <= self.last_ns:
+            return False
+        segment = (timestamp_ns // NS_PER_DAY, phase_code, period_code)
+        if segment != self.segment:
+            self._flush(self.accumulators)
+            self.segment = segment
+            self.n, self.mean, self.m2, self.bars = 0, 0.0, 0.0, 0
+        if self.last_ns is not None and (self.gap_ns is None or timestamp_ns - self.last_ns <= self.gap_ns):
+            value = math.log(close / self.last_close)
+            self.n += 1
+            delta = value - self.mean
+            self.mean += delta / self.n
+            self.m2 += delta * (value - self.mean)
+        self.bars += 1
+        self.last_ns, self.last_close = timestamp_ns, close
+        return True
+
+    def _flush(self, accumulators):
+        """Suma el tramo abierto a accumulators (los tramos sin fase o período se descartan)."""
+        if self.segment is None or self.segment[1] < 0 or self.segment[2] < 0:
+            return
+        volatility = math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+        accumulators.setdefault(f'{self.segment[1]},{self.segment[2]}', PhaseAccumulator()).add(
+            [self.mean if self.n else np.nan], [volatility], [self.bars])
+
+    def statistics(self, period_labels):
+        """Filas con las columnas de statistics_by_phase_period.csv, incluido el día en curso."""
+        accumulators = {key: acc.copy() for key, acc in self.accumulators.items()}
+        self._flush(accumulators)
+        rows = []
+        for key in sorted(accumulators, key=lambda k: tuple(int(code) for code in k.split(','))):
+            phase_code, period_code = (int(code) for code in key.split(','))
+            rows.append({'lunar_phase': phases.PHASE_NAMES_ES[phase_code], 'period': period_labels[period_code],
+                         **accumulators[key].result()})
+        return rows
+
+class LatencyTracker:
+    """Latencias de etiquetado de las últimas `window` barras (STREAM_LATENCY_WINDOW), con percentiles bajo demanda."""
+
+    def __init__(self, window=None):
+        self.samples = collections.deque(maxlen=settings.STREAM_LATENCY_WINDOW if window is None else window)
+        self.count = 0
+
+    def add(self, elapsed_ns):
+        self.samples.append(elapsed_ns)
+        self.count += 1
+
+    def report(self):
+        if not self.samples:
+            return {'bars': self.count, 'window': 0, 'p50_us': None, 'p99_us': None, 'max_us': None}
+        values = np.fromiter(self.samples, dtype=np.int64, count=len(self.samples)) / 1000
+        p50, p99 = np.percentile(values, [50, 99])
+        return {'bars': self.count, 'window': len(values), 'p50_us': round(float(p50), 2),
+                'p99_us': round(float(p99), 2), 'max_us': round(float(values.max()), 2)}
+
+class StreamingTagger:
+    """Etiqueta barras en vivo con fase, período y elongación, y mantiene estadísticos por fase.
+
+    La tabla de fases cubre horizon_days desde el día de la barra; cuando una
+    barra queda a menos de refresh_days de su final se construye la siguiente
+    en un hilo, de modo que el etiquetado no espera a la efeméride. Una barra
+    fuera de la tabla (arranque o salto de fechas) espera a que se construya,
+    también en un hilo, sin bloquear el bucle de eventos; su latencia se mide
+    aparte (miss_latency).
+    """
+
+    def __init__(self, horizon_days=None, refresh_days=None, latency_window=None):
+        horizon_days = settings.STREAM_HORIZON_DAYS if horizon_days is None else horizon_days
+        refresh_days = settings.STREAM_REFRESH_DAYS if refresh_days is None else refresh_days
+        if refresh_days >= horizon_days:
+            logging.error(f"STREAM_REFRESH_DAYS ({refresh_days}) debe ser menor que STREAM_HORIZON_DAYS ({horizon_days})")
+            raise ValueError("Horizonte de la tabla de fases inválido")
+        gap_ns = int(settings.RETURN_GAP_MINUTES * NS_PER_MINUTE) if settings.RETURN_GAP_MINUTES > 0 else None
+        self.horizon_ns = horizon_days * NS_PER_DAY
+        self.refresh_ns = refresh_days * NS_PER_DAY
+        self.parser = BarParser(settings.FINANCIAL_DATA_TIMEZONE)
+        self.period_cuts = [int(cut) for cut in settings.period_cuts_ns]
+        self.period_labels = settings.period_labels
+        self.stats = LivePhaseStats(gap_ns)
+        self.latency = LatencyTracker(latency_window)
+        self.miss_latency = LatencyTracker(latency_window)
+        self.table = None
+        self.table_misses = 0
+        self.out_of_order = 0
+        self._refresh = None
+        self._miss_build = None
+
+    def table_range(self, timestamp_ns):
+        """Rango de la tabla para una barra: desde el día anterior hasta horizon_days después."""
+        start = (timestamp_ns // NS_PER_DAY - 1) * NS_PER_DAY
+        return start, start + NS_PER_DAY + self.horizon_ns
+
+    async def prepare(self, timestamp_ns):
+        """Construye la tabla inicial fuera del bucle de eventos."""
+        self.table = await asyncio.to_thread(build_phase_table, *self.table_range(timestamp_ns))
+        logging.info(f"Tabla de fases preparada hasta {pd.Timestamp(self.table.end_ns, tz='UTC')}")
+
+    async def _extend(self, timestamp_ns):
+        try:
+            table = await asyncio.to_thread(build_phase_table, *self.table_range(timestamp_ns))
+        except Exception as e:
+            logging.error(f"Error al renovar la tabla de fases: {e}")
+            return
+        if self.table is None or table.end_ns > self.table.end_ns:
+            self.table = table
+            logging.info(f"Tabla de fases renovada hasta {pd.Timestamp(table.end_ns, tz='UTC')}")
+
+    async def _table_for_miss(self, timestamp_ns):
+        """Tabla para una barra fuera de la actual, construida en un hilo.
+
+        Las barras que caen en el rango de una construcción en curso (otros
+        clientes del socket) esperan a esa misma en lugar de lanzar otra.
+        """
+        pending = self._miss_build
+        if pending is None or not pending[0] <= timestamp_ns < pending[1]:
+            start, end = self.table_range(timestamp_ns)
+            pending = self._miss_build = (start, end, asyncio.ensure_future(asyncio.to_thread(build_phase_table, start, end)))
+        try:
+            table = await pending[2]
+        finally:
+            if self._miss_build is pending:
+                self._miss_build = None
+        self.table = table
+        return table
+
+    async def tag(self, line):
+        """Etiqueta una línea de barra y devuelve la línea de salida (timestamp UTC, OHLCV, fase, período, elongación)."""
+        started = time.perf_counter_ns()
+        timestamp_ns, fields, close = self.parser.parse(line)
+        table = self.table
+        if table is None or not table.covers(timestamp_ns):
+            self.table_misses += 1
+            table = await self._table_for_miss(timestamp_ns)
+            output = self._label(table, timestamp_ns, fields, close)
+            elapsed = time.perf_counter_ns() - started
+            self.miss_latency.add(elapsed)
+            logging.warning(f"Barra fuera de la tabla de fases ({pd.Timestamp(timestamp_ns, tz='UTC')}); "
+                            f"etiquetada en {elapsed / 1e6:.1f} ms tras construir la tabla")
+            return output
+        if timestamp_ns >= table.end_ns - self.refresh_ns and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.ensure_future(self._extend(timestamp_ns))
+        output = self._label(table, timestamp_ns, fields, close)
+        self.latency.add(time.perf_counter_ns() - started)
+        return output
+
+    def _label(self, table, timestamp_ns, fields, close):
+        """Línea de salida de una barra con la tabla dada; actualiza los estadísticos."""
+        phase_code = table.phase_code(timestamp_ns)
+        period_code = bisect.bisect_right(self.period_cuts, timestamp_ns)
+        angle = table.elongation(timestamp_ns)
+        if not self.stats.add(timestamp_ns, close, phase_code, period_code):
+            self.out_of_order += 1
+        phase = phases.PHASE_NAMES_ES[phase_code] if phase_code >= 0 else ''
+        stamp = datetime.fromtimestamp(timestamp_ns // NS_PER_SECOND, timezone.utc)
+        return f"{stamp},{','.join(fields[2:])},{phase},{self.period_labels[period_code]},{angle}"
+
+    def report(self):
+        """Latencias (las barras fuera de la tabla en table_miss), contadores y estadísticos por fase y período en un dict serializable a JSON."""
+        return {'latency': {**self.latency.report(), 'table_misses': self.table_misses, 'out_of_order': self.out_of_order,
+                            'table_miss': self.miss_latency.report()},
+                'statistics': self.stats.statistics(self.period_labels)}
+
+    async def respond(self, line):
+        """Respuesta a una línea de entrada: barra etiquetada o resultado de una consulta en JSON; None si se ignora."""
+        line = line.strip()
+        if not line or line.lower().startswith('date'):
+            return None
+        query = line.lower()
+        if query == 'stats':
+            return json.dumps(self.report()['statistics'], default=float)
+        if query == 'latency':
+            return json.dumps(self.report()['latency'])
+        try:
+            return await self.tag(line)
+        except (ValueError, IndexError) as e:
+            logging.warning(f"Línea ignorada {line[:80]!r}: {e}")
+            return None
+
+async def stdin_lines():
+    """Líneas de stdin: pipes y terminales con asyncio; un archivo redirigido se lee directamente."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except ValueError:
+        # Archivo regular: cede el bucle cada 1000 líneas para que avance la renovación de la tabla
+        for i, line in enumerate(sys.stdin.buffer):
+            yield line
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+        return
+    async for line in reader:
+        yield line
+
+async def serve_stdin(tagger):
+    """Etiqueta las barras de stdin y escribe las líneas de salida en stdout."""
+    async for raw in stdin_lines():
+        response = await tagger.respond(raw.decode())
+        if response is not None:
+            sys.stdout.write(response + '\n')
+            sys.stdout.flush()
+
+async def serve_socket(tagger, address):
+    """Servidor en un socket local (HOST:PORT, PORT o ruta de socket Unix); responde a cada cliente por su conexión."""
+    async def handle(reader, writer):
+        async for raw in reader:
+            response = await tagger.respond(raw.decode())
+            if response is not None:
+                writer.write((response + '\n').encode())
+                await writer.drain()
+        writer.close()
+
+    if '/' in address:
+        server = await asyncio.start_unix_server(handle, path=address)
+    else:
+        host, _, port = address.rpartition(':')
+        server = await asyncio.start_server(handle, host or '127.0.0.1', int(port))
+    logging.info(f"Escuchando en {address}")
+    async with server:
+        await server.serve_forever()
+
+async def run_stream(listen=None, start=None, report_path=None):
+    """Prepara la tabla de fases (desde start o desde ahora) y atiende stdin o el socket hasta que se cierre."""
+    tagger = StreamingTagger()
+    # SIGTERM (y SIGINT) terminan el servicio escribiendo el informe final
+    task, loop = asyncio.current_task(), asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, task.cancel)
+        except NotImplementedError:
+            pass
+    start = pd.Timestamp(start, tz='UTC') if start else pd.Timestamp.now(tz='UTC')
+    await tagger.prepare(start.value)
+    try:
+        await (serve_socket(tagger, listen) if listen else serve_stdin(tagger))
+    finally:
+        report = tagger.report()
+        latency = report['latency']
+        logging.info(f"{latency['bars']} barras etiquetadas; latencia p50 {latency['p50_us']} µs, p99 {latency['p99_us']} µs "
+                     f"({latency['table_misses']} fuera de la tabla, p50 {latency['table_miss']['p50_us']} µs; "
+                     f"{latency['out_of_order']} desordenadas)")
+        if report_path:
+            os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False, default=float)
+            logging.info(f"Informe del flujo guardado en {report_path}")
+
+def serve(listen=None, start=None, report_path=None):
+    """Ejecuta el servicio hasta fin de entrada, Ctrl+C o SIGTERM."""
+    try:
+        asyncio.run(run_stream(listen, start, report_path))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Etiqueta barras en vivo con fase lunar, período y elongación.")
+    parser.add_argument('--listen', help="Socket local HOST:PORT, PORT o ruta de socket Unix (por defecto stdin/stdout)")
+    parser.add_argument('--start', help="Fecha UTC con la que preparar la tabla de fases (por defecto, ahora)")
+    parser.add_argument('--report', help="Guarda latencias y estadísticos finales en este JSON al terminar")
+    args = parser.parse_args()
+    serve(args.listen, args.start, args.report)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import argparse
+import json
 import pandas as pd
 import numpy as np
 import os
@@ -5,7 +7,6 @@ import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logging.info("Generando resumen consolidado de resultados para análisis...")
 
 def load_results():
     """Carga los archivos de resultados."""
@@ -21,6 +22,16 @@ def load_results():
     logging.info("Archivos de resultados cargados correctamente")
     return stats_df, tests_df
 
+def load_profile_report(profile_path):
+    """Carga un informe de perfil JSON (generado con --profile)."""
+    if not os.path.exists(profile_path):
+        logging.error(f"Informe de perfil no encontrado: {profile_path}")
+        raise FileNotFoundError(f"Informe de perfil no encontrado: {profile_path}")
+    with open(profile_path, encoding='utf-8') as f:
+        report = json.load(f)
+    logging.info(f"Informe de perfil cargado desde {profile_path}")
+    return report
+
 def analyze_boxplot_patterns(stats_df):
     """Genera un resumen numérico de los patrones en los boxplots."""
     boxplot_summary = []
@@ -87,7 +98,7 @@ def analyze_trend_patterns(stats_df):
     
     return pd.DataFrame(trend_summary)
 
-def generate_markdown_summary(stats_df, tests_df, boxplot_summary, trend_summary):
+def generate_markdown_summary(stats_df, tests_df, boxplot_summary, trend_summary, profile_report=None):
     """Genera un resumen consolidado en Markdown."""
     output_dir = 'data/processed'
     os.makedirs(output_dir, exist_ok=True)
@@ -125,7 +136,7 @@ def generate_markdown_summary(stats_df, tests_df, boxplot_summary, trend_summary
         
         f.write("## 2. Pruebas Estadísticas\n\n")
         f.write("**Archivo**: `data/processed/statistical_tests.csv`\n\n")
-        f.write("Resultados de ANOVA de Welch y Kruskal-Wallis para determinar diferencias significativas (p < 0.05).\n\n")
+        f.write("Resultados de ANOVA de Welch, Kruskal-Wallis y la prueba de permutación (con intervalo de confianza bootstrap de eta²) para determinar diferencias significativas (p < 0.05).\n\n")
         tests_df['p_value'] = tests_df['p_value'].round(4)
         f.write(tests_df.to_markdown(index=False))
         f.write("\n\n")
@@ -166,17 +177,33 @@ def generate_markdown_summary(stats_df, tests_df, boxplot_summary, trend_summary
         f.write("**Observaciones**:\n")
         for _, row in trend_summary.iterrows():
             f.write(f"- **{row['lunar_phase']}**: Tendencia {row['trend_type'].lower()} en retornos medios (Pre-pandemia: {row['pre_pandemia_return']}, Pandemia: {row['pandemia_return']}, Pos-pandemia: {row['pos_pandemia_return']})\n")
+
+        if profile_report is not None:
+            total = profile_report['total']
+            f.write("\n## 5. Perfil de Ejecución\n\n")
+            f.write(f"Comando `{profile_report['command']}` ({profile_report['created']}, Python {profile_report['python']}): "
+                    f"{total['wall_s']:.2f} s reales, {total['cpu_s']:.2f} s de CPU, {total['calc_ut_calls']} llamadas a `swe.calc_ut`, "
+                    f"pico de RSS {total['peak_rss_mb']} MB.\n\n")
+            stages_df = pd.DataFrame(profile_report['stages'])
+            if not stages_df.empty:
+                f.write(stages_df.to_markdown(index=False))
+                f.write("\n")
     
     logging.info(f"Resumen consolidado guardado en {output_path}")
     return output_path
 
-def main():
-    """Función principal."""
+def main(profile_path=None):
+    """Función principal; con profile_path añade al resumen el informe de perfil indicado."""
+    logging.info("Generando resumen consolidado de resultados para análisis...")
     stats_df, tests_df = load_results()
     boxplot_summary = analyze_boxplot_patterns(stats_df)
     trend_summary = analyze_trend_patterns(stats_df)
-    report_path = generate_markdown_summary(stats_df, tests_df, boxplot_summary, trend_summary)
+    profile_report = load_profile_report(profile_path) if profile_path else None
+    report_path = generate_markdown_summary(stats_df, tests_df, boxplot_summary, trend_summary, profile_report)
     print(f"Resumen consolidado generado en: {report_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Genera el resumen consolidado de resultados en Markdown.")
+    parser.add_argument('--profile-report', nargs='?', const='reports/profile_latest.json', default=None,
+                        help="Incluye un informe de perfil JSON (por defecto reports/profile_latest.json)")
+    main(parser.parse_args().profile_report)
\ No newline at end of file
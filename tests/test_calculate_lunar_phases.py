@@ -0,0 +1,75 @@
+import json
+import os
+import pandas as pd
+import pytest
+from calculate_lunar_phases import combine_financial_data
+from combined_storage import read_combined
+from settings import settings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def bar(stamp, price, inverted=False):
+    """Línea date,time,open,high,low,close,volume en hora de Berlín."""
+    high, low = (price - 0.0002, price + 0.0002) if inverted else (price + 0.0002, price - 0.0002)
+    return f"{stamp:%Y.%m.%d},{stamp:%H:%M},{price:.5f},{high:.5f},{low:.5f},{price:.5f},10"
+
+def defective_lines():
+    """Barras M1 alrededor del cambio de horario del 2020-10-25 con defectos en posiciones conocidas.
+
+    Fila 4 repite la 3, la 7 tiene high < low y la 8 repite su marca de
+    tiempo, las filas 10 y 11 están intercambiadas, la 28 tiene open fuera
+    del rango, faltan 3 minutos y hay un hueco de 45 minutos (nueva sesión).
+    """
+    utc = pd.date_range('2020-10-24 23:50', '2020-10-25 01:20', freq='min', tz='UTC').append(
+        pd.date_range('2020-10-25 02:05', '2020-10-25 02:30', freq='min', tz='UTC'))
+    utc = utc.delete([70, 71, 72])
+    local = utc.tz_convert('Europe/Berlin').tz_localize(None)
+    base = [bar(stamp, 1.1 + i * 1e-5) for i, stamp in enumerate(local)]
+    outside = base[26].split(',')
+    outside[2] = '1.20000'
+    base[26] = ','.join(outside)
+    lines = base[0:4] + [base[3]] + base[4:6] + [bar(local[6], 1.1, inverted=True)] + base[6:]
+    lines[10], lines[11] = lines[11], lines[10]
+    return lines
+
+@pytest.fixture
+def combine(tmp_path, monkeypatch):
+    """Ejecuta combine_financial_data sobre defective_lines() con el FINANCIAL_CHUNK_SIZE pedido."""
+    monkeypatch.chdir(REPO_ROOT)  # EPHE_PATH por defecto es relativo a la raíz
+    csv_path = tmp_path / 'bars.csv'
+    csv_path.write_text('date,time,open,high,low,close,volume\n' + '\n'.join(defective_lines()) + '\n')
+    phases = pd.DataFrame({'TimestampUTC': pd.to_datetime(['2020-10-20 00:00', '2020-10-25 00:30'], utc=True),
+                           'PhaseName': ['Luna Nueva', 'Cuarto Creciente']})
+    monkeypatch.setattr(settings, 'FINANCIAL_DATA_TIMEZONE', 'Europe/Berlin')
+    monkeypatch.setattr(settings, 'EXPORT_COMBINED_CSV', False)
+    monkeypatch.setattr(settings, 'start_date', pd.Timestamp('2020-01-01', tz='UTC').to_pydatetime())
+    monkeypatch.setattr(settings, 'end_date', pd.Timestamp('2021-12-31', tz='UTC').to_pydatetime())
+
+    def run(chunk_size, drop_invalid=False):
+        monkeypatch.setattr(settings, 'FINANCIAL_CHUNK_SIZE', chunk_size)
+        monkeypatch.setattr(settings, 'DROP_INVALID_BARS', drop_invalid)
+        output_dir = tmp_path / f'chunk_{chunk_size}_{drop_invalid}'
+        combine_financial_data(str(csv_path), str(output_dir), df_phases=phases)
+        with open(output_dir / 'data_quality.json', encoding='utf-8') as f:
+            report = json.load(f)
+        return read_combined(str(output_dir)), pd.read_parquet(output_dir / 'sessions.parquet'), report
+    return run
+
+@pytest.mark.parametrize('drop_invalid', [False, True])
+@pytest.mark.parametrize('chunk_size', [4, 6, 50])
+def test_chunked_combine_matches_in_memory(combine, chunk_size, drop_invalid):
+    """Con FINANCIAL_CHUNK_SIZE pequeño las filas, el índice de sesiones y el informe son los de la lectura completa."""
+    expected_df, expected_sessions, expected_report = combine(0, drop_invalid)
+    df, sessions, report = combine(chunk_size, drop_invalid)
+    pd.testing.assert_frame_equal(df, expected_df)
+    pd.testing.assert_frame_equal(sessions, expected_sessions)
+    assert report == expected_report
+    assert df['timestamp'].is_monotonic_increasing
+    # Sin DROP_INVALID_BARS sólo se descartan las horas inexistentes (aquí ninguna)
+    assert len(df) == (len(defective_lines()) - 3 if drop_invalid else len(defective_lines()))
+    assert df['timestamp'].is_unique == drop_invalid
+
+def test_chunked_combine_rejects_disorder_across_chunks(combine):
+    """Las filas 10 y 11 intercambiadas en bloques distintos no se pueden reordenar: ValueError."""
+    with pytest.raises(ValueError):
+        combine(11)
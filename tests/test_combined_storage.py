@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pytest
+from combined_storage import INT32_MAX, encode_prices, to_columnar
+
+def test_encode_prices_int32_limit():
+    """El máximo con 5 decimales es INT32_MAX / 1e5; un precio mayor o con más decimales es un error."""
+    limit = INT32_MAX / 10 ** 5
+    np.testing.assert_array_equal(encode_prices(pd.Series([1.08123, limit]), 5), [108123, INT32_MAX])
+    assert encode_prices(pd.Series([limit]), 5).dtype == np.int32
+    with pytest.raises(ValueError):
+        encode_prices(pd.Series([limit + 1e-5]), 5)
+    with pytest.raises(ValueError):
+        encode_prices(pd.Series([1.081234]), 5)
+    np.testing.assert_array_equal(encode_prices(pd.Series([30000.125]), 3), [30000125])
+
+def test_columnar_codes_mark_missing_phase():
+    """Las barras sin fase se guardan con código -1 (de ahí int8 con signo)."""
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2021-01-01', periods=3, freq='min', tz='UTC'),
+        'open': 1.1, 'high': 1.1, 'low': 1.1, 'close': 1.1, 'volume': 1,
+        'lunar_phase': [None, 'Luna Nueva', 'Luna Nueva'], 'period': 'post', 'lunar_angle': 0.0
+    })
+    columnar = to_columnar(df, 5)
+    assert columnar['lunar_phase'].cat.codes.dtype == np.int8
+    np.testing.assert_array_equal(columnar['lunar_phase'].cat.codes, [-1, 0, 0])
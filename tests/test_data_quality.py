@@ -0,0 +1,76 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+from calculate_lunar_phases import localize_to_utc
+from data_quality import QualityScan, RepeatedHours, save_quality
+from phase_tagging import to_epoch_ns
+
+BERLIN = pytz.timezone('Europe/Berlin')
+
+def berlin_bars():
+    """Barras M1 en hora de Berlín alrededor de los cambios de horario de 2020-10-25 y 2021-03-28, más una hora inexistente."""
+    utc = pd.date_range('2020-10-24 22:00', '2020-10-25 03:00', freq='min', tz='UTC').append(
+        pd.date_range('2021-03-27 23:00', '2021-03-28 03:00', freq='min', tz='UTC'))
+    local = utc.tz_convert(BERLIN).tz_localize(None)
+    nonexistent = int(np.flatnonzero(local == pd.Timestamp('2021-03-28 03:00'))[0])
+    local = local.insert(nonexistent, pd.Timestamp('2021-03-28 02:30'))
+    return pd.Series(local), to_epoch_ns(utc)
+
+def localize_in_chunks(local, chunk_size):
+    quality = QualityScan()
+    chunks = [local] if chunk_size <= 0 else [local.iloc[i:i + chunk_size] for i in range(0, len(local), chunk_size)]
+    utc = pd.concat([localize_to_utc(chunk, BERLIN, quality) for chunk in chunks])
+    return to_epoch_ns(utc.dropna()), quality
+
+@pytest.mark.parametrize('chunk_size', [0, 1, 60, 150, 180])
+def test_chunked_dst_matches_in_memory(chunk_size):
+    """La hora repetida se resuelve igual aunque un bloque la corte (FINANCIAL_CHUNK_SIZE)."""
+    local, expected = berlin_bars()
+    utc_ns, quality = localize_in_chunks(local, chunk_size)
+    np.testing.assert_array_equal(utc_ns, expected)
+    assert quality.counts['dst_ambiguous'] == 120
+    assert quality.counts['dst_nonexistent'] == 1
+
+def test_single_bar_rule_matches_blocks():
+    """is_dst_one (modo en vivo) da lo mismo que is_dst por bloques."""
+    local, _ = berlin_bars()
+    local = local[local != pd.Timestamp('2021-03-28 02:30')]
+    candidates = to_epoch_ns(local.dt.tz_localize(BERLIN, ambiguous=np.ones(len(local), dtype=bool)))
+    ambiguous = local.dt.tz_localize(BERLIN, ambiguous='NaT').isna().to_numpy()
+    single = RepeatedHours()
+    expected = RepeatedHours().is_dst(candidates, ambiguous)
+    np.testing.assert_array_equal([single.is_dst_one(int(ns), bool(a)) for ns, a in zip(candidates, ambiguous)], expected)
+
+def defective_frame():
+    """Barras M1 con defectos conocidos: dos sesiones, un duplicado, high < low, open fuera del rango, un desorden y un hueco de 4 minutos."""
+    minutes = [0, 1, 2, 2, 3, 4, 5, 6, 8, 7, 9, 14, 15, 16, 80, 81, 82]
+    timestamps_ns = pd.Timestamp('2021-03-01', tz='UTC').value + np.array(minutes, dtype=np.int64) * 60 * 10**9
+    close = np.full(len(minutes), 1.1)
+    high, low, open_ = close + 0.001, close - 0.001, close.copy()
+    high[5], low[5] = low[5], high[5]
+    open_[7] = 1.2
+    return timestamps_ns, open_, high, low, close
+
+@pytest.mark.parametrize('drop_invalid', [False, True])
+def test_quality_report_counts(tmp_path, drop_invalid):
+    """data_quality.json y sessions.parquet cuentan exactamente los defectos de defective_frame()."""
+    quality = QualityScan(session_gap_minutes=30, drop_invalid=drop_invalid)
+    timestamps_ns, *prices = defective_frame()
+    rows = quality.scan(timestamps_ns, *prices)
+    save_quality(quality, str(tmp_path))
+    with open(tmp_path / 'data_quality.json', encoding='utf-8') as f:
+        report = json.load(f)
+    kept = len(timestamps_ns) - 2 if drop_invalid else len(timestamps_ns)
+    # Descartar la barra con high < low (minuto 4) deja un minuto faltante más
+    missing = 5 if drop_invalid else 4
+    assert {key: report[key] for key in ['rows_in', 'rows_out', 'rows_dropped', 'duplicates', 'out_of_order', 'high_below_low',
+                                         'open_close_outside_range', 'missing_minutes', 'sessions', 'max_gap_minutes_within_session']} == {
+        'rows_in': 17, 'rows_out': kept, 'rows_dropped': 17 - kept, 'duplicates': 1, 'out_of_order': 1, 'high_below_low': 1,
+        'open_close_outside_range': 1, 'missing_minutes': missing, 'sessions': 2, 'max_gap_minutes_within_session': 5}
+    assert report['drop_invalid_bars'] is drop_invalid
+    sessions = pd.read_parquet(tmp_path / 'sessions.parquet')
+    assert sessions['bars'].tolist() == [kept - 3, 3]
+    assert sessions['missing_minutes'].tolist() == [missing, 0]
+    assert len(rows) == kept and np.all(np.diff(timestamps_ns[rows]) >= 0)
@@ -0,0 +1,37 @@
+import numpy as np
+from event_study import event_paths
+from phase_tagging import NS_PER_MINUTE
+
+T0 = np.datetime64('2021-06-01T00:00', 'ns').astype(np.int64)
+
+def minutes(values):
+    return T0 + np.asarray(values, dtype=np.int64) * NS_PER_MINUTE
+
+def test_event_paths_known_prices():
+    """Rejilla ±3 min con 4 min de estimación sobre barras en los minutos 0-6, 8-13 y 30-45."""
+    bar_minutes = list(range(0, 7)) + list(range(8, 14)) + list(range(30, 46))
+    log_close = np.array([0.0, 0.1, 0.2, 0.3, 0.4, 1.0, 1.3, 1.1, 1.15, 1.0, 1.2, 1.25, 1.3]
+                         + [2.0 + 0.01 * k for k in range(16)])
+    # Eventos: minuto 8 (falta el 7), 27 (en el hueco), 2 y 44 (sin datos suficientes en los bordes) y 42 (justo en el borde final)
+    events = minutes([8, 27, 2, 44, 42])
+    offsets, abnormal, traded, covered = event_paths(minutes(bar_minutes), log_close, events, 3, 1, 4)
+
+    np.testing.assert_array_equal(offsets, [-3, -2, -1, 0, 1, 2, 3])
+    np.testing.assert_array_equal(covered, [True, True, False, False, True])
+
+    # Minuto 8: la rejilla 4..11 usa el cierre del minuto 6 para el 7 (as-of), así que ese paso no tiene barra;
+    # retorno normal (0.4 - 0.0) / 4 barras de estimación = 0.1 por barra
+    np.testing.assert_allclose(abnormal[0], [0.5, 0.2, 0.0, -0.3, -0.05, -0.25, 0.1], atol=1e-12)
+    np.testing.assert_array_equal(traded[0], [True, True, False, True, True, True, True])
+    # Minuto 27: la estimación (19) y el inicio de la rejilla (23) caen en la misma barra (minuto 13):
+    # estimation_bars == 0, retorno normal 0 y sólo el último paso (minuto 30) tiene barra
+    np.testing.assert_allclose(abnormal[1], [0, 0, 0, 0, 0, 0, 0.7], atol=1e-12)
+    np.testing.assert_array_equal(traded[1], [False] * 6 + [True])
+    # Minuto 42: la rejilla termina en la última barra (45); retornos iguales al normal (0.01 por barra)
+    np.testing.assert_allclose(abnormal[4], np.zeros(7), atol=1e-12)
+    assert traded[4].all()
+
+def test_event_paths_without_bars():
+    """Sin barras ningún evento está cubierto."""
+    _, abnormal, _, covered = event_paths(np.array([], dtype=np.int64), np.array([]), minutes([10, 20]), 3, 1, 4)
+    assert not covered.any() and abnormal.shape == (2, 7)
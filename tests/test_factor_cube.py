@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark_metrics import synthetic_combined
+from factor_cube import QUANTILES, build_factor_cubes, factor_statistics
+from settings import settings
+
+@pytest.fixture
+def bars(monkeypatch):
+    """Unas semanas M1 sintéticas con algunas barras sin fase (se excluyen de todas las celdas)."""
+    monkeypatch.setattr(settings, 'RETURN_GAP_MINUTES', 0)
+    monkeypatch.setattr(settings, 'RESET_RETURNS_AT_SESSIONS', False)
+    df = synthetic_combined(0.1, seed=4)
+    df.loc[1000:1100, 'lunar_phase'] = np.nan
+    return df
+
+def groupby_statistics(df, factors):
+    """Referencia con pandas: retorno log por barra y groupby por los factores (sin las barras que no tienen celda en el cubo)."""
+    frame = pd.DataFrame({'lunar_phase': df['lunar_phase'], 'period': df['period'], 'hour': df['timestamp'].dt.hour,
+                          'return': np.log(df['close'] / df['close'].shift(1))}).dropna(subset=['return', 'lunar_phase', 'period'])
+    grouped = frame.groupby(factors, observed=True)['return']
+    expected = grouped.agg(['count', 'mean', 'std'])
+    for name, q in QUANTILES.items():
+        expected[name] = grouped.quantile(q)
+    return expected.reset_index()
+
+@pytest.mark.parametrize('factors', [['lunar_phase', 'hour'], ['lunar_phase', 'period'], ['hour']])
+def test_marginal_matches_groupby(bars, factors):
+    """FactorCube.marginal sobre el cubo de cinco factores da los momentos y cuantiles de un groupby sobre las barras."""
+    cube = build_factor_cubes(bars, ['lunar_phase', 'period', 'weekday', 'hour', 'session'])['return']
+    result = cube.marginal(factors).frame()
+    expected = groupby_statistics(bars, factors)
+    assert len(result) == len(expected)
+    for factor in factors:
+        np.testing.assert_array_equal(result[factor].astype(str), expected[factor].astype(str))
+    np.testing.assert_array_equal(result['count'], expected['count'])
+    for column in ['mean', 'std'] + list(QUANTILES):
+        np.testing.assert_allclose(result[column], expected[column], rtol=1e-9, atol=1e-15, err_msg=column)
+
+def test_factor_statistics_marginal_rows(bars):
+    """Las filas lunar_phase×hour de factor_statistics son las del marginal (hour vacío en las demás)."""
+    cubes = build_factor_cubes(bars, ['lunar_phase', 'period', 'weekday', 'hour', 'session'])
+    stats_df = factor_statistics(cubes, [['lunar_phase', 'hour']])
+    rows = stats_df[(stats_df['factors'] == 'lunar_phase×hour') & (stats_df['value'] == 'return')]
+    expected = groupby_statistics(bars, ['lunar_phase', 'hour'])
+    np.testing.assert_array_equal(rows['hour'].to_numpy(dtype=np.int64), expected['hour'].to_numpy())
+    np.testing.assert_allclose(rows['median'], expected['median'], rtol=1e-9)
+    assert rows['period'].isna().all() and rows['weekday'].isna().all()
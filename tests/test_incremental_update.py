@@ -0,0 +1,85 @@
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+import calculate_lunar_phases as phases
+from combined_storage import read_combined
+from incremental_update import TAIL_BYTES, IncrementalState, appended_only, file_tail_hash, run_incremental
+from settings import settings
+
+PHASES = pd.DataFrame({'TimestampUTC': pd.to_datetime(['2021-03-01 00:00', '2021-03-02 14:23', '2021-03-04 03:05'], utc=True),
+                       'PhaseName': ['Luna Nueva', 'Creciente Cóncava', 'Cuarto Creciente']})
+
+def m1_lines():
+    """Cinco días de barras M1 UTC con huecos cortos, un hueco de una hora y un cambio de período el día 3."""
+    stamps = pd.date_range('2021-03-01 00:00', '2021-03-05 23:59', freq='min')
+    stamps = stamps[(stamps < '2021-03-03 10:00') | (stamps >= '2021-03-03 11:00')].delete(np.arange(100, 5000, 97))
+    rng = np.random.default_rng(11)
+    close = 1.2 * np.exp(np.cumsum(rng.normal(0, 2e-4, len(stamps))))
+    return [f"{stamp:%Y.%m.%d},{stamp:%H:%M},{price:.5f},{price + 1e-4:.5f},{price - 1e-4:.5f},{price:.5f},1"
+            for stamp, price in zip(stamps, close)]
+
+@pytest.fixture
+def configured(monkeypatch):
+    monkeypatch.setattr(phases, 'generate_lunar_phase_changes', lambda: PHASES)
+    monkeypatch.setattr(phases, 'phase_cache_key', lambda: 'test')
+    monkeypatch.setattr(settings, 'FINANCIAL_DATA_TIMEZONE', 'UTC')
+    monkeypatch.setattr(settings, 'EXPORT_COMBINED_CSV', False)
+    monkeypatch.setattr(settings, 'FINANCIAL_CHUNK_SIZE', 700)
+    monkeypatch.setattr(settings, 'period_cuts_ns', np.array([pd.Timestamp('2021-03-03 12:00', tz='UTC').value]))
+    monkeypatch.setattr(settings, 'period_labels', ['antes', 'después'])
+
+def write_csv(path, lines):
+    path.write_text('date,time,open,high,low,close,volume\n' + ''.join(line + '\n' for line in lines))
+
+@pytest.mark.parametrize('gap_minutes, reset_sessions', [(0, False), (5, False), (0, True)])
+def test_appends_match_full_rebuild(tmp_path, monkeypatch, caplog, configured, gap_minutes, reset_sessions):
+    """Arranque más varias ampliaciones (cortando a mitad de día) dan los mismos acumuladores que una reconstrucción completa."""
+    monkeypatch.setattr(settings, 'RETURN_GAP_MINUTES', gap_minutes)
+    monkeypatch.setattr(settings, 'RESET_RETURNS_AT_SESSIONS', reset_sessions)
+    caplog.set_level(logging.INFO)
+    lines = m1_lines()
+    csv_path = tmp_path / 'bars.csv'
+    for end in [1500, 1501, 2600, 4100, len(lines)]:
+        write_csv(csv_path, lines[:end])
+        incremental = run_incremental(str(csv_path), str(tmp_path / 'incremental'), str(tmp_path / 'state'))
+    # Todas las ampliaciones se leen desde el offset guardado
+    assert caplog.text.count('desde el byte') == 4 and 'se relee completo' not in caplog.text
+    full = run_incremental(str(csv_path), str(tmp_path / 'full'), str(tmp_path / 'full_state'), reset=True)
+    pd.testing.assert_frame_equal(read_combined(str(tmp_path / 'incremental')), read_combined(str(tmp_path / 'full')))
+
+    pd.testing.assert_frame_equal(incremental, full, check_exact=False, rtol=1e-9)
+    appended = IncrementalState(str(tmp_path / 'state')).load()
+    rebuilt = IncrementalState(str(tmp_path / 'full_state')).load()
+    assert appended.accumulators.keys() == rebuilt.accumulators.keys()
+    for key, accumulator in rebuilt.accumulators.items():
+        other = appended.accumulators[key]
+        assert (other.n, other.volatility_n, other.bars) == (accumulator.n, accumulator.volatility_n, accumulator.bars)
+        np.testing.assert_allclose([other.mean, other.m2, other.volatility_sum],
+                                   [accumulator.mean, accumulator.m2, accumulator.volatility_sum], rtol=1e-9, atol=1e-18)
+    assert appended.watermark == rebuilt.watermark
+    pd.testing.assert_frame_equal(appended.pending, rebuilt.pending)
+
+def test_tail_hash_detects_rewritten_tail(tmp_path):
+    """Ampliar el CSV conserva el hash del tramo leído; reescribir una barra del final (o truncar) no."""
+    lines = m1_lines()[:300]
+    csv_path = tmp_path / 'bars.csv'
+    write_csv(csv_path, lines)
+    state = IncrementalState(str(tmp_path / 'state'))
+    state.source = str(csv_path.resolve())
+    state.offset = csv_path.stat().st_size
+    state.tail_hash = file_tail_hash(str(csv_path), state.offset)
+    assert appended_only(state, str(csv_path))
+
+    write_csv(csv_path, lines + m1_lines()[300:320])
+    assert appended_only(state, str(csv_path))
+
+    # Mismo tamaño, cambia el cierre de la última barra ya leída (dentro de TAIL_BYTES)
+    rewritten = lines[:-1] + [lines[-1][:-3] + ('9' if lines[-1][-3] != '9' else '8') + lines[-1][-2:]] + m1_lines()[300:320]
+    assert len(lines[-1]) < TAIL_BYTES
+    write_csv(csv_path, rewritten)
+    assert csv_path.stat().st_size > state.offset
+    assert not appended_only(state, str(csv_path))
+
+    write_csv(csv_path, lines[:-5])
+    assert not appended_only(state, str(csv_path))
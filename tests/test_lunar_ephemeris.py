@@ -0,0 +1,30 @@
+import os
+import numpy as np
+from lunar_ephemeris import CHEB_DEGREE, LunarElongation, check_accuracy
+from phase_tagging import NS_PER_DAY
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_interpolation_matches_swiss_ephemeris(monkeypatch):
+    """Cotas documentadas en 2018-2024: elongación frente a swe.calc_ut e iluminación frente a swe.pheno_ut."""
+    monkeypatch.chdir(REPO_ROOT)  # EPHE_PATH por defecto es relativo a la raíz
+    result = check_accuracy('2018-01-01', '2025-01-01', samples=1000)
+    assert result['max_elongation_error_deg'] < 5e-7
+    assert result['max_illumination_error'] < 1e-8
+    assert result['max_pheno_illumination_error'] < 2e-3
+
+def test_cache_keeps_at_most_max_days(monkeypatch):
+    """Con max_days pequeño la caché descarta los días más antiguos y los resultados no cambian."""
+    monkeypatch.chdir(REPO_ROOT)
+    timestamps_ns = np.arange(np.datetime64('2021-03-01', 'ns').astype(np.int64),
+                              np.datetime64('2021-03-11', 'ns').astype(np.int64), NS_PER_DAY // 7)
+    unbounded = LunarElongation()
+    bounded = LunarElongation(max_days=4)
+    expected = unbounded.elongation(timestamps_ns)
+    # Una petición mayor que la caché sigue siendo correcta
+    np.testing.assert_array_equal(bounded.elongation(timestamps_ns), expected)
+    first_day = timestamps_ns[0] // NS_PER_DAY
+    assert sorted(bounded._coeffs) == list(range(first_day + 6, first_day + 10))
+    np.testing.assert_array_equal(bounded.day_coefficients(first_day, first_day + 1), unbounded.day_coefficients(first_day, first_day + 1))
+    assert list(bounded._coeffs) == [first_day + 8, first_day + 9, first_day, first_day + 1]
+    assert bounded.calc_ut_calls == unbounded.calc_ut_calls + 2 * 2 * (CHEB_DEGREE + 1)
@@ -0,0 +1,30 @@
+import os
+from datetime import datetime, timezone
+import pandas as pd
+import pytest
+from lunar_events import EVENT_TYPES, compute_events, compute_shard, events_frame, stitch_shards
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_stitch_drops_boundary_duplicates():
+    """La fila de estado inicial de un tramo se descarta salvo que el cambio caiga justo en el límite."""
+    boundary = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    first = events_frame({'ingress': [(datetime(2020, 12, 1, tzinfo=timezone.utc), 3), (datetime(2020, 12, 20, tzinfo=timezone.utc), 4)],
+                          'eclipse': [(datetime(2020, 12, 14, tzinfo=timezone.utc), 0)]})
+    # El segundo tramo empieza en el mismo signo (fila repetida) y el tercero con un cambio exactamente en el límite
+    second = events_frame({'ingress': [(boundary, 4), (datetime(2021, 1, 10, tzinfo=timezone.utc), 5)]})
+    third = events_frame({'ingress': [(datetime(2022, 1, 1, tzinfo=timezone.utc), 6)]})
+    events = stitch_shards([first, second, third])
+    assert events['EventName'].astype(str).tolist() == ['Cáncer', 'Eclipse solar total', 'Leo', 'Virgo', 'Libra']
+    assert events['TimestampUTC'].is_monotonic_increasing
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_compute_events_matches_single_shard(monkeypatch, workers):
+    """Por años con 1 o 4 procesos la tabla es la del cálculo de todo el rango en un solo tramo."""
+    monkeypatch.chdir(REPO_ROOT)  # EPHE_PATH por defecto es relativo a la raíz
+    range_start = datetime(2019, 10, 15, tzinfo=timezone.utc)
+    range_end = datetime(2022, 2, 15, tzinfo=timezone.utc)
+    events = compute_events(range_start, range_end, workers=workers)
+    pd.testing.assert_frame_equal(events, compute_shard(range_start, range_end))
+    assert not events.duplicated(['TimestampUTC', 'EventType']).any()
+    assert set(events['EventType']) == set(EVENT_TYPES)
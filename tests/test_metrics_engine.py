@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark_metrics import PERIOD_LABELS, PHASE_NAMES_ES, legacy_metrics, synthetic_combined
+from metrics_engine import daily_metrics_frame
+from phase_tagging import NS_PER_DAY, NS_PER_MINUTE, to_epoch_ns
+
+COLUMNS = ['mean_return', 'volatility', 'high', 'low', 'count', 'range', 'mean_abs_return', 'realized_variance']
+
+def groupby_metrics(df, gap_ns=None, session_starts_ns=None):
+    """Referencia con pandas: retornos con shift, NaN tras huecos e inicios de sesión, y groupby por día, fase y período."""
+    df = df.copy()
+    df['return'] = np.log(df['close'] / df['close'].shift(1))
+    timestamps_ns = to_epoch_ns(df['timestamp'])
+    if gap_ns is not None:
+        df.loc[np.diff(timestamps_ns, prepend=timestamps_ns[0]) > gap_ns, 'return'] = np.nan
+    if session_starts_ns is not None:
+        df.loc[np.isin(timestamps_ns, session_starts_ns), 'return'] = np.nan
+    df['abs_return'] = df['return'].abs()
+    df['squared_return'] = df['return'] ** 2
+    df['date'] = df['timestamp'].dt.tz_localize(None).dt.normalize()
+    grouped = df.groupby(['date', 'lunar_phase', 'period'], observed=True)
+    expected = grouped.agg(mean_return=('return', 'mean'), volatility=('return', 'std'), high=('high', 'max'),
+                           low=('low', 'min'), count=('timestamp', 'count'), mean_abs_return=('abs_return', 'mean'))
+    expected['range'] = expected['high'] - expected['low']
+    expected['realized_variance'] = grouped['squared_return'].sum(min_count=1)
+    return expected.reset_index()
+
+def edge_case_frame():
+    """Tres días de barras cada 10 minutos: sin fase al principio, un cambio de fase en la última barra de un día, un cambio de período y un hueco."""
+    start = np.datetime64('2021-12-30', 'ns').astype(np.int64)
+    timestamps_ns = np.arange(start, start + 3 * NS_PER_DAY, 10 * NS_PER_MINUTE)
+    timestamps_ns = np.delete(timestamps_ns, np.arange(296, 300))  # hueco de 50 minutos el tercer día (antes de la fila 296)
+    n = len(timestamps_ns)
+    phase_codes = np.where(timestamps_ns < start + NS_PER_DAY - 10 * NS_PER_MINUTE, 2, 3)  # (día 1, fase 3): una barra
+    phase_codes[timestamps_ns >= start + NS_PER_DAY + 5 * 3600 * 10 ** 9] = 4
+    phase_codes[:3] = -1  # antes de la tabla de fases: se descartan como con groupby
+    cut = np.datetime64('2022-01-01', 'ns').astype(np.int64)
+    rng = np.random.default_rng(3)
+    close = 1.1 * np.exp(np.cumsum(rng.normal(0, 1e-4, n)))
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(timestamps_ns, unit='ns', utc=True),
+        'high': close + 1e-4,
+        'low': close - 1e-4,
+        'close': close,
+        'lunar_phase': pd.Categorical.from_codes(phase_codes, categories=PHASE_NAMES_ES),
+        'period': pd.Categorical.from_codes((timestamps_ns >= cut).astype(int), categories=PERIOD_LABELS)
+    })
+
+def assert_matches(result, expected):
+    assert len(result) == len(expected)
+    np.testing.assert_array_equal(result['date'].to_numpy(), expected['date'].to_numpy())
+    for key in ['lunar_phase', 'period']:
+        np.testing.assert_array_equal(result[key].astype(str), expected[key].astype(str))
+    for col in COLUMNS:
+        np.testing.assert_allclose(result[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), rtol=1e-9, atol=0,
+                                   equal_nan=True, err_msg=col)
+
+def test_segment_metrics_match_legacy_groupby():
+    """Motor por tramos frente a la implementación groupby anterior (la del benchmark) en unas semanas sintéticas."""
+    df = synthetic_combined(0.1)
+    result = daily_metrics_frame(df)
+    expected = legacy_metrics(df)
+    expected['date'] = pd.to_datetime(expected['date'])
+    for col in ['mean_return', 'volatility', 'high', 'low', 'count', 'range']:
+        np.testing.assert_allclose(result[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), rtol=1e-9,
+                                   atol=0, equal_nan=True, err_msg=col)
+    np.testing.assert_array_equal(result['date'].to_numpy(), expected['date'].to_numpy())
+
+@pytest.mark.parametrize('resets', ['none', 'gap', 'sessions'])
+def test_segment_metrics_edge_cases(resets):
+    """Tramos de una barra (volatilidad NaN), barras sin fase y retornos anulados por huecos o inicios de sesión."""
+    df = edge_case_frame()
+    timestamps_ns = to_epoch_ns(df['timestamp'])
+    gap_ns = 30 * NS_PER_MINUTE if resets == 'gap' else None
+    # Sesiones: al principio, al empezar el año y tras el hueco
+    session_starts_ns = timestamps_ns[[0, 288, 296]] if resets == 'sessions' else None
+    result = daily_metrics_frame(df, gap_ns=gap_ns, session_starts_ns=session_starts_ns)
+    assert_matches(result, groupby_metrics(df, gap_ns, session_starts_ns))
+
+    single = result[(result['lunar_phase'] == PHASE_NAMES_ES[3]) & (result['date'] == pd.Timestamp('2021-12-30'))]
+    assert single['count'].tolist() == [1] and single['volatility'].isna().all() and single['mean_return'].notna().all()
+    assert result['count'].sum() == len(df) - 3
+    # En el tercer día la media excluye exactamente los retornos anulados
+    returns = np.log(df['close'] / df['close'].shift(1)).to_numpy()
+    day_rows = np.zeros(len(df), dtype=bool)
+    day_rows[288:] = True
+    if resets != 'none':
+        day_rows[296] = False
+    if resets == 'sessions':
+        day_rows[288] = False
+    third_day = result[result['date'] == pd.Timestamp('2022-01-01')]
+    assert third_day['mean_return'].iloc[0] == pytest.approx(returns[day_rows].mean(), rel=1e-9)
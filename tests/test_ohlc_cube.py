@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from analyze_lunar_phases import calculate_metrics, load_data
+from calculate_lunar_phases import combine_financial_data
+from combined_storage import combined_years
+from ohlc_cube import RESOLUTIONS, build_cube, cube_metrics_frame, read_cube
+from settings import settings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def m1_lines():
+    """Barras M1 UTC del 2020-12-30 20:00 al 2021-01-01 06:00 con un hueco de 40 minutos y algunos minutos sueltos sin barra."""
+    stamps = pd.date_range('2020-12-30 20:00', '2021-01-01 06:00', freq='min')
+    stamps = stamps[(stamps < '2020-12-31 09:10') | (stamps >= '2020-12-31 09:50')].delete([5, 6, 700])
+    rng = np.random.default_rng(5)
+    close = 1.2 * np.exp(np.cumsum(rng.normal(0, 2e-4, len(stamps))))
+    return [f"{stamp:%Y.%m.%d},{stamp:%H:%M},{price:.5f},{price + 1e-4:.5f},{price - 1e-4:.5f},{price:.5f},{i % 7 + 1}"
+            for i, (stamp, price) in enumerate(zip(stamps, close))]
+
+@pytest.fixture
+def combined(tmp_path, monkeypatch):
+    """Dataset combinado con cambios de fase a mitad de una barra H1 y de una H4 y partido en los años 2020 y 2021."""
+    monkeypatch.chdir(REPO_ROOT)  # EPHE_PATH por defecto es relativo a la raíz
+    csv_path = tmp_path / 'bars.csv'
+    csv_path.write_text('date,time,open,high,low,close,volume\n' + '\n'.join(m1_lines()) + '\n')
+    phases = pd.DataFrame({'TimestampUTC': pd.to_datetime(['2020-12-20 00:00', '2020-12-31 13:17', '2021-01-01 02:30'], utc=True),
+                           'PhaseName': ['Luna Nueva', 'Cuarto Creciente', 'Luna Llena']})
+    monkeypatch.setattr(settings, 'FINANCIAL_DATA_TIMEZONE', 'UTC')
+    monkeypatch.setattr(settings, 'EXPORT_COMBINED_CSV', False)
+    monkeypatch.setattr(settings, 'start_date', pd.Timestamp('2020-01-01', tz='UTC').to_pydatetime())
+    monkeypatch.setattr(settings, 'end_date', pd.Timestamp('2021-12-31', tz='UTC').to_pydatetime())
+    combine_financial_data(str(csv_path), str(tmp_path), df_phases=phases)
+    return str(tmp_path)
+
+@pytest.mark.parametrize('gap_minutes, reset_sessions', [(0, False), (5, False), (0, True)])
+def test_cube_metrics_match_m1(combined, monkeypatch, gap_minutes, reset_sessions):
+    """Las métricas de cada resolución del cubo son las calculadas directamente desde M1."""
+    monkeypatch.setattr(settings, 'RETURN_GAP_MINUTES', gap_minutes)
+    monkeypatch.setattr(settings, 'RESET_RETURNS_AT_SESSIONS', reset_sessions)
+    assert combined_years(combined) == [2020, 2021]
+    build_cube(combined)
+    m1 = load_data(input_dir=combined)
+    base = read_cube(combined, 'M5', rebuild=False)
+    for resolution in ['H1', 'H4', 'D1']:
+        expected = calculate_metrics(m1, resolution=resolution)
+        from_level = calculate_metrics(read_cube(combined, resolution, rebuild=False))
+        from_base = cube_metrics_frame(base, RESOLUTIONS[resolution])
+        for result in (from_level, from_base):
+            pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9, atol=1e-15)
+
+    hourly = calculate_metrics(m1, resolution='H1').set_index('date')
+    # Barras partidas por el cambio de fase: 13:00 (H1) y 00:00-04:00 (H4, primer día del año)
+    assert hourly.loc['2020-12-31 13:00', 'lunar_phase'].astype(str).tolist() == ['Luna Nueva', 'Cuarto Creciente']
+    assert hourly.loc['2020-12-31 13:00', 'count'].tolist() == [17, 43]
+    four_hour = calculate_metrics(m1, resolution='H4').set_index('date')
+    assert four_hour.loc['2021-01-01 00:00', 'lunar_phase'].astype(str).tolist() == ['Cuarto Creciente', 'Luna Llena']
+    # El primer retorno de 2021 se encadena con la última barra de 2020
+    first_bar = read_cube(combined, 'H1', rebuild=False).set_index('timestamp').loc['2021-01-01 00:00']
+    assert first_bar['count'] == first_bar['return_count'] == 60
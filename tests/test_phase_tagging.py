@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from phase_tagging import codes_to_labels, phase_boundaries, tag_intervals, tag_periods, to_epoch_ns
+from settings import Settings
+
+PHASE_NAMES = ['Luna Nueva', 'Cuarto Creciente', 'Luna Llena', 'Cuarto Menguante']
+PERIOD_LABELS = ['pre-pandemia', 'pandemia', 'pos-pandemia']
+
+def legacy_phases(timestamps, df_phases):
+    """Asignación anterior: una máscara .loc por intervalo [inicio, fin) y la última fase abierta."""
+    df = pd.DataFrame({'timestamp': timestamps, 'lunar_phase': None})
+    for i in range(len(df_phases) - 1):
+        mask = (df['timestamp'] >= df_phases['TimestampUTC'].iloc[i]) & (df['timestamp'] < df_phases['TimestampUTC'].iloc[i + 1])
+        df.loc[mask, 'lunar_phase'] = df_phases['PhaseName'].iloc[i]
+    df.loc[df['timestamp'] >= df_phases['TimestampUTC'].iloc[-1], 'lunar_phase'] = df_phases['PhaseName'].iloc[-1]
+    return df['lunar_phase']
+
+def legacy_periods(timestamps, pre_pandemic_end, pandemic_end):
+    """Asignación anterior fila a fila con PANDEMIC_END inclusivo."""
+    def assign_period(timestamp):
+        if timestamp < pre_pandemic_end:
+            return 'pre-pandemia'
+        elif timestamp <= pandemic_end:
+            return 'pandemia'
+        return 'pos-pandemia'
+    return timestamps.apply(assign_period)
+
+def test_tagging_matches_legacy_loop(monkeypatch):
+    """Búsqueda binaria y bucle .loc coinciden, también justo en los límites de fase y en PANDEMIC_END."""
+    monkeypatch.setenv('PRE_PANDEMIC_END', '2020-03-01')
+    monkeypatch.setenv('PANDEMIC_END', '2021-12-31')
+    monkeypatch.setenv('PERIOD_CUTS', '')
+    monkeypatch.setenv('PERIOD_LABELS', ','.join(PERIOD_LABELS))
+    settings = Settings()
+    df_phases = pd.DataFrame({
+        'TimestampUTC': pd.to_datetime(['2020-02-23 15:32', '2020-03-02 19:57', '2021-12-04 07:43',
+                                        '2021-12-11 01:35', '2021-12-31 00:00'], utc=True),
+        'PhaseName': ['Luna Nueva', 'Cuarto Creciente', 'Luna Nueva', 'Cuarto Creciente', 'Luna Llena']
+    })
+    one_ns = pd.Timedelta(1, 'ns')
+    edges = pd.DatetimeIndex(df_phases['TimestampUTC']).append(
+        pd.DatetimeIndex([settings.pre_pandemic_end, settings.pandemic_end]))
+    timestamps = pd.Series(pd.date_range('2020-02-20', '2022-01-02', freq='37min', tz='UTC')
+                           .append(edges).append(edges - one_ns).append(edges + one_ns)
+                           .append(pd.DatetimeIndex(['2019-12-31 23:59'], tz='UTC'))
+                           .sort_values())
+
+    boundaries_ns, codes = phase_boundaries(df_phases, PHASE_NAMES)
+    timestamps_ns = to_epoch_ns(timestamps)
+    phases = codes_to_labels(tag_intervals(timestamps_ns, boundaries_ns, codes), PHASE_NAMES)
+    periods = codes_to_labels(tag_periods(timestamps_ns, settings.period_cuts_ns), settings.period_labels)
+
+    expected_phases = legacy_phases(timestamps, df_phases)
+    expected_periods = legacy_periods(timestamps, settings.pre_pandemic_end, settings.pandemic_end)
+    # Sin fase: NaN en la categórica, None en el bucle anterior
+    np.testing.assert_array_equal(pd.Series(phases).astype(object).fillna('').to_numpy(), expected_phases.fillna('').to_numpy(dtype=object))
+    np.testing.assert_array_equal(np.asarray(periods, dtype=object), expected_periods.to_numpy())
+    assert pd.isna(phases[0]) and expected_phases.iloc[0] is None
+    # PANDEMIC_END exacto sigue siendo pandemia; 1 ns después empieza pos-pandemia
+    at_end = timestamps_ns == to_epoch_ns(pd.DatetimeIndex([settings.pandemic_end]))[0]
+    assert list(periods[at_end]) == ['pandemia'] * int(at_end.sum())
+    assert periods[np.flatnonzero(at_end)[-1] + 1] == 'pos-pandemia'
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+import resampling
+from resampling import resampling_tests
+
+def synthetic_samples():
+    """Dos muestras con 8 fases y 60 días; la segunda con efecto de fase."""
+    rng = np.random.default_rng(0)
+    samples = {}
+    for key, shift in [('flat', 0.0), ('shifted', 0.3)]:
+        codes = rng.integers(0, 8, 1500)
+        samples[key] = (rng.normal(size=1500) + shift * (codes == 3), codes, np.sort(rng.integers(0, 60, 1500)))
+    return samples
+
+@pytest.mark.parametrize('max_batch_rows', [resampling.MAX_BATCH_ROWS, 4000])
+def test_resampling_tests_do_not_depend_on_workers(monkeypatch, max_batch_rows):
+    """Con la misma semilla los p-valores e intervalos son idénticos con 1 y 3 procesos (y con tramos de bootstrap pequeños)."""
+    samples = synthetic_samples()
+    expected = resampling_tests(samples, n_permutations=2500, n_bootstrap=1200, block_days=5, seed=7, workers=1)
+    monkeypatch.setattr(resampling, 'MAX_BATCH_ROWS', max_batch_rows)
+    assert resampling_tests(samples, n_permutations=2500, n_bootstrap=1200, block_days=5, seed=7, workers=3) == expected
+    assert expected['shifted']['p_value'] < 0.01 < expected['flat']['p_value']
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+import numpy as np
+import pytest
+import streaming_tagger
+from phase_tagging import NS_PER_DAY
+from streaming_tagger import BarParser, PhaseTable, StreamingTagger
+from test_data_quality import berlin_bars, localize_in_chunks
+
+def test_bar_parser_matches_batch_dst():
+    """BarParser resuelve las horas repetidas como localize_to_utc y rechaza las inexistentes."""
+    local, expected = berlin_bars()
+    parser = BarParser('Europe/Berlin')
+    parsed = []
+    for stamp in local:
+        line = f"{stamp:%Y.%m.%d},{stamp:%H:%M},1.1,1.1,1.1,1.1,1"
+        if stamp.hour == 2 and stamp.month == 3:
+            with pytest.raises(ValueError):
+                parser.parse(line)
+            continue
+        parsed.append(parser.parse(line)[0])
+    np.testing.assert_array_equal(parsed, expected)
+    np.testing.assert_array_equal(parsed, localize_in_chunks(local, 0)[0])
+
+def test_table_miss_builds_in_thread(monkeypatch):
+    """Una barra fuera de la tabla no bloquea el bucle; las que llegan durante la construcción la comparten."""
+    built = []
+
+    def slow_build(start_ns, end_ns):
+        built.append(threading.get_ident())
+        time.sleep(0.2)
+        days = (end_ns - start_ns) // NS_PER_DAY
+        return PhaseTable(start_ns, end_ns, [start_ns], [0], start_ns // NS_PER_DAY, np.zeros((days, 2)))
+    monkeypatch.setattr(streaming_tagger, 'build_phase_table', slow_build)
+
+    async def run():
+        tagger = StreamingTagger(horizon_days=30, refresh_days=7)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        ticking = asyncio.ensure_future(ticker())
+        outputs = await asyncio.gather(tagger.respond('2021.03.01,10:00,1.1,1.1,1.1,1.1,1'),
+                                       tagger.respond('2021.03.01,10:01,1.1,1.1,1.1,1.1,2'))
+        hit = await tagger.respond('2021.03.01,10:02,1.1,1.1,1.1,1.1,3')
+        ticking.cancel()
+        return tagger, outputs, hit, ticks
+
+    tagger, outputs, hit, ticks = asyncio.run(run())
+    assert len(built) == 1 and built[0] != threading.get_ident()
+    assert ticks >= 5
+    assert [line.split(',')[0] for line in outputs + [hit]] == [f'2021-03-01 10:0{i}:00+00:00' for i in range(3)]
+    latency = tagger.report()['latency']
+    assert latency['table_misses'] == 2 and latency['table_miss']['bars'] == 2 and latency['bars'] == 1
+    assert latency['table_miss']['p50_us'] > 100_000 > latency['max_us']